@@ -8,6 +8,7 @@ import sys
 
 from datetime import datetime
 
+from infrastructure import infrastructure
 from resource_manager.kube_kata import kube_kata
 from resource_manager.kubernetes import kubernetes
 from resource_manager.endpoint import endpoint
@@ -244,9 +245,10 @@ def kube(config, machines):
         machines (list(Machine object)): List of machine objects representing physical machines
     """
     # Cache the worker to prevent loading
-    if config["benchmark"]["cache_worker"]:
+    if config["benchmark"]["cache_worker"] and not config["snapshot_restored"]:
         app_vars = config["module"]["application"].cache_worker(config, machines)
         kubernetes.cache_worker(config, machines, app_vars)
+        infrastructure.save_snapshot(config, machines)
 
     # Start the worker
     app_vars = config["module"]["application"].start_worker(config, machines)
@@ -282,13 +284,15 @@ def kube_control(config, machines):
         config (dict): Parsed configuration
         machines (list(Machine object)): List of machine objects representing physical machines
     """
-    # Start the resource utilization metrics
-    kubernetes.start_resource_metrics(config, machines)
-
     # Cache the worker to prevent loading
-    if config["benchmark"]["cache_worker"]:
+    # The snapshot is taken before the metrics start, so restored VMs don't resume stale samplers
+    if config["benchmark"]["cache_worker"] and not config["snapshot_restored"]:
         app_vars = config["module"]["application"].cache_worker(config, machines)
         kubernetes.cache_worker(config, machines, app_vars)
+        infrastructure.save_snapshot(config, machines)
+
+    # Start the resource utilization metrics
+    kubernetes.start_resource_metrics(config, machines)
 
     if config["benchmark"]["application"] == "mem_usage":
         config["module"]["application"].get_mem_usage(config, machines, kubernetes)
@@ -305,7 +309,7 @@ def kube_control(config, machines):
     # Now get raw output
     logging.info("Benchmark has been finished, prepare results")
 
-    worker_output = kubernetes.get_worker_output(config, machines)
+    worker_output = kubernetes.get_worker_output(config, machines, since_time=starttime)
     worker_description = kubernetes.get_worker_output(config, machines, get_description=True)
 
     control_output, endtime = kubernetes.get_control_output(config, machines, starttime, status)
@@ -318,7 +322,7 @@ def kube_control(config, machines):
 
     if "runtime" in config["benchmark"] and "kata" in config["benchmark"]["runtime"]:
         if config["benchmark"]["application"] == "empty_kata":
-            kata_ts = kube_kata.get_kata_timestamps(config, worker_output)
+            kata_ts = kube_kata.get_kata_timestamps(config, starttime, endtime)
             config["module"]["application"].format_output(
                 config,
                 None,
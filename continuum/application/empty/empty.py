@@ -1,14 +1,30 @@
 """Manage the empty application"""
 
+import bisect
 import logging
 import sys
-import copy
 
 from datetime import datetime
 
-import pandas as pd
-
-from . import plot
+from .. import metrics_store
+
+# Column name per deployment phase in the output dataframe
+COLUMNS = {
+    "1_kubectl_start": "kubectl_start (s)",
+    "2_kubectl_send": "kubectl_parsed (s)",
+    "3_api_receive_job": "api_workload_arrived (s)",
+    "4_jobcontroller_start": "controller_read_workload (s)",
+    "5_pod_object_create": "controller_unpacked_workload (s)",
+    "6_api_receive_pod": "api_pod_created (s)",
+    "7_scheduler_start": "scheduler_read_pod (s)",
+    "8_api_receive_pod": "scheduled_pod (s)",
+    "9_kubelet_start": "kubelet_pod_received (s)",
+    "10_volume_mount": "kubelet_created_cgroup (s)",
+    "11_sandbox_start": "kubelet_mounted_volume (s)",
+    "12_create_container": "kubelet_applied_sandbox (s)",
+    "13_start_container": "kubelet_created_container (s)",
+    "14_app_start": "started_application (s)",
+}
 
 
 def set_container_location(config):
@@ -124,22 +140,73 @@ def format_output(
         worker_description (list(list(str)), optional): Extensive description of each container
         endtime (str, optional): Timestamp of the slowest deployed pod
     """
+    # Only needed for output processing, don't slow down startup
+    from . import plot  # pylint: disable=import-outside-toplevel
+
     # Plot the status of each pod over time
     if status is not None:
         plot.plot_status(status, config["timestamp"])
 
         if control is not None:
-            worker_metrics = fill_control(
-                config, control, starttime, worker_output, worker_description
-            )
-            df = print_control(config, worker_metrics)
+            timeline = fill_control(config, control, starttime, worker_output, worker_description)
+            df = print_control(config, timeline)
+            # Store before print_resources() renames the columns, the plots use the tables per VM
+            metrics_store.collect(config, starttime, resource_output, status, timeline)
             df_resources = print_resources(config, resource_output)
-            validate_data(df)
+            validate_data(timeline)
             plot.plot_control(df, config["timestamp"])
             plot.plot_p56(df, config["timestamp"])
             plot.plot_resources(df_resources, config["timestamp"], xmax=endtime)
 
 
+class Timeline:
+    """Timestamps of all deployment phases, stored per phase instead of per pod.
+    Every pod-container combination gets an id, which indexes the timestamp array of each phase.
+    Timestamps that have not been parsed (yet) are NaN.
+    """
+
+    def __init__(self, pods, containers, tags):
+        """Initialize the object
+
+        Args:
+            pods (list(str)): Name of the pod per id
+            containers (list(str)): Name of the container in the pod per id
+            tags (list(str)): Deployment phases, in chronological order
+        """
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        self.pods = pods
+        self.containers = containers
+        self.tags = tags
+        self.phases = {tag: np.full(len(pods), np.nan) for tag in tags}
+
+    def __len__(self):
+        return len(self.pods)
+
+    def durations(self):
+        """Get the time between every pair of consecutive phases, for all ids at once
+
+        Returns:
+            dict(tuple(str, str), ndarray): Duration per id, per pair of phases
+        """
+        return {
+            (first, second): self.phases[second] - self.phases[first]
+            for first, second in zip(self.tags, self.tags[1:])
+        }
+
+    def to_frame(self):
+        """Convert to a dataframe with one row per id
+
+        Returns:
+            (DataFrame) Pandas dataframe object with pod, container and a column per phase
+        """
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        data = {"pod": self.pods, "container": self.containers}
+        data.update(self.phases)
+        return pd.DataFrame(data)
+
+
 def create_control_object(worker_description, mapping):
     """Create the data object to store our final parsed data in.
     Make one entry for each pod-container combination.
@@ -148,16 +215,12 @@ def create_control_object(worker_description, mapping):
     Args:
         worker_description (list(list(str))): Extensive description of each container
         mapping (list(list(str))): Mapping of components with custom prints to tags for analysis
-    """
-    worker_metrics = []
-    worker_set = {
-        "pod": None,  # Name of the pod for which these metrics are captured
-        "container": None,  # Name of the container in the pod
-    }
-
-    for _, _, name in mapping:
-        worker_set[name] = None
 
+    Returns:
+        Timeline: Empty timeline with an id per pod-container combination
+    """
+    pods = []
+    containers = []
     container_ids = []
 
     # Set pod and container object per metric set
@@ -191,77 +254,132 @@ def create_control_object(worker_description, mapping):
             logging.error("ERROR: pod_name could not be be set")
             sys.exit()
 
-        w_set = copy.deepcopy(worker_set)
-        w_set["pod"] = pod_name
-        w_set["container"] = container_name
-        worker_metrics.append(w_set)
+        pods.append(pod_name)
+        containers.append(container_name)
 
-    return worker_metrics
+    return Timeline(pods, containers, [name for _, _, name in mapping])
 
 
-def sort_on_time(timestamp, worker_metrics, tag, compare_tag, future_compare):
-    """Insert starttime in the array worker_metrics[tag], in chronological order compared
-    to an already filled series of timestamps worker_metrics[compare_tag]
+def index_metrics(timeline):
+    """Index the timeline on the names used in custom prints, so log lines are matched to
+    ids with a lookup instead of a scan over all ids
 
     Args:
-        starttime (datetime, optional): Invocation time of kubectl apply command
-        worker_metrics (list(dict)): Metrics per worker node
-        tag (str): Dict key to save the found logs under
-        compare_tag (str): Other dict key against which you should sort on time
-        future_compare (bool): Compare to a dataset in the future (<) or past (>)
+        timeline (Timeline): Timestamps per deployment phase
+
+    Returns:
+        dict(str, dict): Ids per pod, container, (pod, container) and job
     """
-    # Sort previous tag to find the correct order of time
-    try:
-        sorted_worker_metrics = sorted(worker_metrics, key=lambda x: x[compare_tag])
-    except Exception as e:
-        logging.error("ERROR: couldnt sort due to exception %s", str(e))
-        logging.error(str(worker_metrics))
-        sys.exit()
+    index = {"pod": {}, "container": {}, "pod_container": {}, "job": {}}
+    for i, (pod, container) in enumerate(zip(timeline.pods, timeline.containers)):
+        index["pod"].setdefault(pod, []).append(i)
+        index["container"].setdefault(container, []).append(i)
+        index["pod_container"].setdefault((pod, container), []).append(i)
 
-    # You can't directly insert in worker_metrics like this, so we first
-    # find the timestamp to insert to in the sorted list, and then
-    # find the right entry in worker_metrics to insert into
-    insertion_time = 100000
-    for s in sorted_worker_metrics:
-        if s[tag] is None:
-            if (future_compare and timestamp < s[compare_tag]) or (
-                not future_compare and timestamp > s[compare_tag]
-            ):
-                insertion_time = s[compare_tag]
-                break
-
-            logging.warning(
-                "WARNING: Expected insertion timestamp %s didn't succeed on %s to %s (future=%i)",
-                str(timestamp),
-                tag,
-                compare_tag,
-                int(future_compare),
-            )
+        # Pods are named after their job (job-suffix), so index every prefix ending in a "-"
+        for j, c in enumerate(pod):
+            if c == "-":
+                index["job"].setdefault(pod[: j + 1], []).append(i)
 
-    if insertion_time == 100000:
-        logging.error("ERROR: didn't find an entry to insert a %s print into", tag)
-        logging.error(str(worker_metrics))
+    return index
+
+
+def fill_metrics(timeline, indices, tag, timestamp):
+    """Set the timestamp of a phase for the given ids, if not set yet
+
+    Args:
+        timeline (Timeline): Timestamps per deployment phase
+        indices (list(int)): Ids to set
+        tag (str): Phase to save the found logs under
+        timestamp (float): Value to set
+
+    Returns:
+        int: Number of ids set
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    phase = timeline.phases[tag]
+    indices = np.asarray(indices, dtype=int)
+    unset = indices[np.isnan(phase[indices])]
+    phase[unset] = timestamp
+    return len(unset)
+
+
+def time_index(timeline, tag, compare_tag):
+    """Sort the ids without a timestamp for a phase yet on another phase, once per phase.
+    Ties keep the order of ids.
+
+    Args:
+        timeline (Timeline): Timestamps per deployment phase
+        tag (str): Phase to save the found logs under
+        compare_tag (str): Other phase against which you should sort on time
+
+    Returns:
+        (list(float), list(int)): Sorted compare_tag timestamps, and their ids
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    compare = timeline.phases[compare_tag]
+    if np.isnan(compare).any():
+        logging.error("ERROR: couldnt sort due to missing %s timestamps", compare_tag)
+        logging.error(timeline.to_frame().to_string())
         sys.exit()
 
-    # Now insert in the real list given by searching for our timestamp
-    insert = False
-    for metric in worker_metrics:
-        if metric[compare_tag] == insertion_time and metric[tag] is None:
-            metric[tag] = timestamp
-            insert = True
-            break
+    order = np.argsort(compare, kind="stable")
+    indices = order[np.isnan(timeline.phases[tag][order])]
+    return compare[indices].tolist(), indices.tolist()
+
+
+def sort_on_time(timestamp, timeline, tag, compare_tag, future_compare, index):
+    """Insert starttime in the array timeline.phases[tag], in chronological order compared
+    to an already filled series of timestamps timeline.phases[compare_tag]
 
-    if not insert:
+    Args:
+        starttime (datetime, optional): Invocation time of kubectl apply command
+        timeline (Timeline): Timestamps per deployment phase
+        tag (str): Phase to save the found logs under
+        compare_tag (str): Other phase against which you should sort on time
+        future_compare (bool): Compare to a dataset in the future (<) or past (>)
+        index (list(float), list(int)): Ids without a timestamp yet, see time_index().
+            The id that is inserted into is removed.
+    """
+    keys, indices = index
+
+    # Insert into the first entry (in time) that is later (future) or earlier (past) than
+    # our timestamp. In the past case, that is always the earliest entry
+    if future_compare:
+        pos = bisect.bisect_right(keys, timestamp)
+    elif keys and timestamp > keys[0]:
+        pos = 0
+    else:
+        pos = len(keys)
+
+    if pos > 0:
+        logging.warning(
+            "WARNING: Expected insertion timestamp %s didn't succeed on %s to %s (future=%i) "
+            "for %i entries",
+            str(timestamp),
+            tag,
+            compare_tag,
+            int(future_compare),
+            pos,
+        )
+
+    if pos == len(keys):
         logging.error("ERROR: didn't find an entry to insert a %s print into", tag)
-        logging.error(str(worker_metrics))
+        logging.error(timeline.to_frame().to_string())
         sys.exit()
 
+    keys.pop(pos)
+    timeline.phases[tag][indices.pop(pos)] = timestamp
+
 
 def check(
     config,
     control,
     starttime,
-    worker_metrics,
+    timeline,
+    index,
     component,
     sub_string,
     tag,
@@ -274,12 +392,13 @@ def check(
         config (dict): Parsed configuration
         control (list(str), optional): Parsed output from control plane components
         starttime (datetime, optional): Invocation time of kubectl apply command
-        worker_metrics (list(dict)): Metrics per worker node
+        timeline (Timeline): Timestamps per deployment phase
+        index (dict(str, dict)): Ids per pod / container / job, see index_metrics()
         component (str): Kubernetes component in which logs we look
         sub_string (str): String to check for in each line of component's logs
-        tag (str): Dict key to save the found logs under
+        tag (str): Phase to save the found logs under
         compare_tag (str): Optional. When no tag exists in the output line (like 0400 job=empty-1)
-                           compare against worker_metrics[compare_tag] for chronological insertion.
+                           compare against timeline.phases[compare_tag] for chronological insertion.
         reverse (bool): Optional. Reverse insertion chronological. Defaults to False
     """
     logging.debug(
@@ -300,6 +419,7 @@ def check(
         is_controlplane = False
 
     i = 0
+    sorted_index = None
 
     # Investigate either the control plane node or all worker nodes
     for node, output in control.items():
@@ -321,7 +441,7 @@ def check(
 
             # Now parse the lines
             for t, line in out_filtered:
-                if i == len(worker_metrics):
+                if i == len(timeline):
                     logging.debug("WARNING: i == number of deployed pods. Stop processing")
                     break
 
@@ -332,7 +452,10 @@ def check(
                 ):
                     # See comments in next function
                     timestamp = time_delta(t, starttime)
-                    sort_on_time(timestamp, worker_metrics, tag, compare_tag, reverse)
+                    if sorted_index is None:
+                        sorted_index = time_index(timeline, tag, compare_tag)
+
+                    sort_on_time(timestamp, timeline, tag, compare_tag, reverse, sorted_index)
                     i += 1
                 else:
                     # The cases where a tag exists
@@ -346,33 +469,32 @@ def check(
                         pod = strip[0]
                         container = strip[1]
 
-                        for metric in worker_metrics:
-                            if (
-                                metric["pod"] == pod
-                                and metric["container"] == container
-                                and metric[tag] is None
-                            ):
-                                metric[tag] = time_delta(t, starttime)
-                                i += 1
+                        i += fill_metrics(
+                            timeline,
+                            index["pod_container"].get((pod, container), []),
+                            tag,
+                            time_delta(t, starttime),
+                        )
                     elif "pod=" in line:
                         # Add to correct pod
                         pod = line.strip().split("pod=")[1]
                         if "default/" in pod:
                             pod = pod.split("default/")[1]
 
-                        for metric in worker_metrics:
-                            # Note: logs are already sorted by time, so only just the first entry
-                            #       This applies to all metric[tag] is None in this function
-                            if metric["pod"] == pod and metric[tag] is None:
-                                metric[tag] = time_delta(t, starttime)
-                                i += 1
+                        # Note: logs are already sorted by time, so only just the first entry
+                        #       This applies to all metric[tag] is None in this function
+                        i += fill_metrics(
+                            timeline, index["pod"].get(pod, []), tag, time_delta(t, starttime)
+                        )
                     elif "container=" in line:
                         # Add to correct container
                         container = line.strip().split("container=default/")[1]
-                        for metric in worker_metrics:
-                            if metric["container"] == container and metric[tag] is None:
-                                metric[tag] = time_delta(t, starttime)
-                                i += 1
+                        i += fill_metrics(
+                            timeline,
+                            index["container"].get(container, []),
+                            tag,
+                            time_delta(t, starttime),
+                        )
                     elif "job=" in line:
                         # Filter on job
                         # These job prints only have "empty-5", while pod name is "empty-5-asdfa"
@@ -386,28 +508,21 @@ def check(
                             job = line.strip().split("job=")[1] + "-"
 
                         # Normal insertion according to job match
-                        for metric in worker_metrics:
-                            if job in metric["pod"] and metric[tag] is None:
-                                metric[tag] = time_delta(t, starttime)
-                                i += 1
+                        i += fill_metrics(
+                            timeline, index["job"].get(job, []), tag, time_delta(t, starttime)
+                        )
 
-    if i < len(worker_metrics):
+    if i < len(timeline):
         if (component == "apiserver" or tag == "5_pod_object_create") and i == 1:
             # Only fill up the rest if there was only 1 entry and its the apiserver we're parsing
-            logging.debug(
-                "Parsed output for %i / %i pods. Fill up the rest.", i, len(worker_metrics)
-            )
+            logging.debug("Parsed output for %i / %i pods. Fill up the rest.", i, len(timeline))
 
             # Fill up if there are multiple containers per pod
-            if i < len(worker_metrics):
-                j = i - 1
-                while i < len(worker_metrics):
-                    worker_metrics[i][tag] = worker_metrics[j][tag]
-                    i += 1
+            timeline.phases[tag][i:] = timeline.phases[tag][i - 1]
         else:
             # In all other conditions all pods should have been parsed automatically
             # If that didn't happen, generate an error
-            logging.error("ERROR: Only parsed output for %i / %i pods.", i, len(worker_metrics))
+            logging.error("ERROR: Only parsed output for %i / %i pods.", i, len(timeline))
             sys.exit()
 
 
@@ -442,7 +557,8 @@ def fill_control(config, control, starttime, worker_output, worker_description):
         [None, None, "14_app_start"],  # First print in the application
     ]
 
-    worker_metrics = create_control_object(worker_description, mapping)
+    timeline = create_control_object(worker_description, mapping)
+    index = index_metrics(timeline)
 
     # Issue: 5_pod_object_create does not print the pod that has been created
     #        So, we only insert it after 7_scheduler_start, which does have this info
@@ -471,7 +587,8 @@ def fill_control(config, control, starttime, worker_output, worker_description):
                 config,
                 control,
                 starttime,
-                worker_metrics,
+                timeline,
+                index,
                 component,
                 sub_string,
                 tag,
@@ -479,7 +596,7 @@ def fill_control(config, control, starttime, worker_output, worker_description):
                 reverse,
             )
         elif component is not None:
-            check(config, control, starttime, worker_metrics, component, sub_string, tag)
+            check(config, control, starttime, timeline, index, component, sub_string, tag)
 
     # 17_app_start: First print in the application
     for pod, output in worker_output:
@@ -503,7 +620,7 @@ def fill_control(config, control, starttime, worker_output, worker_description):
                 #
                 # This mapping should be 100% strictly correct because to get the output, you
                 # need the correct pod/container names as well (which are used to create the
-                # worker_metrics object itself)
+                # timeline object itself)
                 check_container = False
                 if " " in pod:
                     check_container = True
@@ -511,27 +628,22 @@ def fill_control(config, control, starttime, worker_output, worker_description):
                     pod = line[0]
                     container = line[1]
 
-                for i, metrics in enumerate(worker_metrics):
-                    if not check_container and metrics["pod"] == pod:
-                        worker_metrics[i][mapping[-1][2]] = time_delta(end_time, starttime)
-                        # You could add a break here and in the end of the next else, but the
-                        # code's logic should be robust enough so that it isn't required
-                    elif (
-                        check_container
-                        and metrics["pod"] == pod
-                        and metrics["container"] == container
-                    ):
-                        worker_metrics[i][mapping[-1][2]] = time_delta(end_time, starttime)
+                if check_container:
+                    indices = index["pod_container"].get((pod, container), [])
+                else:
+                    indices = index["pod"].get(pod, [])
+
+                timeline.phases[mapping[-1][2]][indices] = time_delta(end_time, starttime)
 
-    return worker_metrics
+    return timeline
 
 
-def print_control(config, worker_metrics):
+def print_control(config, timeline):
     """Print controlplane data from the source code
 
     Args:
         config (dict): Parsed configuration
-        worker_metrics (list(dict)): Metrics per worker node
+        timeline (Timeline): Timestamps per deployment phase
 
     Returns:
         (DataFrame) Pandas dataframe object with parsed timestamps per category
@@ -539,29 +651,11 @@ def print_control(config, worker_metrics):
     logging.info("------------------------------------")
     logging.info("%s OUTPUT", config["mode"].upper())
     logging.info("------------------------------------")
-    df = pd.DataFrame(worker_metrics)
+    df = timeline.to_frame()
 
     # Rename to phases instead of events for plot
     # May need to rename specific entries for specific plots later
-    df.rename(
-        columns={
-            "1_kubectl_start": "kubectl_start (s)",
-            "2_kubectl_send": "kubectl_parsed (s)",
-            "3_api_receive_job": "api_workload_arrived (s)",
-            "4_jobcontroller_start": "controller_read_workload (s)",
-            "5_pod_object_create": "controller_unpacked_workload (s)",
-            "6_api_receive_pod": "api_pod_created (s)",
-            "7_scheduler_start": "scheduler_read_pod (s)",
-            "8_api_receive_pod": "scheduled_pod (s)",
-            "9_kubelet_start": "kubelet_pod_received (s)",
-            "10_volume_mount": "kubelet_created_cgroup (s)",
-            "11_sandbox_start": "kubelet_mounted_volume (s)",
-            "12_create_container": "kubelet_applied_sandbox (s)",
-            "13_start_container": "kubelet_created_container (s)",
-            "14_app_start": "started_application (s)",
-        },
-        inplace=True,
-    )
+    df.rename(columns=COLUMNS, inplace=True)
     df = df.sort_values(by=["started_application (s)"])
 
     df_no_indices = df.to_string(index=False)
@@ -576,20 +670,22 @@ def print_control(config, worker_metrics):
     return df
 
 
-def validate_data(df):
+def validate_data(timeline):
     """Validate that all numbers are strictly increasing
 
     Args:
-        df (DataFrame): Pandas dataframe object with parsed timestamps per category
+        timeline (Timeline): Timestamps per deployment phase
     """
-    columns = list(df.columns)
-    for i, col in enumerate(columns[2:-1]):
-        first = col
-        second = columns[i + 3]
-
-        diff = df.loc[(df[first] > df[second])]
-        if not diff.empty:
-            logging.info("[WARNING]: %s < %s is not true for %i lines", first, second, len(diff))
+    for (first, second), duration in timeline.durations().items():
+        # Missing timestamps are NaN, which never compare as negative
+        wrong = int((duration < 0).sum())
+        if wrong:
+            logging.info(
+                "[WARNING]: %s < %s is not true for %i lines",
+                COLUMNS[first],
+                COLUMNS[second],
+                wrong,
+            )
 
 
 def print_resources(config, df):
@@ -1,15 +1,18 @@
 """Manage the empty application"""
 
+import bisect
 import logging
 import sys
 import copy
 
 from datetime import datetime
-from typing import List
+from typing import TYPE_CHECKING
 
-import pandas as pd
+from .. import metrics_store
 
-from . import plot
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 
 
 def set_container_location(config):
@@ -127,6 +130,9 @@ def format_output(
         worker_description (list(list(str)), optional): Extensive description of each container
         endtime (str, optional): Timestamp of the slowest deployed pod
     """
+    # Only needed for output processing, don't slow down startup
+    from . import plot  # pylint: disable=import-outside-toplevel
+
     # Plot the status of each pod over time
     if status is not None:
         plot.plot_status(status, config["timestamp"])
@@ -136,6 +142,8 @@ def format_output(
                 config, control, starttime, worker_output, worker_description
             )
             df = print_control(config, worker_metrics)
+            # Store before print_resources() renames the columns, the plots use the tables per VM
+            metrics_store.collect(config, starttime, resource_output, status)
             df_resources = print_resources(config, resource_output)
             validate_data(df)
             plot.plot_control(df, config["timestamp"])
@@ -150,17 +158,19 @@ def format_output(
                 plot.plot_p56_kata(df_kata, config["timestamp"])
 
 
-def get_kata_df(df: pd.DataFrame, kata_ts: List[List[int]], starttime) -> pd.DataFrame:
+def get_kata_df(df: "pd.DataFrame", kata_ts: "np.ndarray", starttime) -> "pd.DataFrame":
     """_summary_
 
     Args:
         df (pd.DataFrame): _description_
-        kata_ts (List[List[int]]): _description_
+        kata_ts (np.ndarray): T0 - T4 in microseconds per pod, see get_kata_timestamps()
         starttime (_type_): _description_
 
     Returns:
         pd.DataFrame: _description_
     """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
     df_columns = [
         "kubelet_pod_received (s)",
         "kubelet_created_cgroup (s)",
@@ -168,12 +178,15 @@ def get_kata_df(df: pd.DataFrame, kata_ts: List[List[int]], starttime) -> pd.Dat
         "started_application (s)",
     ]
 
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
     df = df[df_columns]
-    kata_ts = sorted(kata_ts, key=lambda x: x[-1])
-    kata_p = [
-        [time_delta(t * 1e-6, starttime) for (i, t) in enumerate(l) if i != 0] for l in kata_ts
-    ]
-    kata_p = [list(l) for l in zip(*kata_p)]  # pivot to append to df_lists
+
+    # Time deltas of T1 - T4 per pod, corrected for timezones like time_delta()
+    kata_ts = kata_ts[np.argsort(kata_ts[:, -1], kind="stable")]
+    deltas = kata_ts[:, 1:] * 1e-6 - starttime
+    deltas += np.maximum(np.ceil(-deltas / 3600.0), 0.0) * 3600.0
+    kata_p = deltas.T.tolist()  # pivot to append to df_lists
 
     kata_columns = [
         "kata_create_runtime (s)",
@@ -253,69 +266,124 @@ def create_control_object(worker_description, mapping):
     return worker_metrics
 
 
-def sort_on_time(timestamp, worker_metrics, tag, compare_tag, future_compare):
-    """Insert starttime in the array worker_metrics[tag], in chronological order compared
-    to an already filled series of timestamps worker_metrics[compare_tag]
+def index_metrics(worker_metrics):
+    """Index worker_metrics on the names used in custom prints, so log lines are matched to
+    entries with a lookup instead of a scan over all entries
+
+    Args:
+        worker_metrics (list(dict)): Metrics per worker node
+
+    Returns:
+        dict(str, dict): Indices into worker_metrics per pod, container, (pod, container) and job
+    """
+    index = {"pod": {}, "container": {}, "pod_container": {}, "job": {}}
+    for i, metric in enumerate(worker_metrics):
+        index["pod"].setdefault(metric["pod"], []).append(i)
+        index["container"].setdefault(metric["container"], []).append(i)
+        index["pod_container"].setdefault((metric["pod"], metric["container"]), []).append(i)
+
+        # Pods are named after their job (job-suffix), so index every prefix ending in a "-"
+        for j, c in enumerate(metric["pod"]):
+            if c == "-":
+                index["job"].setdefault(metric["pod"][: j + 1], []).append(i)
+
+    return index
+
+
+def fill_metrics(worker_metrics, indices, tag, timestamp):
+    """Set worker_metrics[tag] for the given entries, if not set yet
+
+    Args:
+        worker_metrics (list(dict)): Metrics per worker node
+        indices (list(int)): Entries in worker_metrics to set
+        tag (str): Dict key to save the found logs under
+        timestamp (float): Value to set
+
+    Returns:
+        int: Number of entries set
+    """
+    filled = 0
+    for i in indices:
+        if worker_metrics[i][tag] is None:
+            worker_metrics[i][tag] = timestamp
+            filled += 1
+
+    return filled
+
+
+def time_index(worker_metrics, tag, compare_tag):
+    """Sort the entries of worker_metrics without a tag yet on their compare_tag, once per tag.
+    Ties keep the order of worker_metrics.
 
     Args:
-        starttime (datetime, optional): Invocation time of kubectl apply command
         worker_metrics (list(dict)): Metrics per worker node
         tag (str): Dict key to save the found logs under
         compare_tag (str): Other dict key against which you should sort on time
-        future_compare (bool): Compare to a dataset in the future (<) or past (>)
+
+    Returns:
+        (list(float), list(int)): Sorted compare_tag timestamps, and their entries in worker_metrics
     """
-    # Sort previous tag to find the correct order of time
     try:
-        sorted_worker_metrics = sorted(worker_metrics, key=lambda x: x[compare_tag])
+        order = sorted(range(len(worker_metrics)), key=lambda i: worker_metrics[i][compare_tag])
     except Exception as e:
         logging.error("ERROR: couldnt sort due to exception %s", str(e))
         logging.error(str(worker_metrics))
         sys.exit()
 
-    # You can't directly insert in worker_metrics like this, so we first
-    # find the timestamp to insert to in the sorted list, and then
-    # find the right entry in worker_metrics to insert into
-    insertion_time = 100000
-    for s in sorted_worker_metrics:
-        if s[tag] is None:
-            if (future_compare and timestamp < s[compare_tag]) or (
-                not future_compare and timestamp > s[compare_tag]
-            ):
-                insertion_time = s[compare_tag]
-                break
-
-            logging.warning(
-                "WARNING: Expected insertion timestamp %s didn't succeed on %s to %s (future=%i)",
-                str(timestamp),
-                tag,
-                compare_tag,
-                int(future_compare),
-            )
+    indices = [i for i in order if worker_metrics[i][tag] is None]
+    return [worker_metrics[i][compare_tag] for i in indices], indices
 
-    if insertion_time == 100000:
-        logging.error("ERROR: didn't find an entry to insert a %s print into", tag)
-        logging.error(str(worker_metrics))
-        sys.exit()
 
-    # Now insert in the real list given by searching for our timestamp
-    insert = False
-    for metric in worker_metrics:
-        if metric[compare_tag] == insertion_time and metric[tag] is None:
-            metric[tag] = timestamp
-            insert = True
-            break
+def sort_on_time(timestamp, worker_metrics, tag, compare_tag, future_compare, index):
+    """Insert starttime in the array worker_metrics[tag], in chronological order compared
+    to an already filled series of timestamps worker_metrics[compare_tag]
 
-    if not insert:
+    Args:
+        starttime (datetime, optional): Invocation time of kubectl apply command
+        worker_metrics (list(dict)): Metrics per worker node
+        tag (str): Dict key to save the found logs under
+        compare_tag (str): Other dict key against which you should sort on time
+        future_compare (bool): Compare to a dataset in the future (<) or past (>)
+        index (list(float), list(int)): Entries without a tag yet, see time_index().
+            The entry that is inserted into is removed.
+    """
+    keys, indices = index
+
+    # Insert into the first entry (in time) that is later (future) or earlier (past) than
+    # our timestamp. In the past case, that is always the earliest entry
+    if future_compare:
+        pos = bisect.bisect_right(keys, timestamp)
+    elif keys and timestamp > keys[0]:
+        pos = 0
+    else:
+        pos = len(keys)
+
+    if pos > 0:
+        logging.warning(
+            "WARNING: Expected insertion timestamp %s didn't succeed on %s to %s (future=%i) "
+            "for %i entries",
+            str(timestamp),
+            tag,
+            compare_tag,
+            int(future_compare),
+            pos,
+        )
+
+    if pos == len(keys):
         logging.error("ERROR: didn't find an entry to insert a %s print into", tag)
         logging.error(str(worker_metrics))
         sys.exit()
 
+    keys.pop(pos)
+    worker_metrics[indices.pop(pos)][tag] = timestamp
+
 
 def check(
     config,
     control,
     starttime,
     worker_metrics,
+    index,
     component,
     sub_string,
     tag,
@@ -329,6 +397,7 @@ def check(
         control (list(str), optional): Parsed output from control plane components
         starttime (datetime, optional): Invocation time of kubectl apply command
         worker_metrics (list(dict)): Metrics per worker node
+        index (dict(str, dict)): Indices into worker_metrics, see index_metrics()
         component (str): Kubernetes component in which logs we look
         sub_string (str): String to check for in each line of component's logs
         tag (str): Dict key to save the found logs under
@@ -354,6 +423,7 @@ def check(
         is_controlplane = False
 
     i = 0
+    sorted_index = None
 
     # Investigate either the control plane node or all worker nodes
     for node, output in control.items():
@@ -386,7 +456,10 @@ def check(
                 ):
                     # See comments in next function
                     timestamp = time_delta(t, starttime)
-                    sort_on_time(timestamp, worker_metrics, tag, compare_tag, reverse)
+                    if sorted_index is None:
+                        sorted_index = time_index(worker_metrics, tag, compare_tag)
+
+                    sort_on_time(timestamp, worker_metrics, tag, compare_tag, reverse, sorted_index)
                     i += 1
                 else:
                     # The cases where a tag exists
@@ -400,33 +473,32 @@ def check(
                         pod = strip[0]
                         container = strip[1]
 
-                        for metric in worker_metrics:
-                            if (
-                                metric["pod"] == pod
-                                and metric["container"] == container
-                                and metric[tag] is None
-                            ):
-                                metric[tag] = time_delta(t, starttime)
-                                i += 1
+                        i += fill_metrics(
+                            worker_metrics,
+                            index["pod_container"].get((pod, container), []),
+                            tag,
+                            time_delta(t, starttime),
+                        )
                     elif "pod=" in line:
                         # Add to correct pod
                         pod = line.strip().split("pod=")[1]
                         if "default/" in pod:
                             pod = pod.split("default/")[1]
 
-                        for metric in worker_metrics:
-                            # Note: logs are already sorted by time, so only just the first entry
-                            #       This applies to all metric[tag] is None in this function
-                            if metric["pod"] == pod and metric[tag] is None:
-                                metric[tag] = time_delta(t, starttime)
-                                i += 1
+                        # Note: logs are already sorted by time, so only just the first entry
+                        #       This applies to all metric[tag] is None in this function
+                        i += fill_metrics(
+                            worker_metrics, index["pod"].get(pod, []), tag, time_delta(t, starttime)
+                        )
                     elif "container=" in line:
                         # Add to correct container
                         container = line.strip().split("container=default/")[1]
-                        for metric in worker_metrics:
-                            if metric["container"] == container and metric[tag] is None:
-                                metric[tag] = time_delta(t, starttime)
-                                i += 1
+                        i += fill_metrics(
+                            worker_metrics,
+                            index["container"].get(container, []),
+                            tag,
+                            time_delta(t, starttime),
+                        )
                     elif "job=" in line:
                         # Filter on job
                         # These job prints only have "empty-5", while pod name is "empty-5-asdfa"
@@ -440,10 +512,9 @@ def check(
                             job = line.strip().split("job=")[1] + "-"
 
                         # Normal insertion according to job match
-                        for metric in worker_metrics:
-                            if job in metric["pod"] and metric[tag] is None:
-                                metric[tag] = time_delta(t, starttime)
-                                i += 1
+                        i += fill_metrics(
+                            worker_metrics, index["job"].get(job, []), tag, time_delta(t, starttime)
+                        )
 
     if i < len(worker_metrics):
         if (component == "apiserver" or tag == "5_pod_object_create") and i == 1:
@@ -497,6 +568,7 @@ def fill_control(config, control, starttime, worker_output, worker_description):
     ]
 
     worker_metrics = create_control_object(worker_description, mapping)
+    index = index_metrics(worker_metrics)
 
     # Issue: 5_pod_object_create does not print the pod that has been created
     #        So, we only insert it after 7_scheduler_start, which does have this info
@@ -526,6 +598,7 @@ def fill_control(config, control, starttime, worker_output, worker_description):
                 control,
                 starttime,
                 worker_metrics,
+                index,
                 component,
                 sub_string,
                 tag,
@@ -533,7 +606,7 @@ def fill_control(config, control, starttime, worker_output, worker_description):
                 reverse,
             )
         elif component is not None:
-            check(config, control, starttime, worker_metrics, component, sub_string, tag)
+            check(config, control, starttime, worker_metrics, index, component, sub_string, tag)
 
     # 17_app_start: First print in the application
     for pod, output in worker_output:
@@ -565,17 +638,13 @@ def fill_control(config, control, starttime, worker_output, worker_description):
                     pod = line[0]
                     container = line[1]
 
-                for i, metrics in enumerate(worker_metrics):
-                    if not check_container and metrics["pod"] == pod:
-                        worker_metrics[i][mapping[-1][2]] = time_delta(end_time, starttime)
-                        # You could add a break here and in the end of the next else, but the
-                        # code's logic should be robust enough so that it isn't required
-                    elif (
-                        check_container
-                        and metrics["pod"] == pod
-                        and metrics["container"] == container
-                    ):
-                        worker_metrics[i][mapping[-1][2]] = time_delta(end_time, starttime)
+                if check_container:
+                    indices = index["pod_container"].get((pod, container), [])
+                else:
+                    indices = index["pod"].get(pod, [])
+
+                for i in indices:
+                    worker_metrics[i][mapping[-1][2]] = time_delta(end_time, starttime)
 
     return worker_metrics
 
@@ -590,6 +659,8 @@ def print_control(config, worker_metrics):
     Returns:
         (DataFrame) Pandas dataframe object with parsed timestamps per category
     """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
     logging.info("------------------------------------")
     logging.info("%s OUTPUT", config["mode"].upper())
     logging.info("------------------------------------")
@@ -3,8 +3,6 @@
 import logging
 import copy
 import sys
-import numpy as np
-import pandas as pd
 
 from application import application
 
@@ -167,6 +165,9 @@ def gather_worker_metrics(_machines, _config, worker_output, _starttime):
     Returns:
         list(dict): List of parsed output for each cloud or edge worker
     """
+    # Only needed for output processing, don't slow down startup
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
     worker_metrics = []
     if worker_output == []:
         return worker_metrics
@@ -261,6 +262,8 @@ def gather_endpoint_metrics(config, endpoint_output, container_names):
     Returns:
         list(dict): List of parsed output for each endpoint
     """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
     endpoint_metrics = []
     endpoint_set = {
         "worker_id": None,  # To which worker is this endpoint connected
@@ -374,6 +377,8 @@ def format_output(config, worker_metrics, endpoint_metrics, status=None):
         sub_metrics (list(dict)): Metrics per worker node
         endpoint_metrics (list(dict)): Metrics per endpoint
     """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
     if status is not None:
         logging.error("This application does not support status reporting")
         sys.exit()
@@ -0,0 +1,530 @@
+"""\
+Store metrics of all sources in one long table with columns series, entity, timestamp and value
+- series: what is measured, e.g. kube_cpu (millicpu), os_memory (%), power/intel-rapl:0 (W),
+  pods/ContainerCreating (number of pods), or phase/<deployment phase> (1 per event)
+- entity: what it is measured for, e.g. a node, a control plane component, a pod, or "cluster".
+  VM names are stored as hostnames (without underscores), which is how Kubernetes names its nodes,
+  so series of different sources about the same VM share their entity.
+- timestamp: absolute time in seconds since the epoch, so all sources share a timebase
+- value: float
+
+Sources with wide tables (a column per entity) are converted on insertion. On disk, the store is
+partitioned by run: <root>/run=<run>/<source>.csv.gz, with one file per source. The run is the
+Continuum run (config["timestamp"], see log_run()), and energy_metrics.py adds the energy it
+measured on the VMs of that run to the same partition, so load() returns both.
+
+Queries:
+- frame(): filter on series, entity and time
+- wide(): a column per series and entity, for sources that share their timestamps
+- resample(): as-of values of a series per entity on a regular timebase
+- asof(): attach the latest value of another series to every sample of a series
+- during(): samples of a series taken while another series was non-zero, e.g. the power per node
+  while pods were ContainerCreating: during("power/intel-rapl:0", "pods/ContainerCreating")
+"""
+
+import logging
+import os
+import sys
+
+SCHEMA = ["series", "entity", "timestamp", "value"]
+
+# Default location of the store, next to the other output of a run
+ROOT = "./logs/metrics"
+
+
+def hostname(name):
+    """Get the hostname of a VM, which is how Kubernetes names its node
+
+    Args:
+        name (str): VM name, e.g. cloud0_matthijs
+
+    Returns:
+        str: Hostname, e.g. cloud0matthijs
+    """
+    return name.replace("_", "")
+
+
+def log_run(log_name):
+    """Get the run of a Continuum log file, which starts with config["timestamp"]
+
+    Args:
+        log_name (str): Log file name, e.g. 2024-01-31_12:00:00_cloud_kubecontrol_empty.log
+
+    Returns:
+        str: Run, e.g. 2024-01-31_12:00:00
+    """
+    return "_".join(os.path.basename(log_name).split("_")[:2])
+
+
+def read_energy(path):
+    """Read the energy file written by energy_metrics.py ({run}_metrics.txt)
+
+    Format, with an entry per VM per sample:
+    # max_energy_range_uj intel-rapl:0=262143328850 ...     (optional)
+    <time> <host cpu time>
+    <vm> <intel-rapl:0 energy (uJ)> <usr time> <sys time> [<zone>=<energy (uJ)> ...]
+
+    Args:
+        path (str): Path to the energy file
+
+    Returns:
+        (DataFrame): Energy in J since the first sample and power in W, per VM and RAPL zone
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    max_ranges = {}
+    samples = {}
+    t = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+
+            if fields[0] == "#":
+                if len(fields) > 1 and fields[1] == "max_energy_range_uj":
+                    max_ranges = dict(field.split("=") for field in fields[2:])
+                continue
+
+            if len(fields) == 2:
+                t = float(fields[0])
+                continue
+
+            # Files without zones only hold the package energy
+            zones = dict(field.split("=") for field in fields[4:])
+            zones.setdefault("intel-rapl:0", fields[1])
+            entity = hostname(fields[0])
+            for zone, energy in zones.items():
+                samples.setdefault((entity, zone), ([], []))
+                samples[(entity, zone)][0].append(t)
+                samples[(entity, zone)][1].append(int(energy))
+
+    frames = []
+    for (entity, zone), (times, energies) in samples.items():
+        times = np.array(times)
+        delta = np.diff(np.array(energies, dtype=np.float64))
+
+        # Counters wrap at max_energy_range_uj, without it wraps can't be corrected
+        if zone in max_ranges:
+            delta[delta < 0] += int(max_ranges[zone])
+        else:
+            delta[delta < 0] = np.nan
+
+        energy = np.concatenate(([0.0], np.nancumsum(delta))) / 10**6
+        with np.errstate(divide="ignore", invalid="ignore"):
+            power = delta / 10**6 / np.diff(times)
+
+        frames.append(
+            pd.DataFrame(
+                {
+                    "series": "energy/%s" % (zone),
+                    "entity": entity,
+                    "timestamp": times,
+                    "value": energy,
+                }
+            )
+        )
+        frames.append(
+            pd.DataFrame(
+                {
+                    "series": "power/%s" % (zone),
+                    "entity": entity,
+                    "timestamp": times[1:],
+                    "value": power,
+                }
+            )
+        )
+
+    if not frames:
+        return pd.DataFrame(columns=SCHEMA)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+class MetricsStore:
+    """Long table of metrics of a single run, see the module docstring for the schema"""
+
+    def __init__(self, run, root=ROOT):
+        """Initialize the object
+
+        Args:
+            run (str): Identifier of the run, e.g. the timestamp in config["timestamp"]
+            root (str, optional): Directory holding a partition per run. Defaults to ROOT.
+        """
+        self.run = run
+        self.root = root
+
+        # Long dataframe per source, concatenated on first query
+        self.sources = {}
+        self.df = None
+
+    def path(self):
+        """Get the directory of this run's partition
+
+        Returns:
+            str: Path to the partition
+        """
+        return os.path.join(self.root, "run=%s" % (self.run))
+
+    def add(self, source, df):
+        """Add metrics in the common schema, replacing earlier metrics of the same source
+
+        Args:
+            source (str): Name of the source, used as file name on disk
+            df (DataFrame): Metrics with the columns in SCHEMA
+        """
+        missing = [column for column in SCHEMA if column not in df.columns]
+        if missing:
+            logging.error("Metrics of source %s miss columns: %s", source, ", ".join(missing))
+            sys.exit()
+
+        df = df[SCHEMA].dropna(subset=["timestamp", "value"])
+        self.sources[source] = df.astype({"series": str, "entity": str, "value": float})
+        self.df = None
+
+    def add_wide(self, source, df, time_column, parse, offset=0.0):
+        """Add metrics from a wide table with a time column and a column per series and entity
+
+        Args:
+            source (str): Name of the source, used as file name on disk
+            df (DataFrame): Wide table
+            time_column (str): Name of the time column
+            parse (function): Map a column name to (series, entity), or None to skip the column
+            offset (float, optional): Seconds to add to the time column. Defaults to 0.0.
+        """
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        frames = []
+        for column in df.columns:
+            if column == time_column:
+                continue
+
+            parsed = parse(column)
+            if parsed is None:
+                continue
+
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "series": parsed[0],
+                        "entity": parsed[1],
+                        "timestamp": df[time_column].to_numpy() + offset,
+                        "value": pd.to_numeric(df[column], errors="coerce").to_numpy(),
+                    }
+                )
+            )
+
+        if frames:
+            self.add(source, pd.concat(frames, ignore_index=True))
+
+    def add_kube(self, df, starttime):
+        """Add metrics gathered from Kubernetes, see filter_metrics_kube()
+
+        Args:
+            df (DataFrame): Columns timestamp (relative to starttime), <node / component>_cpu
+                in millicpu and <node / component>_memory in Mi
+            starttime (float): Invocation time of kubectl apply command
+        """
+
+        def parse(column):
+            entity, metric = column.rsplit("_", 1)
+            return "kube_%s" % (metric), hostname(entity)
+
+        self.add_wide("kube", df, "timestamp", parse, offset=starttime)
+
+    def add_os(self, df, starttime):
+        """Add metrics gathered from the OS of every VM, see filter_metrics_os()
+
+        Args:
+            df (DataFrame): Columns Time (s) (relative to starttime), cpu-used <vm> (%)
+                and memory-used <vm> (%)
+            starttime (float): Invocation time of kubectl apply command
+        """
+
+        def parse(column):
+            metric, vm_name, _ = column.split(" ")
+            return "os_%s" % (metric.split("-")[0]), hostname(vm_name)
+
+        self.add_wide("os", df, "Time (s)", parse, offset=starttime)
+
+    def add_status(self, status):
+        """Add the number of pods per status over time, see status_timeline()
+
+        Args:
+            status (list(dict)): Status of all pods over time, with absolute time in time_orig
+        """
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        df = pd.DataFrame(status).drop(columns="time")
+
+        def parse(column):
+            return "pods/%s" % (column), "cluster"
+
+        self.add_wide("status", df, "time_orig", parse)
+
+    def add_timeline(self, timeline, starttime):
+        """Add the deployment phases of every pod as events, with value 1
+
+        Args:
+            timeline (Timeline): Timestamps of all deployment phases, relative to starttime
+            starttime (float): Invocation time of kubectl apply command
+        """
+        import numpy as np  # pylint: disable=import-outside-toplevel
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        entities = np.array(
+            [
+                pod if not container else "%s/%s" % (pod, container)
+                for pod, container in zip(timeline.pods, timeline.containers)
+            ],
+            dtype=object,
+        )
+
+        frames = []
+        for tag, times in timeline.phases.items():
+            parsed = ~np.isnan(times)
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "series": "phase/%s" % (tag),
+                        "entity": entities[parsed],
+                        "timestamp": times[parsed] + starttime,
+                        "value": 1.0,
+                    }
+                )
+            )
+
+        if frames:
+            self.add("control", pd.concat(frames, ignore_index=True))
+
+    def add_energy(self, path, source="energy"):
+        """Add energy and power per VM and RAPL zone, see read_energy()
+
+        Args:
+            path (str): Path to the energy file written by energy_metrics.py
+            source (str, optional): Name of the source, to keep multiple measurements on the
+                same VMs apart. Defaults to "energy".
+        """
+        self.add(source, read_energy(path))
+
+    def save(self):
+        """Write every source to its own compressed csv file in the partition of this run"""
+        path = self.path()
+        os.makedirs(path, exist_ok=True)
+        for source, df in self.sources.items():
+            df.to_csv(os.path.join(path, "%s.csv.gz" % (source)), index=False, encoding="utf-8")
+
+    @classmethod
+    def load(cls, run, root=ROOT):
+        """Load the partition of a run from disk
+
+        Args:
+            run (str): Identifier of the run
+            root (str, optional): Directory holding a partition per run. Defaults to ROOT.
+
+        Returns:
+            MetricsStore: Store with all sources of the run
+        """
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        store = cls(run, root)
+        path = store.path()
+        if not os.path.isdir(path):
+            logging.error("No metrics found for run %s in %s", run, root)
+            sys.exit()
+
+        for file in sorted(os.listdir(path)):
+            if file.endswith(".csv.gz"):
+                df = pd.read_csv(os.path.join(path, file), dtype={"series": str, "entity": str})
+                store.add(file[: -len(".csv.gz")], df)
+
+        return store
+
+    def frame(self, series=None, entity=None, start=None, end=None):
+        """Get metrics in the common schema, ordered on timestamp
+
+        Args:
+            series (str or list(str), optional): Only these series. Defaults to None (all).
+            entity (str or list(str), optional): Only these entities. Defaults to None (all).
+            start (float, optional): Only from this timestamp on. Defaults to None.
+            end (float, optional): Only up to this timestamp. Defaults to None.
+
+        Returns:
+            (DataFrame): Metrics with the columns in SCHEMA
+        """
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        if self.df is None:
+            if self.sources:
+                df = pd.concat(self.sources.values(), ignore_index=True)
+            else:
+                df = pd.DataFrame(columns=SCHEMA)
+
+            # Keep the insertion order as index, see wide()
+            self.df = df.sort_values("timestamp", kind="stable")
+
+        mask = pd.Series(True, index=self.df.index)
+        if series is not None:
+            mask &= self.df["series"].isin([series] if isinstance(series, str) else series)
+        if entity is not None:
+            mask &= self.df["entity"].isin([entity] if isinstance(entity, str) else entity)
+        if start is not None:
+            mask &= self.df["timestamp"] >= start
+        if end is not None:
+            mask &= self.df["timestamp"] <= end
+
+        return self.df[mask]
+
+    def wide(self, series, name, start=0.0):
+        """Get a table with a time column and a column per series and entity.
+        Columns are in order of first appearance, samples at the same time share a row.
+
+        Args:
+            series (list(str)): Series to include
+            name (function): Map (series, entity) to a column name
+            start (float, optional): Timestamp that becomes 0 in the time column. Defaults to 0.0.
+
+        Returns:
+            (DataFrame): Column Time (s), and a column per series and entity
+        """
+        df = self.frame(series).copy()
+        df["column"] = [name(s, e) for s, e in zip(df["series"], df["entity"])]
+
+        columns = list(dict.fromkeys(df.sort_index()["column"]))
+        table = df.pivot_table(index="timestamp", columns="column", values="value")
+        table = table.reindex(columns=columns).reset_index()
+        table["timestamp"] -= start
+        table.columns.name = None
+        return table.rename(columns={"timestamp": "Time (s)"})
+
+    def resample(self, series, interval, start=None, end=None, tolerance=None):
+        """Get the as-of value of a series per entity on a regular timebase:
+        the last sample at or before every point in time
+
+        Args:
+            series (str): Series to resample
+            interval (float): Seconds between points in time
+            start (float, optional): First point in time. Defaults to None (first sample).
+            end (float, optional): Last point in time. Defaults to None (last sample).
+            tolerance (float, optional): Max age of a sample in seconds. Defaults to None.
+
+        Returns:
+            (DataFrame): Column timestamp, and a column per entity
+        """
+        import numpy as np  # pylint: disable=import-outside-toplevel
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        df = self.frame(series)
+        if df.empty:
+            return pd.DataFrame(columns=["timestamp"])
+
+        start = df["timestamp"].iloc[0] if start is None else start
+        end = df["timestamp"].iloc[-1] if end is None else end
+        timebase = start + interval * np.arange(int(np.floor((end - start) / interval)) + 1)
+
+        table = {"timestamp": timebase}
+        for entity, group in df.groupby("entity", sort=False):
+            times = group["timestamp"].to_numpy()
+            values = group["value"].to_numpy()
+
+            index = np.searchsorted(times, timebase, side="right") - 1
+            valid = index >= 0
+            if tolerance is not None:
+                valid &= timebase - times[np.maximum(index, 0)] <= tolerance
+
+            table[entity] = np.where(valid, values[np.maximum(index, 0)], np.nan)
+
+        return pd.DataFrame(table)
+
+    def asof(self, series, other, by_entity=True, tolerance=None):
+        """Attach the latest value of another series to every sample of a series
+
+        Args:
+            series (str): Series to take the samples of
+            other (str): Series to join
+            by_entity (bool, optional): Only join samples of the same entity. Defaults to True.
+            tolerance (float, optional): Max age of the joined sample in seconds.
+                Defaults to None.
+
+        Returns:
+            (DataFrame): Columns in SCHEMA, plus other (value of the other series)
+        """
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        left = self.frame(series)
+        right = self.frame(other)[["entity", "timestamp", "value"]]
+        right = right.rename(columns={"value": "other", "entity": "other_entity"})
+
+        by = None
+        if by_entity:
+            right = right.rename(columns={"other_entity": "entity"})
+            by = "entity"
+
+        df = pd.merge_asof(
+            left, right, on="timestamp", by=by, tolerance=tolerance, direction="backward"
+        )
+        return df[SCHEMA + ["other"]]
+
+    def during(self, series, condition, tolerance=None):
+        """Get the samples of a series taken while another series was non-zero,
+        for any entity of the other series (e.g. "cluster" for pods/<status>)
+
+        Args:
+            series (str): Series to take the samples of
+            condition (str): Series that needs to be non-zero
+            tolerance (float, optional): Max age of the condition sample in seconds.
+                Defaults to None.
+
+        Returns:
+            (DataFrame): Samples with the columns in SCHEMA
+        """
+        df = self.asof(series, condition, by_entity=False, tolerance=tolerance)
+        return df.loc[df["other"].fillna(0) != 0, SCHEMA]
+
+
+def check_joined(store, series="power/intel-rapl:0", condition="pods/Running"):
+    """Check that the energy and the Continuum metrics of a run meet in the store, by taking the
+    samples of an energy series while a Continuum series was non-zero
+
+    Args:
+        store (MetricsStore): Store of the run, see MetricsStore.load()
+        series (str, optional): Energy series. Defaults to "power/intel-rapl:0".
+        condition (str, optional): Continuum series. Defaults to "pods/Running".
+
+    Returns:
+        (DataFrame): Samples of the series during the condition, see MetricsStore.during()
+    """
+    for name in [series, condition]:
+        if store.frame(name).empty:
+            logging.warning("No %s metrics in run %s in %s", name, store.run, store.root)
+
+    return store.during(series, condition)
+
+
+def collect(config, starttime, resource_output=None, status=None, timeline=None):
+    """Put all metrics of a benchmark run in a store, and save it to disk
+
+    Args:
+        config (dict): Parsed configuration
+        starttime (float): Invocation time of kubectl apply command
+        resource_output (tuple(DataFrame, DataFrame), optional): Kubernetes and OS metrics,
+            see get_resource_output(). Defaults to None.
+        status (list(dict), optional): Status of all pods over time. Defaults to None.
+        timeline (Timeline, optional): Timestamps of all deployment phases. Defaults to None.
+
+    Returns:
+        MetricsStore: Store with all metrics of the run
+    """
+    store = MetricsStore(config["timestamp"])
+
+    if resource_output is not None:
+        store.add_kube(resource_output[0], starttime)
+        store.add_os(resource_output[1], starttime)
+    if status:
+        store.add_status(status)
+    if timeline is not None:
+        store.add_timeline(timeline, starttime)
+
+    store.save()
+    return store
@@ -1,7 +1,7 @@
 """Manage the stress application"""
 
+from .. import metrics_store
 from ..empty.empty import print_resources
-from ..empty.plot import plot_resources
 
 
 def set_container_location(config):
@@ -78,7 +78,7 @@ def format_output(
     _worker_metrics,
     status=None,
     control=None,
-    _starttime=None,
+    starttime=None,
     _worker_output=None,
     _worker_description=None,
     resource_output=None,
@@ -97,8 +97,13 @@ def format_output(
         worker_description (list(list(str)), optional): Extensive description of each container
         endtime (str, optional): Timestamp of the slowest deployed pod
     """
+    # Only needed for output processing, don't slow down startup
+    from ..empty.plot import plot_resources  # pylint: disable=import-outside-toplevel
+
     # Plot the status of each pod over time
     if status is not None:
         if control is not None:
+            # Store before print_resources() renames the columns, the plots use the tables per VM
+            metrics_store.collect(config, starttime, resource_output, status)
             df_resources = print_resources(config, resource_output)
             plot_resources(df_resources, config["timestamp"], xmax=endtime)
@@ -6,19 +6,16 @@ Check the documentation and help for more information.
 """
 
 import argparse
+import builtins
+import importlib
 import os
 import os.path
 import sys
 import logging
 import time
 
-from application import application
-from execution_model import execution_model
-from infrastructure import infrastructure
-from resource_manager import resource_manager
-
-# pylint: disable-next=redefined-builtin
-from input import input
+# Continuum modules are imported in __main__, so their import cost can be profiled,
+# and so other scripts can import this file without loading all of Continuum
 
 
 def make_wide(formatter, w=120, h=36):
@@ -41,6 +38,89 @@ def make_wide(formatter, w=120, h=36):
         return formatter
 
 
+class ImportProfiler:
+    """Measure the time spent importing each module, for --profile-startup.
+    Both the import statement and importlib.import_module (used for plugins) are timed.
+    """
+
+    def __init__(self):
+        """Initialize the object"""
+        self.start_time = time.perf_counter()
+        self.original_import = builtins.__import__
+        self.original_import_module = importlib.import_module
+
+        # Time per newly loaded module: [including nested imports, excluding nested imports]
+        self.times = {}
+
+        # Time spent in nested imports, per active import
+        self.stack = []
+
+    def timed(self, function, name, *args, **kwargs):
+        """Execute an import function, and record its time if it loaded new modules
+
+        Args:
+            function (function): Original import function
+            name (str): Name of the module to import
+
+        Returns:
+            module: Imported module
+        """
+        loaded = len(sys.modules)
+        start = time.perf_counter()
+        self.stack.append(0.0)
+
+        try:
+            return function(name, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+
+            # Name the import after the first module it loaded, relative imports have no name
+            if len(sys.modules) > loaded:
+                first = list(sys.modules)[loaded]
+                self.times.setdefault(first, [elapsed, elapsed - nested])
+
+    def start(self):
+        """Start timing imports"""
+        builtins.__import__ = lambda name, *args, **kwargs: self.timed(
+            self.original_import, name, *args, **kwargs
+        )
+        importlib.import_module = lambda name, *args, **kwargs: self.timed(
+            self.original_import_module, name, *args, **kwargs
+        )
+
+    def stop(self):
+        """Stop timing imports"""
+        builtins.__import__ = self.original_import
+        importlib.import_module = self.original_import_module
+
+    def report(self, n=25):
+        """Log the most expensive imports
+
+        Args:
+            n (int, optional): Number of imports to report. Defaults to 25.
+        """
+        total = time.perf_counter() - self.start_time
+        imports = sum(t[1] for t in self.times.values())
+
+        logging.info("-" * 78)
+        logging.info("%-40s %-18s %-18s", "Module", "Total (s)", "Self (s)")
+        for name, (inclusive, exclusive) in sorted(
+            self.times.items(), key=lambda item: item[1][0], reverse=True
+        )[:n]:
+            logging.info("%-40s %-18.3f %-18.3f", name, inclusive, exclusive)
+
+        logging.info("-" * 78)
+        logging.info(
+            "Startup took %.3f s, of which %.3f s importing %i modules",
+            total,
+            imports,
+            len(self.times),
+        )
+
+
 def set_logging(args):
     """Enable logging to both stdout and file (BENCHMARK_FOLDER/logs)
     If -v/--verbose is used, stdout will report logging.DEBUG, otherwise only logging.INFO
@@ -139,6 +219,23 @@ def main(args):
 
 
 if __name__ == "__main__":
+    # Imports are timed before argument parsing, as parsing the config imports the plugins
+    profiler = None
+    if "--profile-startup" in sys.argv:
+        profiler = ImportProfiler()
+        profiler.start()
+
+    # pylint: disable=wrong-import-position
+    from application import application
+    from execution_model import execution_model
+    from infrastructure import infrastructure
+    from resource_manager import resource_manager
+
+    # pylint: disable-next=redefined-builtin
+    from input import input
+
+    # pylint: enable=wrong-import-position
+
     # Get input arguments, and validate those arguments
     parser_obj = argparse.ArgumentParser(
         formatter_class=make_wide(argparse.HelpFormatter, w=120, h=500)
@@ -150,12 +247,19 @@ if __name__ == "__main__":
         help="benchmark config file",
     )
     parser_obj.add_argument("-v", "--verbose", action="store_true", help="increase verbosity level")
+    parser_obj.add_argument(
+        "--profile-startup", action="store_true", help="report the time spent importing modules"
+    )
 
     arguments = parser_obj.parse_args()
 
     timestamp = set_logging(arguments)
     arguments.config["timestamp"] = timestamp
 
+    if profiler is not None:
+        profiler.stop()
+        profiler.report()
+
     input.print_input(arguments.config)
 
     main(arguments)
@@ -0,0 +1,484 @@
+"""\
+In-process RAPL energy collector for QEMU VMs, replacing the external `scaphandre qemu` process.
+Host energy is read from every RAPL zone in /sys/class/powercap: all packages (intel-rapl:N) and
+their sub-domains such as core, uncore and dram (intel-rapl:N:M). The energy of a package and its
+sub-domains is attributed to each VM by the CPU time its threads spent on the CPUs of that package,
+relative to the busy time of those CPUs. A thread's time goes to the package of its CPU affinity
+if it's pinned to a single package, or otherwise to the package of the CPU it last ran on. Zones
+that don't belong to a package, like psys, are attributed by the VM's share of all host CPU time.
+DRAM zones are keyed by where the VM's memory is instead: if libvirt bound it to NUMA nodes
+(numatune, visible as cpuset.mems of the VM's cgroups), all CPU time of the VM counts towards the
+DRAM of the packages holding those nodes, split evenly over the nodes.
+
+Per VM and zone, the accumulated energy is written to <root>/<vm>/<zone>/energy_uj, next to the
+zone's name and max_energy_range_uj. This mirrors the powercap layout, and intel-rapl:0 is where
+Scaphandre used to write, so guests read it through the virtiofs share as before. Like the real
+counters, the per-VM counters wrap at max_energy_range_uj; use energy_delta() to subtract them.
+
+Reading energy_uj requires root on most kernels.
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# The sampling loop is shared with the resource usage scripts that run inside the VMs
+from resource_manager.kubecontrol.cloud.sampling import Sampler
+
+POWERCAP = "/sys/class/powercap"
+CPUS = "/sys/devices/system/cpu"
+NODES = "/sys/devices/system/node"
+CGROUP = "/sys/fs/cgroup"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def read_int(path: str) -> int:
+    """Read a file holding a single integer, like energy_uj or cpuacct.usage
+
+    Args:
+        path (str): full path to file
+
+    Returns:
+        int: value in the file
+    """
+    with open(path) as f:
+        return int(f.readline())
+
+
+def energy_delta(prev: int, curr: int, max_range: int) -> int:
+    """Get the energy used between two readings of a RAPL counter, which wraps at max_range
+
+    Args:
+        prev (int): previous counter value in uJ
+        curr (int): current counter value in uJ
+        max_range (int): max_energy_range_uj of the zone
+
+    Returns:
+        int: energy used in uJ
+    """
+    if curr >= prev:
+        return curr - prev
+
+    return curr + max_range - prev
+
+
+def discover_zones() -> Dict[str, Dict]:
+    """Find all RAPL packages and their sub-domains
+
+    Returns:
+        dict(str, dict): path, name, max_energy_range_uj and physical package id (None for
+            zones like psys) per zone, like intel-rapl:0:1
+    """
+    zones = {}
+    for zone in sorted(os.listdir(POWERCAP)):
+        # intel-rapl is the control type, intel-rapl-mmio duplicates the package zones
+        if not zone.startswith("intel-rapl:"):
+            continue
+
+        path = os.path.join(POWERCAP, zone)
+        with open(os.path.join(path, "name")) as f:
+            name = f.readline().strip()
+
+        zones[zone] = {
+            "path": os.path.join(path, "energy_uj"),
+            "name": name,
+            "max": read_int(os.path.join(path, "max_energy_range_uj")),
+            "package": None,
+        }
+
+    # Packages are named package-<physical_package_id>, sub-domains belong to their parent
+    for zone, info in zones.items():
+        parent = zones.get(":".join(zone.split(":")[:2]), info)
+        if parent["name"].startswith("package-"):
+            info["package"] = int(parent["name"].split("-")[1])
+
+    return zones
+
+
+def cpu_packages() -> Dict[int, int]:
+    """Get the physical package (socket) of every host CPU
+
+    Returns:
+        dict(int, int): physical package id per CPU id
+    """
+    packages = {}
+    for cpu in os.listdir(CPUS):
+        path = os.path.join(CPUS, cpu, "topology", "physical_package_id")
+        if cpu[3:].isdigit() and os.path.exists(path):
+            packages[int(cpu[3:])] = read_int(path)
+
+    return packages
+
+
+def parse_list(text: str) -> List[int]:
+    """Parse a kernel CPU or node list, like 0-3,8
+
+    Args:
+        text (str): list in the kernel's format
+
+    Returns:
+        list(int): ids in the list
+    """
+    ids = []
+    for part in text.strip().split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            ids += range(int(first), int(last) + 1)
+        elif part:
+            ids.append(int(part))
+
+    return ids
+
+
+def node_packages(packages: Dict[int, int]) -> Dict[int, int]:
+    """Get the physical package (socket) of every NUMA node
+
+    Args:
+        packages (dict(int, int)): physical package id per CPU id, see cpu_packages()
+
+    Returns:
+        dict(int, int): physical package id per NUMA node, for nodes with CPUs
+    """
+    nodes = {}
+    if not os.path.exists(NODES):
+        return nodes
+
+    for node in os.listdir(NODES):
+        if not (node.startswith("node") and node[4:].isdigit()):
+            continue
+
+        with open(os.path.join(NODES, node, "cpulist")) as f:
+            cpus = [cpu for cpu in parse_list(f.read()) if cpu in packages]
+
+        if cpus:
+            nodes[int(node[4:])] = packages[cpus[0]]
+
+    return nodes
+
+
+def host_busy_usec(packages: Dict[int, int]) -> Dict[Optional[int], int]:
+    """Get the CPU time spent on the host CPUs of every package, excluding idle and iowait.
+
+    Equivalent command:
+    grep ^cpu /proc/stat
+
+    Args:
+        packages (dict(int, int)): physical package id per CPU id, see cpu_packages()
+
+    Returns:
+        dict(int, int): busy CPU time in microseconds per package, and for all CPUs under None
+    """
+    busy = {None: 0}
+    with open("/proc/stat") as f:
+        for line in f:
+            if not line.startswith("cpu"):
+                break
+
+            cpu, *fields = line.split()
+            fields = [int(val) for val in fields]
+
+            # user nice system idle iowait irq softirq steal (guest time is already part of user)
+            usec = (sum(fields[:8]) - fields[3] - fields[4]) * 1_000_000 // CLOCK_TICKS
+            if cpu == "cpu":
+                busy[None] = usec
+            elif int(cpu[3:]) in packages:
+                package = packages[int(cpu[3:])]
+                busy[package] = busy.get(package, 0) + usec
+
+    return busy
+
+
+def qemu_cgroup(pid: int) -> Optional[str]:
+    """Get the cgroup v2 directory of the libvirt machine scope a QEMU process belongs to.
+    Libvirt places the emulator and vCPU threads in sub-cgroups of that scope.
+
+    Args:
+        pid (int): pid of the QEMU process
+
+    Returns:
+        str: full path to the cgroup directory, or None without cgroup v2
+    """
+    with open(f"/proc/{pid}/cgroup") as f:
+        for line in f:
+            hierarchy, _, path = line.rstrip("\n").split(":", 2)
+            if hierarchy == "0" and path != "/":
+                scope = path.split("/libvirt")[0]
+                cgroup = CGROUP + scope
+                if os.path.exists(os.path.join(cgroup, "cpu.stat")):
+                    return cgroup
+
+    return None
+
+
+class EnergyCollector:
+    """Periodically attribute host RAPL energy to QEMU VMs and export it per VM and zone.
+    Uncore energy is attributed by CPU share on its package too, lacking a better per-VM signal.
+    """
+
+    def __init__(self, root: str, vm_pids: Dict[str, int], interval: float = 1.0):
+        """Initialize the collector
+
+        Args:
+            root (str): directory holding a directory per VM, shared with the guest using virtiofs
+            vm_pids (dict(str, int)): pid of the QEMU process per VM name
+            interval (float, optional): seconds between samples. Defaults to 1.0.
+        """
+        self.root = root
+        self.interval = interval
+        self.zones = discover_zones()
+        self.packages = cpu_packages()
+
+        self.pids = dict(vm_pids)
+        self.cgroups = {vm_name: qemu_cgroup(pid) for vm_name, pid in self.pids.items()}
+
+        # Share of the memory of every VM per package, None if not bound to NUMA nodes
+        self.nodes = node_packages(self.packages)
+        self.memory = {vm_name: self.vm_memory_packages(vm_name) for vm_name in self.pids}
+
+        # Accumulated energy per VM and zone, without wrapping
+        self.energy = {vm_name: {zone: 0 for zone in self.zones} for vm_name in self.pids}
+
+        # Busy time per package, and CPU time per thread of every VM
+        self.prev_host_energy = {}
+        self.prev_host_busy = {}
+        self.prev_thread_busy = {}
+
+        self.sampler = Sampler(interval)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def vm_memory_packages(self, vm_name: str) -> Optional[Dict[int, float]]:
+        """Get the share of the memory of a VM per package, from the NUMA nodes libvirt bound
+        its memory to (cpuset.mems in its cgroups). Memory is assumed to be split evenly over the
+        nodes, like the placement does.
+
+        Args:
+            vm_name (str): name of the VM
+
+        Returns:
+            dict(int, float): share of the memory per physical package id, or None if unknown
+        """
+        cgroup = self.cgroups[vm_name]
+        if cgroup is None:
+            return None
+
+        nodes = set()
+        for directory, _, files in os.walk(cgroup):
+            if "cpuset.mems" in files:
+                with open(os.path.join(directory, "cpuset.mems")) as f:
+                    nodes.update(parse_list(f.read()))
+
+        nodes = [node for node in nodes if node in self.nodes]
+        if not nodes:
+            return None
+
+        shares = {}
+        for node in nodes:
+            package = self.nodes[node]
+            shares[package] = shares.get(package, 0.0) + 1.0 / len(nodes)
+
+        return shares
+
+    def vm_threads(self, vm_name: str) -> List[int]:
+        """Get the threads of a VM: all threads in its cgroup, including vhost workers,
+        or otherwise the threads of its QEMU process
+
+        Args:
+            vm_name (str): name of the VM
+
+        Returns:
+            list(int): thread ids
+        """
+        cgroup = self.cgroups[vm_name]
+        if cgroup is None:
+            return [int(tid) for tid in os.listdir(f"/proc/{self.pids[vm_name]}/task")]
+
+        tids = []
+        for directory, _, files in os.walk(cgroup):
+            if "cgroup.threads" in files:
+                with open(os.path.join(directory, "cgroup.threads")) as f:
+                    tids += [int(line) for line in f]
+
+        if not tids:
+            raise FileNotFoundError(2, "No threads left", cgroup)
+
+        return tids
+
+    def thread_package(self, tid: int, cpu: int) -> Optional[int]:
+        """Get the package a thread ran on: the package it's pinned to, or the package of the
+        CPU it last ran on
+
+        Args:
+            tid (int): thread id
+            cpu (int): CPU the thread last ran on
+
+        Returns:
+            int: physical package id, or None if unknown
+        """
+        try:
+            affinity = {self.packages.get(c) for c in os.sched_getaffinity(tid)}
+            if len(affinity) == 1:
+                return affinity.pop()
+        except OSError:
+            pass
+
+        return self.packages.get(cpu)
+
+    def vm_busy_usec(self, vm_name: str) -> Dict[int, Tuple[int, Optional[int]]]:
+        """Get the CPU time used by every thread of a VM, and the package it ran on
+
+        Args:
+            vm_name (str): name of the VM
+
+        Returns:
+            dict(int, tuple(int, int)): CPU time in microseconds and package per thread id
+        """
+        busy = {}
+        for tid in self.vm_threads(vm_name):
+            try:
+                with open(f"/proc/{tid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except (FileNotFoundError, ProcessLookupError):
+                # The thread exited since listing it
+                continue
+
+            # utime and stime, fields 14 and 15 (1-index), in clock ticks, and processor (39)
+            usec = (int(fields[11]) + int(fields[12])) * 1_000_000 // CLOCK_TICKS
+            busy[tid] = (usec, self.thread_package(tid, int(fields[36])))
+
+        return busy
+
+    def write(self, vm_name: str):
+        """Export the energy of a VM per zone, wrapped like the host counter.
+        Files are replaced at once, so readers never see them partially written.
+
+        Args:
+            vm_name (str): name of the VM
+        """
+        for zone, info in self.zones.items():
+            path = os.path.join(self.root, vm_name, zone, "energy_uj")
+            with open(path + ".tmp", "w") as f:
+                f.write(str(self.energy[vm_name][zone] % info["max"]))
+
+            os.replace(path + ".tmp", path)
+
+    def start(self):
+        """Take the first sample, export the zones with zero energy for every VM, and start sampling"""
+        if not self.zones:
+            raise FileNotFoundError(f"No RAPL zones found in {POWERCAP}")
+
+        self.prev_host_energy = {zone: read_int(info["path"]) for zone, info in self.zones.items()}
+        self.prev_host_busy = host_busy_usec(self.packages)
+        for vm_name in self.pids:
+            self.prev_thread_busy[vm_name] = {
+                tid: usec for tid, (usec, _) in self.vm_busy_usec(vm_name).items()
+            }
+
+            for zone, info in self.zones.items():
+                directory = os.path.join(self.root, vm_name, zone)
+                os.makedirs(directory, exist_ok=True)
+                with open(os.path.join(directory, "name"), "w") as f:
+                    f.write(info["name"])
+                with open(os.path.join(directory, "max_energy_range_uj"), "w") as f:
+                    f.write(str(info["max"]))
+
+            self.write(vm_name)
+
+        self.thread.start()
+
+    def sample(self):
+        """Attribute the host energy used since the last sample to the VMs by their CPU share
+        on the package of every zone"""
+        delta_energy = {}
+        for zone, info in self.zones.items():
+            host_energy = read_int(info["path"])
+            delta_energy[zone] = energy_delta(self.prev_host_energy[zone], host_energy, info["max"])
+            self.prev_host_energy[zone] = host_energy
+
+        host_busy = host_busy_usec(self.packages)
+        delta_busy = {
+            package: busy - self.prev_host_busy.get(package, busy)
+            for package, busy in host_busy.items()
+        }
+        self.prev_host_busy = host_busy
+
+        # CPU time of every VM per package since the last sample
+        delta_vm_busy = {}
+        for vm_name in self.pids:
+            # Threads that started since the last sample count from zero
+            prev = self.prev_thread_busy[vm_name]
+            busy = self.vm_busy_usec(vm_name)
+            delta_vm_busy[vm_name] = {None: 0}
+            for tid, (usec, package) in busy.items():
+                delta = max(usec - prev.get(tid, 0), 0)
+                delta_vm_busy[vm_name][None] += delta
+                if package is not None:
+                    vm_busy = delta_vm_busy[vm_name]
+                    vm_busy[package] = vm_busy.get(package, 0) + delta
+
+            self.prev_thread_busy[vm_name] = {tid: usec for tid, (usec, _) in busy.items()}
+
+        for zone, delta in delta_energy.items():
+            package = self.zones[zone]["package"]
+            if package not in delta_busy:
+                package = None
+
+            vm_times = {
+                vm_name: vm_busy.get(package, 0) for vm_name, vm_busy in delta_vm_busy.items()
+            }
+            host_time = delta_busy.get(package, 0)
+            if self.zones[zone]["name"] == "dram":
+                # The time of every VM on this package is replaced by all its time, weighted by
+                # the share of its memory attached to this package. The busy time of the package
+                # is adjusted for all VMs at once, so the shares never add up to more than 1.
+                for vm_name, memory in self.memory.items():
+                    if memory is None:
+                        continue
+
+                    local = vm_times[vm_name]
+                    vm_times[vm_name] = delta_vm_busy[vm_name][None] * memory.get(package, 0.0)
+                    host_time += vm_times[vm_name] - local
+
+            if host_time <= 0:
+                continue
+
+            shares = {vm_name: max(vm_time, 0) / host_time for vm_name, vm_time in vm_times.items()}
+            total = sum(shares.values())
+            for vm_name, share in shares.items():
+                if total > 1.0:
+                    share /= total
+
+                self.energy[vm_name][zone] += int(delta * share)
+
+        for vm_name in self.pids:
+            self.write(vm_name)
+
+    def tick(self) -> bool:
+        """Take a sample, unless a VM or RAPL zone disappeared
+
+        Returns:
+            bool: False to stop sampling
+        """
+        try:
+            self.sample()
+        except FileNotFoundError as e:
+            print(f"Energy collector: stop sampling, {e.filename} disappeared")
+            return False
+
+        return True
+
+    def run(self):
+        """Sample every interval until stopped, or until a VM or RAPL zone disappears"""
+        self.sampler.run(self.tick, self.stop_event)
+        stats = self.sampler.stats()
+        print(
+            f"Energy collector: {stats['ticks']} samples, {stats['missed']} missed, "
+            f"jitter mean {stats['jitter_mean'] * 1000:.3f} ms, "
+            f"max {stats['jitter_max'] * 1000:.3f} ms"
+        )
+
+    def stop(self):
+        """Stop sampling and wait for the sampling thread to exit"""
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
@@ -9,11 +9,15 @@ import re
 import uuid
 import random
 import multiprocessing
+import threading
 from typing import Callable
 from multiprocessing import Pool
 
 # Place in same folder as continuu.py to hijack Continuum processes using Continuum main branch last checked on 2024-06-01.
 import continuum
+import energy_collector
+from application import metrics_store
+from resource_manager.kubecontrol.cloud.sampling import Sampler
 
 
 def print_with_time(to_print: str):
@@ -73,6 +77,76 @@ def init_argparse() -> argparse.ArgumentParser:
         type=int
     )
     
+    parser_obj.add_argument(
+        "--wrk-workload", 
+        choices=list(WRK_WORKLOADS), 
+        help="DeathStarBench social network workload generated by wrk2", 
+        default="read-home-timeline"
+    )
+
+    parser_obj.add_argument(
+        "--wrk-rates", 
+        nargs="+",
+        help="Requests per second: one per run for a constant profile (rate sweep), all in order for a step profile, first and last for a ramp profile", 
+        default=[2056], 
+        type=int
+    )
+
+    parser_obj.add_argument(
+        "--wrk-profile", 
+        choices=["constant", "step", "ramp"], 
+        help="Shape of the load during a run", 
+        default="constant"
+    )
+
+    parser_obj.add_argument(
+        "--wrk-step", 
+        action="store", 
+        help="Seconds per phase of a ramp profile", 
+        default=60, 
+        type=int
+    )
+
+    parser_obj.add_argument(
+        "--wrk-margin", 
+        action="store", 
+        help="Seconds the load runs beyond the measurement, to cover setup before measuring starts", 
+        default=30, 
+        type=int
+    )
+
+    parser_obj.add_argument(
+        "--wrk-threads", 
+        action="store", 
+        help="wrk2 threads", 
+        default=8, 
+        type=int
+    )
+
+    parser_obj.add_argument(
+        "--wrk-connections", 
+        action="store", 
+        help="wrk2 connections", 
+        default=64, 
+        type=int
+    )
+
+    parser_obj.add_argument(
+        "--kill-interval", 
+        action="store", 
+        help="Seconds between pod kills during the measurement", 
+        default=60, 
+        type=int
+    )
+
+    parser_obj.add_argument(
+        "--kill-seed", 
+        action="store", 
+        help="Seed of the pod kill schedule, run i uses seed + i", 
+        default=1, 
+        type=int
+    )
+
     parser_obj.add_argument(
         "--keep-vms", 
         action="store_true", 
@@ -153,15 +227,22 @@ def run_continuum(config_path: str) -> int:
     return -1
 
 
-def run_scaphandre():
-    process = subprocess.Popen('sudo /home/tkemenade/scaphandre/target/release/scaphandre qemu', shell=True, text=True, stdout=subprocess.PIPE, preexec_fn=os.setsid)
+def run_energy_collector(vm_names):
+    """Start the in-process RAPL collector, which exports energy_uj per VM like `scaphandre qemu`.
 
-    # Wait for scaphandre startup by waiting for string "Sending" from "Sending ⚡ metrics"
-    while True:
-        stdout_line = process.stdout.readline()
-        if "Sending" in stdout_line:
-            break
-    return process.pid
+    Args:
+        vm_names (list(str)): names of the VMs to measure
+
+    Returns:
+        EnergyCollector: running collector, or None if the QEMU processes were not found
+    """
+    pids = get_vm_pids(vm_names)
+    if pids is None:
+        return None
+
+    collector = energy_collector.EnergyCollector('/var/lib/libvirt/scaphandre/', {vm_name: int(pid) for vm_name, pid in zip(vm_names, pids)})
+    collector.start()
+    return collector
 
 
 def kill(process_name, pid):
@@ -184,49 +265,101 @@ def get_pid_proc_stat_metrics(pid):
     return usr_time, sys_time
 
 
-def save_synced_resource_usage(sync_with, vm_names, run, limit):
-    if len(vm_names) == 0:
-        print("No vms provided")
-        return
+def get_vm_pids(vm_names):
+    """Get the pid of the QEMU process of each VM
 
-    # Get pid of guest VM processes
+    Args:
+        vm_names (list(str)): names of the VMs
+
+    Returns:
+        list(str): pid per VM, or None if not all VMs are running
+    """
     all_processes = subprocess.run(['ps', '-ef'], check=True, text=True, stdout=subprocess.PIPE).stdout
     vm_processes = [process for process in all_processes.split('\n') if '_tkemenade' in process and 'libvirt+' in process]
     pids = [0] * len(vm_names)
     for vm_process in vm_processes:
         proc_info = vm_process.split()
         guest_name = proc_info[9][6:].split(',')[0]
-        idx = vm_names.index(guest_name)
-        pids[idx] = proc_info[1]
-    
+        if guest_name in vm_names:
+            pids[vm_names.index(guest_name)] = proc_info[1]
+
     if 0 in pids:
         print("pids not valid")
+        return None
+
+    return pids
+
+
+def get_rapl_zones(vm_dir):
+    """Get the RAPL zones exported for a VM by the energy collector.
+
+    Args:
+        vm_dir (str): full path to the directory of the VM
+
+    Returns:
+        list(str): zones, like intel-rapl:0 (package) and intel-rapl:0:0 (sub-domain)
+    """
+    return sorted(zone for zone in os.listdir(vm_dir) if zone.startswith('intel-rapl:'))
+
+
+def get_vm_metrics(sync_with, vm_name, pid, zones):
+    """Get a line with the energy and CPU time of a VM.
+    Format: name energy_intel-rapl:0 usr_time sys_time zone=energy ...
+
+    Args:
+        sync_with (str): directory holding a directory per VM with its RAPL zones
+        vm_name (str): name of the VM
+        pid (str): pid of the QEMU process of the VM
+        zones (list(str)): RAPL zones to include
+
+    Returns:
+        str: metrics line
+    """
+    # cat /proc/[pid]/stat, 1-index: 14 user time, 15 system time
+    proc_usr_time, proc_sys_time = get_first_line(f'/proc/{pid}/stat').split()[13:15]
+    energy = {zone: get_first_line(f'{sync_with}{vm_name}/{zone}/energy_uj').strip() for zone in zones}
+    zone_energy = "".join(f' {zone}={value}' for zone, value in energy.items())
+    return f'{vm_name} {energy.get("intel-rapl:0", 0)} {proc_usr_time} {proc_sys_time}{zone_energy}\n'
+
+
+def save_synced_resource_usage(sync_with, vm_names, run, limit, continuum_run):
+    if len(vm_names) == 0:
+        print("No vms provided")
+        return
+
+    # Get pid of guest VM processes
+    pids = get_vm_pids(vm_names)
+    if pids is None:
         return
 
-    # Wait untill energy_uj created by Scaphandre exists
+    # Wait untill energy_uj created by the energy collector exists
     sync_paths = [sync_with + vm_name + '/intel-rapl:0/energy_uj' for vm_name in vm_names]
     for path in sync_paths:
         while True:
             if os.path.exists(path):
                 break
 
+    # All RAPL zones exported per VM: packages and their sub-domains (core, uncore, dram)
+    zones = get_rapl_zones(sync_with + vm_names[0])
+
     with open(f'/home/tkemenade/continuum/res/{run}_metrics.txt', 'w') as metrics_file:
+        # Counters wrap at max_energy_range_uj, which the parser needs to correct for it
+        max_ranges = [f'{zone}={get_first_line(f"{sync_with}{vm_names[0]}/{zone}/max_energy_range_uj").strip()}' for zone in zones]
+        metrics_file.write(f'# max_energy_range_uj {" ".join(max_ranges)}\n')
+
         metrics_file.write(get_global_proc_stat_metrics())
         for i in range(len(vm_names)):
-            proc_usr_time, proc_sys_time = get_first_line(f'/proc/{pids[i]}/stat').split()[13:15]
-            metrics_file.write(f'{vm_names[i]} {get_first_line(sync_paths[i])} {proc_usr_time} {proc_sys_time}\n')
+            metrics_file.write(get_vm_metrics(sync_with, vm_names[i], pids[i], zones))
         metrics_file.write('\n')
 
-        # cat /proc/[pid]/stat
-        # 1-index
-        # 14 user time
-        # 15 system time
-
-
         prev_modified_times = [get_modified_time(sync_paths[i]) for i in range(len(vm_names))]
         clock_times = [time.time()] * len(vm_names)
         start = time.time()
-        while time.time() - start < limit:
+
+        def poll() -> bool:
+            if time.time() - start >= limit:
+                return False
+
             for i in range(len(vm_names)):
                 new_modified_time = get_modified_time(sync_paths[i])
                 new_clock_time = time.time()
@@ -236,16 +369,32 @@ def save_synced_resource_usage(sync_with, vm_names, run, limit):
                 #     print(f'modified {vm_names[i]} at {new_clock_time}')
                 if modified or new_clock_time - clock_times[i] > 1:
                     metrics_file.write(get_global_proc_stat_metrics())
-                    proc_usr_time, proc_sys_time = get_first_line(f'/proc/{pids[i]}/stat').split()[13:15]
-                    metrics_file.write(f'{vm_names[i]} {get_first_line(sync_paths[i])} {proc_usr_time} {proc_sys_time}\n\n')
+                    metrics_file.write(get_vm_metrics(sync_with, vm_names[i], pids[i], zones) + '\n')
                     
                     prev_modified_times[i] = new_modified_time
                     clock_times[i] = new_clock_time
 
-            time.sleep(0.1)
+            return True
+
+        # Poll on fixed deadlines, so the time spent writing doesn't stretch the polling interval
+        sampler = Sampler(0.1)
+        sampler.run(poll)
+        stats = sampler.stats()
+        print(f"Sync loop: {stats['missed']} polls missed, jitter max {stats['jitter_max'] * 1000:.3f} ms")
 
     print("Exit sync loop")
 
+    # Also store energy and power in the common schema, in the partition of the Continuum run that
+    # deployed the VMs. Every measurement on those VMs is its own source in that partition.
+    root = '/home/tkemenade/continuum/logs/metrics'
+    store = metrics_store.MetricsStore(continuum_run, root=root)
+    store.add_energy(f'/home/tkemenade/continuum/res/{run}_metrics.txt', source=f'energy_{run.replace("/", "_")}')
+    store.save()
+
+    # Both sources should now be in the same run: check that they can be queried together
+    joined = metrics_store.check_joined(metrics_store.MetricsStore.load(continuum_run, root=root))
+    print(f"Joined metrics: {len(joined)} power samples of run {continuum_run} while pods were running")
+
 
 def destroy_vm(vm_name):
     subprocess.run(['virsh', 'destroy', vm_name], check=True, text=True)
@@ -766,98 +915,256 @@ def setup_by_name(name: str, vm_names: [str], host_names: [str], args: argparse.
 
 
 
-def start_wrk2(vm_name: str, host_name: str) -> int:
-    print_with_time(f"Start wrk2 {vm_name}, {host_name}")
-    ssh_process = create_ssh_process(vm_name, host_name)
+# DeathStarBench social network workloads: wrk2 lua script and endpoint
+WRK_WORKLOADS = {
+    "read-home-timeline": ("read-home-timeline.lua", "home-timeline/read"),
+    "compose-post": ("compose-post.lua", "post/compose"),
+    "mixed-workload": ("mixed-workload.lua", "post/compose"),
+}
 
-    ssh_process.stdin.write("nohup kubectl port-forward svc/nginx-thrift 8080 > /dev/null 2>&1 &\n")
 
-    sync_stdout_with_guid(ssh_process)
+def make_load_phases(profile: str, rates: list[int], duration: int, run: int, step: int) -> list[tuple[int, int]]:
+    """Turn a load profile into phases with a constant request rate each.
 
-    # wrk command
-    threads = 8
-    connections = 64
-    duration = 6000  # in seconds = 1 2/3 hour
-    requests_per_sec = 2056
-    # wrk -D exp -t 8 -c 64 -d 6000s -L -s ~/DeathStarBench/socialNetwork/wrk2/scripts/social-network/read-home-timeline.lua http://localhost:8080/wrk2-api/home-timeline/read -R 2056
-    # ssh_process.stdin.write(f"wrk -D exp -t {threads} -c {connections} -d {duration}s -L -s ~/DeathStarBench/socialNetwork/wrk2/scripts/social-network/compose-post.lua http://localhost:8080/wrk2-api/post/compose -R {requests_per_sec}\n")
-    ssh_process.stdin.write(f"wrk -D exp -t {threads} -c {connections} -d {duration}s -L -s ~/DeathStarBench/socialNetwork/wrk2/scripts/social-network/read-home-timeline.lua http://localhost:8080/wrk2-api/home-timeline/read -R {requests_per_sec}\n")
+    Profiles:
+    - constant: one rate for the whole run, run i uses rate i (modulo), so runs sweep the rates
+    - step: every rate in turn, each for an equal part of the run
+    - ramp: from the first to the last rate in phases of `step` seconds
 
-    ssh_process.stdin.write('\n')
+    Args:
+        profile (str): constant, step or ramp
+        rates (list(int)): requests per second
+        duration (int): length of the run in seconds
+        run (int): index of the run
+        step (int): length of a ramp phase in seconds
 
-    # wrk -D exp -t <num-threads> -c <num-conns> -d <duration> -L -s ~/DeathStarBench/socialNetwork/wrk2/scripts/social-network/mixed-workload.lua http://localhost:8080/wrk2-api/post/compose -R <reqs-per-sec>
-    # wrk -D exp -t 2 -c 10 -d 10s -L -s ~/DeathStarBench/socialNetwork/wrk2/scripts/social-network/compose-post.lua http://localhost:8080/wrk2-api/post/compose -R 100
-    
-    return ssh_process.pid
+    Returns:
+        list(tuple(int, int)): request rate and duration in seconds per phase
+    """
+    if profile == "constant":
+        return [(rates[run % len(rates)], duration)]
 
+    if profile == "step":
+        length = max(duration // len(rates), 1)
+        return [(rate, length) for rate in rates]
 
-def get_running_pods(ssh_process):
-    sync_stdout_with_guid(ssh_process)
-    pods = []
-    ssh_process.stdin.write("kubectl get pod --field-selector=status.phase==Running\n")
-    ssh_process.stdin.write("echo \"END OF OUT\"\n")
+    phases = max(duration // step, 1)
+    first, last = rates[0], rates[-1]
+    return [(round(first + (last - first) * i / max(phases - 1, 1)), step) for i in range(phases)]
+
+
+def parse_wrk_output(output: str) -> dict:
+    """Get the achieved throughput, latency percentiles and errors from wrk2 output with -L.
+
+    Args:
+        output (str): stdout of wrk2
+
+    Returns:
+        dict: requests/sec, latency percentiles in ms, and error count
+    """
+    units = {"us": 0.001, "ms": 1, "s": 1000, "m": 60000}
+    result = {"requests_per_sec": 0.0, "errors": 0}
+    in_distribution = False
+    for line in output.split('\n'):
+        fields = line.split()
+        if line.startswith("Requests/sec:"):
+            result["requests_per_sec"] = float(fields[1])
+        elif line.startswith("  Socket errors:"):
+            result["errors"] += sum(int(field.strip(",")) for field in fields[3::2])
+        elif line.startswith("  Non-2xx or 3xx responses:"):
+            result["errors"] += int(fields[-1])
+        elif "Latency Distribution (HdrHistogram - Recorded Latency)" in line:
+            in_distribution = True
+        elif in_distribution and len(fields) == 2 and fields[0].endswith("%"):
+            value = re.match(r'([0-9.]+)([a-z]+)', fields[1])
+            if value:
+                result[f'p{float(fields[0][:-1]):g}'] = float(value.group(1)) * units[value.group(2)]
+        elif in_distribution and fields:
+            in_distribution = False
+
+    return result
+
+
+class LoadGenerator:
+    """Run wrk2 against the DeathStarBench social network, one phase after the other.
+    wrk2 runs non-interactively over SSH. Per phase, its full output including the HdrHistogram
+    is stored in the run directory, and a summary line is appended to <run>_wrk.txt.
+    """
+
+    def __init__(self, vm_name: str, host_name: str, run: str, phases: list[tuple[int, int]], args: argparse.Namespace):
+        """Initialize the load generator
+
+        Args:
+            vm_name (str): name of the cloud controller VM
+            host_name (str): host of the cloud controller VM
+            run (str): name of the run, used for the output files
+            phases (list(tuple(int, int))): request rate and duration per phase, see make_load_phases()
+            args (Namespace): Argparse object
+        """
+        self.ssh = ['ssh', f'{vm_name}@{host_name}', '-i', '/home/tkemenade/.ssh/id_rsa_continuum']
+        self.run = run
+        self.phases = phases
+        self.args = args
+
+        self.process = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run_phases, daemon=True)
+
+    def command(self, rate: int, duration: int) -> str:
+        """wrk2 command for one phase
+
+        Args:
+            rate (int): requests per second
+            duration (int): length of the phase in seconds
+
+        Returns:
+            str: shell command to run on the cloud controller
+        """
+        script, endpoint = WRK_WORKLOADS[self.args.wrk_workload]
+        return (f'wrk -D exp -t {self.args.wrk_threads} -c {self.args.wrk_connections} -d {duration}s -L '
+                f'-s ~/DeathStarBench/socialNetwork/wrk2/scripts/social-network/{script} '
+                f'http://localhost:8080/wrk2-api/{endpoint} -R {rate}')
+
+    def start(self):
+        """Forward the nginx-thrift service to the cloud controller, and start the first phase"""
+        print_with_time(f"Start wrk2 {self.ssh[1]} with phases {self.phases}")
+        subprocess.run(self.ssh + ['nohup kubectl port-forward svc/nginx-thrift 8080 > /dev/null 2>&1 &'], check=True)
+        self.thread.start()
+
+    def run_phases(self):
+        """Run all phases in order, and store their output"""
+        with open(f'/home/tkemenade/continuum/res/{self.run}_wrk.txt', 'w') as summary_file:
+            summary_file.write('start end rate requests_per_sec p50 p99 p99.9 errors\n')
+
+            for i, (rate, duration) in enumerate(self.phases):
+                if self.stopped.is_set():
+                    return
+
+                start = time.time()
+                self.process = subprocess.Popen(self.ssh + [self.command(rate, duration)], text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+                output, _ = self.process.communicate()
+                end = time.time()
+
+                with open(f'/home/tkemenade/continuum/res/{self.run}_wrk_{i}_{rate}.txt', 'w') as output_file:
+                    output_file.write(output)
+
+                result = parse_wrk_output(output)
+                summary_file.write(f'{start} {end} {rate} {result["requests_per_sec"]} {result.get("p50", -1)} '
+                                   f'{result.get("p99", -1)} {result.get("p99.9", -1)} {result["errors"]}\n')
+                summary_file.flush()
+
+    def stop(self):
+        """Stop the running phase, its output up to now is still stored"""
+        self.stopped.set()
+        if self.process is not None and self.process.poll() is None:
+            # Killing the local SSH client doesn't stop wrk2 on the controller
+            subprocess.run(self.ssh + ['pkill -INT -x wrk'], check=False)
+            kill("wrk2", self.process.pid)
+        if self.thread.is_alive():
+            self.thread.join()
+
+
+# DeathStarBench social network services whose pods may be killed
+KILLABLE_SERVICES = [
+    "compose-post-service", 
+    "home-timeline-redis", 
+    "home-timeline-service", 
+    "jaeger", 
+    # "media-frontend",  # Exlcude slow starting service from kill
+    "media-memcached", 
+    "media-mongodb", 
+    "media-service", 
+    # "nginx-thrift",  # Exlcude slow starting service from kill
+    "post-storage-memcached", 
+    "post-storage-mongodb", 
+    "post-storage-service", 
+    "social-graph-mongodb", 
+    "social-graph-redis", 
+    "social-graph-service", 
+    "text-service", 
+    "unique-id-service", 
+    "url-shorten-memcached", 
+    "url-shorten-mongodb", 
+    "url-shorten-service", 
+    "user-memcached", 
+    "user-mention-service", 
+    "user-mongodb", 
+    "user-service", 
+    "user-timeline-mongodb", 
+    "user-timeline-redis", 
+    "user-timeline-service"
+]
+
+
+def make_kill_schedule(seed: int, duration: int, interval: int, per_kill: int = 3) -> list[tuple[int, list[str]]]:
+    """Precompute when pods of which services are killed, so runs with the same seed are comparable.
+    Services are sampled without replacement, so a kill never waits on enough pods to be Running.
+
+    Args:
+        seed (int): seed for the random generator
+        duration (int): length of the measurement in seconds
+        interval (int): seconds between kills
+        per_kill (int, optional): number of services to kill a pod of each time. Defaults to 3.
+
+    Returns:
+        list(tuple(int, list(str))): seconds since the start, and services to kill a pod of
+    """
+    rng = random.Random(seed)
+    return [(offset, sorted(rng.sample(KILLABLE_SERVICES, per_kill))) for offset in range(interval, duration + 1, interval)]
+
+
+def kill_pods(ssh_process, services: list[str]) -> list[str]:
+    """Delete one Running pod of each service with a single batched kubectl delete.
+
+    Args:
+        ssh_process (Popen): persistent SSH session to the cloud controller
+        services (list(str)): services to kill a pod of
+
+    Returns:
+        list(str): deleted pods
+    """
+    # Pod names are <deployment>-<replicaset hash>-<pod hash>
+    marker = str(uuid.uuid4())
+    select = " ".join(f'$(echo "$pods" | grep -m 1 -E "^pod/{service}-[a-z0-9]+-[a-z0-9]+$")' for service in services)
+    ssh_process.stdin.write(
+        f'pods=$(kubectl get pod --field-selector=status.phase==Running -o name); '
+        f'echo {select} | xargs -r kubectl delete --wait=false; echo "{marker}"\n'
+    )
+
+    deleted = []
     while True:
         line = ssh_process.stdout.readline()
-        if "Running" in line:
-            pods.append(line.split()[0])
-            continue
-        if "END OF OUT" in line and "echo" not in line :
-            break
-    return pods
+        if marker in line and "echo" not in line:
+            return deleted
+        if line.startswith('pod "') and "deleted" in line:
+            deleted.append(line.split('"')[1])
 
 
-def kill_predefined_pod_randomly(vm_name: str, host_name: str, interval: int):
-    pods = [
-        "compose-post-service", 
-        "home-timeline-redis", 
-        "home-timeline-service", 
-        "jaeger", 
-        # "media-frontend",  # Exlcude slow starting service from kill
-        "media-memcached", 
-        "media-mongodb", 
-        "media-service", 
-        # "nginx-thrift",  # Exlcude slow starting service from kill
-        "post-storage-memcached", 
-        "post-storage-mongodb", 
-        "post-storage-service", 
-        "social-graph-mongodb", 
-        "social-graph-redis", 
-        "social-graph-service", 
-        "text-service", 
-        "unique-id-service", 
-        "url-shorten-memcached", 
-        "url-shorten-mongodb", 
-        "url-shorten-service", 
-        "user-memcached", 
-        "user-mention-service", 
-        "user-mongodb", 
-        "user-service", 
-        "user-timeline-mongodb", 
-        "user-timeline-redis", 
-        "user-timeline-service"
-    ]
-    random.seed(1)
+def kill_pods_on_schedule(vm_name: str, host_name: str, run: str, schedule: list[tuple[int, list[str]]]):
+    """Kill pods following a precomputed schedule, and record the exact kill times in the run directory.
+    Each kill is one round trip over a single SSH session, there is no polling in between.
+
+    Args:
+        vm_name (str): name of the cloud controller VM
+        host_name (str): host of the cloud controller VM
+        run (str): name of the run, used for the output file
+        schedule (list(tuple(int, list(str)))): kill schedule, see make_kill_schedule()
+    """
     ssh_process = create_ssh_process(vm_name, host_name)
-    while True:
-        time.sleep(interval)
-        to_kill = []
-        running_pods = get_running_pods(ssh_process)
-        running_pods.sort()
-        it = 0
-        while it < 3:
-            idx = random.randrange(len(running_pods))
-            pod_to_kill = running_pods[idx]
-            found = False
-            for allowed_pod in pods:
-                if allowed_pod in pod_to_kill:
-                    found = True
-                    to_kill.append(pod_to_kill) 
-            if found:
-                it += 1
-        for pod_to_kill in to_kill:
-            ssh_process.stdin.write(f'kubectl delete pod {pod_to_kill}\n')
-            print_with_time(f'KILL INTERVAL: killed {pod_to_kill}')
-            
+    sync_stdout_with_guid(ssh_process)
+
+    start = time.time()
+    with open(f'/home/tkemenade/continuum/res/{run}_kills.txt', 'w') as kills_file:
+        for offset, services in schedule:
+            time.sleep(max(start + offset - time.time(), 0))
+
+            for pod in kill_pods(ssh_process, services):
+                kill_time = time.time()
+                kills_file.write(f'{kill_time} {pod}\n')
+                print_with_time(f'KILL INTERVAL: killed {pod}')
+
+            kills_file.flush()
+
 
 def run_benchmark(parser_obj: argparse.ArgumentParser, args: argparse.Namespace):
     if (False):
@@ -908,16 +1215,13 @@ def run_benchmark(parser_obj: argparse.ArgumentParser, args: argparse.Namespace)
             for vm_name in vm_names:
                 os.makedirs('/var/lib/libvirt/scaphandre/' + vm_name + '/intel-rapl:0', exist_ok=True)
             
-            print_with_time('\tStart Scaphandre')
-            start_scaphandre = time.time()
-            pid = -1
+            print_with_time('\tStart energy collector')
+            start_collector = time.time()
+            collector = None
             if (benchmark_on):
-                pid = run_scaphandre()
-            end_scaphandre = time.time()
-            print_with_time('\tStarted Scaphandre')
-            
-            # Time for Scaphandre to finish
-            time.sleep(1)
+                collector = run_energy_collector(list(vm_names))
+            end_collector = time.time()
+            print_with_time('\tStarted energy collector')
 
             print_with_time('\tStart setup')
             start_setup = time.time()
@@ -928,31 +1232,35 @@ def run_benchmark(parser_obj: argparse.ArgumentParser, args: argparse.Namespace)
             
             # Time for setup to finish
             time.sleep(1)
-            pids.append(start_wrk2(vm_names[0], host_names[0]))
+            load_phases = make_load_phases(args.wrk_profile, args.wrk_rates, arguments.measure_interval + args.wrk_margin, i, args.wrk_step)
+            load_generator = LoadGenerator(vm_names[0], host_names[0], run_name, load_phases, args)
+            load_generator.start()
             # input("ENTER TO CONTINUE TO MEASURE")
-            kill_proc = multiprocessing.Process(target=kill_predefined_pod_randomly, args=(vm_names[0], host_names[0], 60))
-            # kill_predefined_pod_randomly(vm_names[0], host_names[0], 60)
+            kill_schedule = make_kill_schedule(args.kill_seed + i, arguments.measure_interval, args.kill_interval)
+            kill_proc = multiprocessing.Process(target=kill_pods_on_schedule, args=(vm_names[0], host_names[0], run_name, kill_schedule))
             kill_proc.start()
             print_with_time(f'\tStart measurement {run_name} with {arguments.measure_interval} iterations with vms: {", ".join(vm_names)}')
 
             start_resource_usage_sync = time.time()
             if (benchmark_on):
-                save_synced_resource_usage('/var/lib/libvirt/scaphandre/', vm_names, run_name, arguments.measure_interval)
+                save_synced_resource_usage('/var/lib/libvirt/scaphandre/', vm_names, run_name, arguments.measure_interval, metrics_store.log_run(log_filename))
             end_resource_usage_sync = time.time()
 
             kill_proc.terminate()
+            load_generator.stop()
 
             if (benchmark_on):
                 # Store some metrics about times and active processes.
                 with open(f'/home/tkemenade/continuum/res/{run_name}_METADATA.txt', 'w') as meta_file:
                     meta_file.write(f'Continuum deployment time {end_continuum - start_continuum}\n')
                     meta_file.write(f'Stack setup time {end_setup - start_setup}\n')
-                    meta_file.write(f'Scaphandre open process time {end_scaphandre - start_scaphandre}\n')
+                    meta_file.write(f'Collector start time {end_collector - start_collector}\n')
                     meta_file.write(f'Sync metrics time {end_resource_usage_sync - start_resource_usage_sync}\n')
                     meta_file.write(f'VMs active {get_vm_count()}\nVMs experiment {len(vm_names)}\n')
 
-            # Scaphandre always killed to prevent unmanaged dangling Scaphandre thread.
-            kill("Scaphandre", pid)
+            # Collector always stopped to prevent a dangling sampling thread.
+            if collector is not None:
+                collector.stop()
             # Cleanup setup that is still running.
             for pid in pids:
                 print(f"Killing {pid}")
@@ -969,7 +1277,7 @@ def run_benchmark(parser_obj: argparse.ArgumentParser, args: argparse.Namespace)
             
             print_with_time(f'\tFinished measurement {run_name} with {arguments.measure_interval} iterations with vms: {", ".join(vm_names)}')
 
-            # Cooldown to prevent Scaphandre from crashing.
+            # Cooldown before the next run.
             time.sleep(3)
         print_with_time(f'Finished experiment {experiment_name}')
 
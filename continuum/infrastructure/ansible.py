@@ -1,12 +1,34 @@
 """\
-Generate Ansible inventory files
+Generate Ansible inventory files and configuration
+Inventory files are only rewritten when their content changes, and all playbooks share a
+configuration with a persistent fact cache, SSH pipelining, and a fork count based on the
+number of hosts, so facts are gathered once per host instead of once per playbook.
 """
 
 import sys
 import logging
+import io
 import os
 import re
 
+# Bounds for the number of hosts Ansible manages in parallel
+MIN_FORKS = 5
+MAX_FORKS = 50
+
+ANSIBLE_CFG = """\
+[defaults]
+forks = %i
+gathering = smart
+fact_caching = jsonfile
+fact_caching_connection = %s
+fact_caching_timeout = 86400
+host_key_checking = False
+
+[ssh_connection]
+pipelining = True
+ssh_args = -o ControlMaster=auto -o ControlPersist=60s
+"""
+
 
 def check_output(out):
     """Check if an Ansible Playbook succeeded or failed
@@ -39,6 +61,72 @@ def check_output(out):
         sys.exit()
 
 
+def write_file(config, name, content):
+    """Write a generated file to the .continuum directory, only if its content changed.
+    Ansible runs on the local machine, so the file is only needed there.
+
+    Args:
+        config (dict): Parsed configuration
+        name (str): File name inside .continuum
+        content (str): File content
+
+    Returns:
+        bool: The file has been (re)written
+    """
+    path = os.path.join(config["infrastructure"]["base_path"], ".continuum", name)
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == content:
+                logging.debug("%s is up to date", path)
+                return False
+    except FileNotFoundError:
+        pass
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+    return True
+
+
+def configure(config, machines):
+    """Generate the Ansible configuration used by all playbooks of this run.
+    Cached facts of VMs are removed, as VMs are (re)created with the same names every run.
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+    """
+    logging.info("Generate Ansible configuration file")
+    facts = os.path.join(config["infrastructure"]["base_path"], ".continuum", "ansible_facts")
+    os.makedirs(facts, exist_ok=True)
+
+    hosts = len(machines)
+    for machine in machines:
+        names = (
+            machine.base_names
+            + machine.cloud_controller_names
+            + machine.cloud_names
+            + machine.edge_names
+            + machine.endpoint_names
+        )
+        hosts += len(names)
+
+        for name in names:
+            try:
+                os.remove(os.path.join(facts, name))
+            except FileNotFoundError:
+                pass
+
+    forks = max(MIN_FORKS, min(hosts, MAX_FORKS))
+    write_file(config, "ansible.cfg", ANSIBLE_CFG % (forks, facts))
+
+    # Ansible-playbook runs as a subprocess of Continuum, and inherits this setting
+    os.environ["ANSIBLE_CONFIG"] = os.path.join(
+        config["infrastructure"]["base_path"], ".continuum", "ansible.cfg"
+    )
+
+
 def create_inventory_machine(config, machines):
     """Create ansible inventory for creating VMs, so ssh to all physical machines is needed
 
@@ -47,148 +135,150 @@ def create_inventory_machine(config, machines):
         machines (list(Machine object)): List of machine objects representing physical machines
     """
     logging.info("Generate Ansible inventory file for physical machines")
-    with open(".tmp/inventory", "w", encoding="utf-8") as f:
-        # Shared variables between all groups
-        f.write("[all:vars]\n")
-        f.write("ansible_python_interpreter=/usr/bin/python3\n")
-        f.write("ansible_ssh_common_args='-o StrictHostKeyChecking=no'\n")
-        f.write("base_path=%s\n" % (config["infrastructure"]["base_path"]))
-        f.write("username=%s\n" % (config["username"]))
+    f = io.StringIO()
+    # Shared variables between all groups
+    f.write("[all:vars]\n")
+    f.write("ansible_python_interpreter=/usr/bin/python3\n")
+    f.write("ansible_ssh_common_args='-o StrictHostKeyChecking=no'\n")
+    f.write("base_path=%s\n" % (config["infrastructure"]["base_path"]))
+    f.write("username=%s\n" % (config["username"]))
+
+    # All hosts group
+    f.write("\n[all_hosts]\n")
+
+    for machine in machines:
+        base = ""
+        if config["infrastructure"]["infra_only"]:
+            base = "base=%s" % (machine.base_names[0])
+
+        if machine.is_local:
+            f.write(
+                "localhost ansible_connection=local username=%s %s\n" % (machine.user, base)
+            )
+        else:
+            f.write(
+                "%s ansible_connection=ssh ansible_host=%s ansible_user=%s username=%s %s\n"
+                % (
+                    machine.name_sanitized,
+                    machine.ip,
+                    machine.user,
+                    machine.user,
+                    base,
+                )
+            )
 
-        # All hosts group
-        f.write("\n[all_hosts]\n")
+    # Specific cloud/edge/endpoint groups for installing RM software
+    # For machines with cloud VMs
+    if config["infrastructure"]["cloud_nodes"]:
+        f.write("\n[clouds]\n")
+        clouds = 0
 
         for machine in machines:
-            base = ""
-            if config["infrastructure"]["infra_only"]:
-                base = "base=%s" % (machine.base_names[0])
+            if machine.cloud_controller + machine.clouds == 0:
+                continue
+
+            base = machine.base_names[0]
+            if not config["infrastructure"]["infra_only"]:
+                base = [name for name in machine.base_names if "_cloud_" in name][0]
 
             if machine.is_local:
                 f.write(
-                    "localhost ansible_connection=local username=%s %s\n" % (machine.user, base)
+                    "localhost ansible_connection=local cloud_controller=%i \
+cloud_start=%i cloud_end=%i base_cloud=%s\n"
+                    % (
+                        machine.cloud_controller,
+                        clouds,
+                        clouds + machine.clouds - 1,
+                        base,
+                    )
                 )
             else:
                 f.write(
-                    "%s ansible_connection=ssh ansible_host=%s ansible_user=%s username=%s %s\n"
+                    "%s ansible_connection=ssh ansible_host=%s ansible_user=%s \
+cloud_controller=%i cloud_start=%i cloud_end=%i base_cloud=%s\n"
                     % (
                         machine.name_sanitized,
                         machine.ip,
                         machine.user,
-                        machine.user,
+                        machine.cloud_controller,
+                        clouds,
+                        clouds + machine.clouds - 1,
                         base,
                     )
                 )
 
-        # Specific cloud/edge/endpoint groups for installing RM software
-        # For machines with cloud VMs
-        if config["infrastructure"]["cloud_nodes"]:
-            f.write("\n[clouds]\n")
-            clouds = 0
+            clouds += machine.clouds
 
-            for machine in machines:
-                if machine.cloud_controller + machine.clouds == 0:
-                    continue
+    # For machines with edge VMs
+    if config["infrastructure"]["edge_nodes"]:
+        f.write("\n[edges]\n")
+        edges = 0
 
-                base = machine.base_names[0]
-                if not config["infrastructure"]["infra_only"]:
-                    base = [name for name in machine.base_names if "_cloud_" in name][0]
-
-                if machine.is_local:
-                    f.write(
-                        "localhost ansible_connection=local cloud_controller=%i \
-cloud_start=%i cloud_end=%i base_cloud=%s\n"
-                        % (
-                            machine.cloud_controller,
-                            clouds,
-                            clouds + machine.clouds - 1,
-                            base,
-                        )
-                    )
-                else:
-                    f.write(
-                        "%s ansible_connection=ssh ansible_host=%s ansible_user=%s \
-cloud_controller=%i cloud_start=%i cloud_end=%i base_cloud=%s\n"
-                        % (
-                            machine.name_sanitized,
-                            machine.ip,
-                            machine.user,
-                            machine.cloud_controller,
-                            clouds,
-                            clouds + machine.clouds - 1,
-                            base,
-                        )
-                    )
-
-                clouds += machine.clouds
-
-        # For machines with edge VMs
-        if config["infrastructure"]["edge_nodes"]:
-            f.write("\n[edges]\n")
-            edges = 0
-
-            for machine in machines:
-                if machine.edges == 0:
-                    continue
+        for machine in machines:
+            if machine.edges == 0:
+                continue
 
-                base = machine.base_names[0]
-                if not config["infrastructure"]["infra_only"]:
-                    base = [name for name in machine.base_names if "_edge_" in name][0]
+            base = machine.base_names[0]
+            if not config["infrastructure"]["infra_only"]:
+                base = [name for name in machine.base_names if "_edge_" in name][0]
 
-                if machine.is_local:
-                    f.write(
-                        "localhost ansible_connection=local edge_start=%i \
+            if machine.is_local:
+                f.write(
+                    "localhost ansible_connection=local edge_start=%i \
 edge_end=%i base_edge=%s\n"
-                        % (edges, edges + machine.edges - 1, base)
-                    )
-                else:
-                    f.write(
-                        "%s ansible_connection=ssh ansible_host=%s ansible_user=%s \
+                    % (edges, edges + machine.edges - 1, base)
+                )
+            else:
+                f.write(
+                    "%s ansible_connection=ssh ansible_host=%s ansible_user=%s \
 edge_start=%i edge_end=%i base_edge=%s\n"
-                        % (
-                            machine.name_sanitized,
-                            machine.ip,
-                            machine.user,
-                            edges,
-                            edges + machine.edges - 1,
-                            base,
-                        )
+                    % (
+                        machine.name_sanitized,
+                        machine.ip,
+                        machine.user,
+                        edges,
+                        edges + machine.edges - 1,
+                        base,
                     )
+                )
 
-                edges += machine.edges
+            edges += machine.edges
 
-        # For machines with endpoint VMs
-        if config["infrastructure"]["endpoint_nodes"]:
-            f.write("\n[endpoints]\n")
-            endpoints = 0
-            for machine in machines:
-                if machine.endpoints == 0:
-                    continue
-
-                base = machine.base_names[0]
-                if not config["infrastructure"]["infra_only"]:
-                    base = [name for name in machine.base_names if "_endpoint" in name][0]
-
-                if machine.is_local:
-                    f.write(
-                        "localhost ansible_connection=local endpoint_start=%i \
+    # For machines with endpoint VMs
+    if config["infrastructure"]["endpoint_nodes"]:
+        f.write("\n[endpoints]\n")
+        endpoints = 0
+        for machine in machines:
+            if machine.endpoints == 0:
+                continue
+
+            base = machine.base_names[0]
+            if not config["infrastructure"]["infra_only"]:
+                base = [name for name in machine.base_names if "_endpoint" in name][0]
+
+            if machine.is_local:
+                f.write(
+                    "localhost ansible_connection=local endpoint_start=%i \
 endpoint_end=%i base_endpoint=%s\n"
-                        % (endpoints, endpoints + machine.endpoints - 1, base)
-                    )
-                else:
-                    f.write(
-                        "%s ansible_connection=ssh ansible_host=%s ansible_user=%s \
+                    % (endpoints, endpoints + machine.endpoints - 1, base)
+                )
+            else:
+                f.write(
+                    "%s ansible_connection=ssh ansible_host=%s ansible_user=%s \
 endpoint_start=%i endpoint_end=%i base_endpoint=%s\n"
-                        % (
-                            machine.name_sanitized,
-                            machine.ip,
-                            machine.user,
-                            endpoints,
-                            endpoints + machine.endpoints - 1,
-                            base,
-                        )
+                    % (
+                        machine.name_sanitized,
+                        machine.ip,
+                        machine.user,
+                        endpoints,
+                        endpoints + machine.endpoints - 1,
+                        base,
                     )
+                )
+
+            endpoints += machine.endpoints
 
-                endpoints += machine.endpoints
+    write_file(config, "inventory", f.getvalue())
 
 
 def create_inventory_vm(config, machines):
@@ -200,84 +290,82 @@ def create_inventory_vm(config, machines):
     """
     logging.info("Generate Ansible inventory file for VMs")
 
-    with open(".tmp/inventory_vms", "w", encoding="utf-8") as f:
-        f.write("[all:vars]\n")
-        f.write("ansible_python_interpreter=/usr/bin/python3\n")
-        f.write("ansible_ssh_common_args='-o StrictHostKeyChecking=no'\n")
-        f.write("ansible_ssh_private_key_file=%s\n" % (config["ssh_key"]))
-                            
-        f.write(f"virtiofsd={config['infrastructure']['virtiofsd']}\n")
+    f = io.StringIO()
+    f.write("[all:vars]\n")
+    f.write("ansible_python_interpreter=/usr/bin/python3\n")
+    f.write("ansible_ssh_common_args='-o StrictHostKeyChecking=no'\n")
+    f.write("ansible_ssh_private_key_file=%s\n" % (config["ssh_key"]))
+                        
+    f.write(f"virtiofsd={config['infrastructure']['virtiofsd']}\n")
 
-        if "registry" in config:
-            f.write("registry_ip=%s\n" % (config["registry"]))
+    if "registry" in config:
+        f.write("registry_ip=%s\n" % (config["registry"]))
 
-        f.write(
-            "continuum_home=%s\n"
-            % (os.path.join(config["infrastructure"]["base_path"], ".continuum"))
-        )
+    f.write(
+        "continuum_home=%s\n"
+        % (os.path.join(config["infrastructure"]["base_path"], ".continuum"))
+    )
 
-        # Tier specific groups
-        if (config["mode"] == "cloud" or config["mode"] == "edge") and (
-            "benchmark" in config and config["benchmark"]["resource_manager"] != "mist"
-        ):
-            f.write("cloud_ip=%s\n" % (machines[0].cloud_controller_ips_internal[0]))
-            f.write("cloud_ip_external=%s\n" % (machines[0].cloud_controller_ips[0]))
+    # Tier specific groups
+    if (config["mode"] == "cloud" or config["mode"] == "edge") and (
+        "benchmark" in config and config["benchmark"]["resource_manager"] != "mist"
+    ):
+        f.write("cloud_ip=%s\n" % (machines[0].cloud_controller_ips_internal[0]))
+        f.write("cloud_ip_external=%s\n" % (machines[0].cloud_controller_ips[0]))
 
-            # Cloud controller (is always on machine 0)
-            f.write("\n[cloudcontroller]\n")
-            f.write(
-                "%s ansible_connection=ssh ansible_host=%s ansible_user=%s \
+        # Cloud controller (is always on machine 0)
+        f.write("\n[cloudcontroller]\n")
+        f.write(
+            "%s ansible_connection=ssh ansible_host=%s ansible_user=%s \
 username=%s cloud_mode=%i kubeversion=%s kubeversion_major=%s\n"
-                % (
-                    machines[0].cloud_controller_names[0],
-                    machines[0].cloud_controller_ips[0],
-                    machines[0].cloud_controller_names[0],
-                    machines[0].cloud_controller_names[0],
-                    config["mode"] == "cloud",
-                    config["benchmark"]["kube_version"][1:],
-                    config["benchmark"]["kube_version"][:-2],
-                )
+            % (
+                machines[0].cloud_controller_names[0],
+                machines[0].cloud_controller_ips[0],
+                machines[0].cloud_controller_names[0],
+                machines[0].cloud_controller_names[0],
+                config["mode"] == "cloud",
+                config["benchmark"]["kube_version"][1:],
+                config["benchmark"]["kube_version"][:-2],
             )
+        )
 
-        # Cloud worker VM group
-        if config["mode"] == "cloud":
-            f.write("\n[clouds]\n")
+    # Cloud worker VM group
+    if config["mode"] == "cloud":
+        f.write("\n[clouds]\n")
 
-            for machine in machines:
-                for name, ip in zip(machine.cloud_names, machine.cloud_ips):
-                    f.write(
-                        "%s ansible_connection=ssh ansible_host=%s \
+        for machine in machines:
+            for name, ip in zip(machine.cloud_names, machine.cloud_ips):
+                f.write(
+                    "%s ansible_connection=ssh ansible_host=%s \
 ansible_user=%s username=%s\n"
-                        % (name, ip, name, name)
-                    )
+                    % (name, ip, name, name)
+                )
 
-        # Edge VM group
-        if config["mode"] == "edge":
-            f.write("\n[edges]\n")
+    # Edge VM group
+    if config["mode"] == "edge":
+        f.write("\n[edges]\n")
 
-            for machine in machines:
-                for name, ip in zip(machine.edge_names, machine.edge_ips):
-                    f.write(
-                        "%s ansible_connection=ssh ansible_host=%s \
+        for machine in machines:
+            for name, ip in zip(machine.edge_names, machine.edge_ips):
+                f.write(
+                    "%s ansible_connection=ssh ansible_host=%s \
 ansible_user=%s username=%s\n"
-                        % (name, ip, name, name)
-                    )
+                    % (name, ip, name, name)
+                )
 
-        # Endpoint VM group
-        if config["infrastructure"]["endpoint_nodes"]:
-            f.write("\n[endpoints]\n")
-            for machine in machines:
-                for name, ip in zip(machine.endpoint_names, machine.endpoint_ips):
-                    f.write(
-                        "%s ansible_connection=ssh ansible_host=%s \
+    # Endpoint VM group
+    if config["infrastructure"]["endpoint_nodes"]:
+        f.write("\n[endpoints]\n")
+        for machine in machines:
+            for name, ip in zip(machine.endpoint_names, machine.endpoint_ips):
+                f.write(
+                    "%s ansible_connection=ssh ansible_host=%s \
 ansible_user=%s username=%s\n"
-                        % (name, ip, name, name)
-                    )
-
-        # Only include base VM logic if there are base VMs
-        if not machines[0].base_ips:
-            return
+                    % (name, ip, name, name)
+                )
 
+    # Only include base VM logic if there are base VMs
+    if machines[0].base_ips:
         # Make group with all base VMs for netperf installation
         f.write("\n[base]\n")
         for machine in machines:
@@ -343,6 +431,8 @@ ansible_user=%s username=%s\n"
                                 % (name, ip, name, name)
                             )
 
+    write_file(config, "inventory_vms", f.getvalue())
+
 
 def copy(config, machines):
     """Copy Ansible files to the local machine, base_path directory
@@ -357,15 +447,7 @@ def copy(config, machines):
     dest = os.path.join(config["infrastructure"]["base_path"], ".continuum/")
     out = []
 
-    # Copy inventory files
-    if any("base" in base_name for base_name in machines[0].base_names):
-        out.append(
-            machines[0].copy_files(config, os.path.join(config["base"], ".tmp/inventory"), dest)
-        )
-
-    out.append(
-        machines[0].copy_files(config, os.path.join(config["base"], ".tmp/inventory_vms"), dest)
-    )
+    # Inventory files are written to the destination directly, see write_file()
 
     # Copy the benchmark file if needed
     if (
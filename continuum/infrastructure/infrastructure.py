@@ -8,10 +8,16 @@ import sys
 import time
 import json
 import string
-import numpy as np
 
+from . import ansible
 from . import machine as m
 from . import network
+from . import placement
+
+# Seconds between SSH polls of VMs that did not phone home yet, and seconds a VM has to be
+# reachable over SSH before it counts as booted without phoning home
+PHONE_HOME_POLL = 10
+PHONE_HOME_GRACE = 30
 
 
 def delete_vms(config, machines):
@@ -46,6 +52,22 @@ def start_provider(config, machines):
     config["module"]["provider"].start(config, machines)
 
 
+def save_snapshot(config, machines):
+    """[INTERFACE] Save the initialized cluster so later runs with the same configuration
+    can restore it. Only when the provider supports it and the user enabled warm_snapshot.
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+    """
+    if (
+        "warm_snapshot" in config["infrastructure"]
+        and config["infrastructure"]["warm_snapshot"]
+        and not config["snapshot_restored"]
+    ):
+        config["module"]["provider"].save_snapshot(config, machines)
+
+
 def add_options(config):
     """[INTERFACE] Add config options for a particular module
 
@@ -67,55 +89,25 @@ def verify_options(parser, config):
 
 def schedule_equal(config, machines):
     """Distribute the VMs equally over the available machines, based on utilization
+    of cores and memory. See placement.place() for the cost model and constraints.
 
     Args:
         config (dict): Parsed configuration
         machines (list(Machine object)): List of machine objects representing physical machines
+
+    Returns:
+        list(set): List of 'cloud', 'edge', 'endpoint' sets containing the number of
+            those machines per physical node
     """
     logging.info("Schedule VMs on machine: Based on utilization")
-    machines_per_node = [{"cloud": 0, "edge": 0, "endpoint": 0} for _ in range(len(machines))]
-    machines_cores_used = [0 for _ in range(len(machines))]
-
-    types_to_go = {
-        "cloud": config["infrastructure"]["cloud_nodes"],
-        "edge": config["infrastructure"]["edge_nodes"],
-        "endpoint": config["infrastructure"]["endpoint_nodes"],
-    }
-    cores_per_type = {
-        "cloud": config["infrastructure"]["cloud_cores"],
-        "edge": config["infrastructure"]["edge_cores"],
-        "endpoint": config["infrastructure"]["endpoint_cores"],
-    }
-
-    machine_type = "cloud"
-    while sum(types_to_go.values()) != 0:
-        if types_to_go[machine_type] == 0:
-            if machine_type == "cloud":
-                machine_type = "edge"
-            elif machine_type == "edge":
-                machine_type = "endpoint"
-
-            continue
-
-        # Get machine with least cores used compared to total cores
-        i = np.argmin(
-            [cores_used / m.cores for cores_used, m in zip(machines_cores_used, machines)]
-        )
-
-        # Place VM on that machine
-        machines_cores_used[i] += cores_per_type[machine_type]
-        machines_per_node[i][machine_type] += 1
-        types_to_go[machine_type] -= 1
-
-    return machines_per_node
+    return placement.place(config, machines)
 
 
 def schedule_pin(config, machines):
     """Check if the requested cloud / edge VMs and endpoint containers can be scheduled
-    on the available hardware using a greedy algorithm:
-    - If physical node 0 can fit the next cloud / edge VM or endpoint container, do it.
-    - If not, go to the next node and try to fit it on there.
-    - The scheduling algorithm never considers to previous node for any scheduling anymore.
+    on the available hardware with each VM core pinned to its own physical core.
+    Machines are filled in order and NUMA nodes are packed tightly, so as few machines
+    as possible are used. See placement.place() for the cost model and constraints.
 
     Args:
         config (dict): Parsed configuration
@@ -125,74 +117,8 @@ def schedule_pin(config, machines):
         list(set): List of 'cloud', 'edge', 'endpoint' sets containing the number of
             those machines per physical node
     """
-    logging.info("Schedule VMs on machine: Based on CPU cores left / Greedy")
-    machines_per_node = [{"cloud": 0, "edge": 0, "endpoint": 0}]
-
-    node = 0
-    machine_cores_left = machines[0].cores
-
-    machine_type = "cloud"
-    types_to_go = {
-        "cloud": config["infrastructure"]["cloud_nodes"],
-        "edge": config["infrastructure"]["edge_nodes"],
-        "endpoint": config["infrastructure"]["endpoint_nodes"],
-    }
-    cores_per_type = {
-        "cloud": config["infrastructure"]["cloud_cores"],
-        "edge": config["infrastructure"]["edge_cores"],
-        "endpoint": config["infrastructure"]["endpoint_cores"],
-    }
-
-    while sum(types_to_go.values()) != 0 and node < len(machines):
-        if types_to_go[machine_type] == 0:
-            if machine_type == "cloud":
-                machine_type = "edge"
-            elif machine_type == "edge":
-                machine_type = "endpoint"
-
-            continue
-
-        if cores_per_type[machine_type] <= machine_cores_left:
-            machine_cores_left -= cores_per_type[machine_type]
-            machines_per_node[node][machine_type] += 1
-            types_to_go[machine_type] -= 1
-
-            if types_to_go[machine_type] == 0:
-                if machine_type == "cloud":
-                    machine_type = "edge"
-                elif machine_type == "edge":
-                    machine_type = "endpoint"
-                else:
-                    continue
-
-            if machine_cores_left == 0:
-                node += 1
-
-                if node == len(machines):
-                    break
-
-                machine_cores_left = machines[node].cores
-                machines_per_node.append({"cloud": 0, "edge": 0, "endpoint": 0})
-        else:
-            node += 1
-
-            if node == len(machines):
-                break
-
-            machine_cores_left = machines[node].cores
-            machines_per_node.append({"cloud": 0, "edge": 0, "endpoint": 0})
-
-    if sum(types_to_go.values()) != 0:
-        logging.error(
-            """\
-Not all VMs or containers fit on the available hardware.
-Please request less cloud / edge / endpoints nodes, 
-less cores per VM / container or add more hardware
-using the --file option"""
-        )
-        sys.exit()
-
-    return machines_per_node
+    logging.info("Schedule VMs on machine: Based on CPU cores and memory left / Bin packing")
+    return placement.place(config, machines)
 
 
 def create_keypair(config, machines):
@@ -265,7 +191,8 @@ def create_tmp_dir(config, machines):
 
 
 def delete_old_content(config, machines):
-    """Delete continuum content from previous runs, excluding base images
+    """Delete continuum content from previous runs, excluding base images,
+    Ansible inventory files and configuration (these are only rewritten if they change)
 
     Args:
         config (dict): Parsed configuration
@@ -283,7 +210,7 @@ rm -rf %s/.continuum/edge && \
 rm -rf %s/.continuum/endpoint && \
 rm -rf %s/.continuum/execution_model && \
 rm -rf %s/.continuum/infrastructure && \
-find %s/.continuum -maxdepth 1 -type f -delete""" % (
+find %s/.continuum -maxdepth 1 -type f ! -name "inventory*" ! -name ansible.cfg -delete""" % (
                 (config["infrastructure"]["base_path"],) * 9
             )
         else:
@@ -390,8 +317,51 @@ def add_ssh(config, machines, base=None):
             logging.error("".join(error))
             sys.exit()
 
+    # VMs announce themselves once booted, so scan all of those at once
+    # VMs that don't phone home are polled over SSH meanwhile, so they don't stall the launch
+    pending = ips
+    if "phone_home" in config:
+        logging.info("Wait for VMs to phone home")
+        known_hosts = os.path.join(config["home"], ".ssh/known_hosts")
+        reachable = {}
+        warned = False
+        while pending:
+            late = config["phone_home"].wait(pending, timeout=PHONE_HOME_POLL)
+
+            # Late VMs count as booted once SSH has been up for a while without phone-home
+            scan = [ip for ip in pending if ip not in late]
+            if late:
+                command = "ssh-keyscan -T 2 %s" % (" ".join(late))
+                _, error = machines[0].process(config, command, shell=True)[0]
+
+                now = time.monotonic()
+                for ip in late:
+                    if any("# " + str(ip) + ":" in err for err in error):
+                        reachable.setdefault(ip, now)
+                        if now - reachable[ip] >= PHONE_HOME_GRACE:
+                            scan.append(ip)
+
+            if scan:
+                command = "ssh-keyscan %s >> %s" % (" ".join(scan), known_hosts)
+                _, error = machines[0].process(config, command, shell=True)[0]
+
+                done = [ip for ip in scan if any("# " + str(ip) + ":" in err for err in error)]
+                if not warned and any(ip in late for ip in done):
+                    logging.warning(
+                        "VMs are reachable over SSH but do not phone home, "
+                        "check if they can reach %s. Falling back to ssh-keyscan",
+                        config["phone_home"].url(),
+                    )
+                    warned = True
+
+                pending = [ip for ip in pending if ip not in done]
+                if not done:
+                    time.sleep(5)
+
+        config["phone_home"].report(ips)
+
     # Once the known_hosts file has been cleaned up, add all new keys
-    for ip in ips:
+    for ip in pending:
         logging.info("Wait for VM to have started up")
         while True:
             command = f"ssh-keyscan {ip} >> {os.path.join(config['home'], '.ssh/known_hosts')}"
@@ -492,7 +462,9 @@ def docker_registry(config, machines):
         images += images_kube
         need_pull += [True] * 6
 
-    # Pull images which aren't present yet in the registry
+    # Images which aren't present yet in the registry, each with its name in the registry
+    # Images are deduplicated, as different tiers may use the same image
+    pairs = []
     for i, (image, pull) in enumerate(zip(images, need_pull)):
         if not pull:
             continue
@@ -505,17 +477,28 @@ def docker_registry(config, machines):
         else:
             dest = os.path.join(config["registry"], image.split(":")[1])
 
-        commands = [
-            ["docker", "pull", image],
-            ["docker", "tag", image, dest],
-            ["docker", "push", dest],
-        ]
+        if (image, dest) not in pairs:
+            pairs.append((image, dest))
+
+    if not pairs:
+        return
 
-        for command in commands:
-            output, error = machines[0].process(config, command)[0]
+    # Pull, tag and push all images concurrently, one stage at a time. The Docker daemon
+    # downloads layers shared between images only once, and the registry skips pushing
+    # layers it already has, so shared layers are never transferred twice.
+    logging.info("Distribute %i image(s) to the local Docker registry", len(pairs))
+    stages = [
+        [["docker", "pull", image] for image, _ in pairs],
+        [["docker", "tag", image, dest] for image, dest in pairs],
+        [["docker", "push", dest] for _, dest in pairs],
+    ]
 
+    for commands in stages:
+        results = machines[0].process(config, commands)
+
+        for command, (_, error) in zip(commands, results):
             if error:
-                logging.error("".join(error))
+                logging.error("Command %s failed: %s", " ".join(command), "".join(error))
                 sys.exit()
 
 
@@ -534,10 +517,10 @@ def docker_pull(config, machines, base_names):
 
     logging.info("Pull docker containers into base images")
 
-    # Pull the images
+    # Pull the images into all base VMs on all machines at once
+    commands = []
+    sshs = []
     for machine in machines:
-        commands = []
-        sshs = []
         for name, ip in zip(machine.base_names, machine.base_ips):
             name_r = name
             if "_" in name:
@@ -556,7 +539,7 @@ def docker_pull(config, machines, base_names):
                     if "combined" in config["images"]:
                         images.append(config["images"]["combined"].split(":")[1])
 
-                for image in images:
+                for image in sorted(set(images)):
                     command = [
                         "docker",
                         "pull",
@@ -565,33 +548,33 @@ def docker_pull(config, machines, base_names):
                     commands.append(command)
                     sshs.append(name + "@" + ip)
 
-        if commands:
-            results = machines[0].process(config, commands, ssh=sshs)
+    if commands:
+        results = machines[0].process(config, commands, ssh=sshs)
 
-            for ssh, (output, error) in zip(sshs, results):
-                logging.info("Execute docker pull command on address [%s]", ssh)
+        for ssh, (output, error) in zip(sshs, results):
+            logging.info("Execute docker pull command on address [%s]", ssh)
 
-                if error and any(
-                    "server gave HTTP response to HTTPS client" in line for line in error
-                ):
-                    logging.warning(
-                        """\
+            if error and any(
+                "server gave HTTP response to HTTPS client" in line for line in error
+            ):
+                logging.warning(
+                    """\
         File /etc/docker/daemon.json does not exist, or is empty on machine %s. 
         This will most likely prevent the machine from pulling endpoint docker images 
         from the private Docker registry running on the main machine %s.
         Please create this file on machine %s with content: { "insecure-registries":["%s"] }
         Followed by a restart of Docker: systemctl restart docker""",
-                        ssh,
-                        machines[0].name,
-                        ssh,
-                        config["registry"],
-                    )
-                if error:
-                    logging.error("".join(error))
-                    sys.exit()
-                elif not output:
-                    logging.error("No output from command docker pull")
-                    sys.exit()
+                    ssh,
+                    machines[0].name,
+                    ssh,
+                    config["registry"],
+                )
+            if error:
+                logging.error("".join(error))
+                sys.exit()
+            elif not output:
+                logging.error("No output from command docker pull")
+                sys.exit()
 
 
 def start(config):
@@ -626,13 +609,20 @@ def start(config):
     # Sets IPs and names for
     set_ip_names(config, machines, nodes_per_machine)
     m.print_schedule(machines)
+    placement.print_placement(machines)
+
+    # Settings shared by all Ansible playbooks of this run
+    ansible.configure(config, machines)
 
     if not (config["infrastructure"]["infra_only"] or config["benchmark"]["resource_manager_only"]):
         docker_registry(config, machines)
 
+    # Set by the provider if the VMs were restored from a snapshot of an initialized cluster
+    config["snapshot_restored"] = False
     start_provider(config, machines)
 
-    if config["infrastructure"]["network_emulation"]:
+    # Restored VMs already have network emulation set up
+    if config["infrastructure"]["network_emulation"] and not config["snapshot_restored"]:
         network.start(config, machines)
 
     if config["infrastructure"]["netperf"]:
@@ -41,6 +41,21 @@ class Machine:
         # Cores on this machine
         self.cores = 0
 
+        # Memory in GB and NUMA topology on this machine
+        # Physical cores are identified by their first hardware thread (CPU id)
+        self.memory = 0
+        self.numa_cpus = {}
+        self.numa_memory = {}
+        self.numa_socket = {}
+        self.cpu_siblings = {}
+
+        # CPU ids per VM, per VM type, and CPU ids reserved for the host (numa_policy = isolate)
+        # Memory in GB per NUMA node per VM, per VM type
+        # All are set by the placement engine
+        self.cpusets = {"cloud": [], "edge": [], "endpoint": []}
+        self.host_cpus = []
+        self.memory_nodes = {"cloud": [], "edge": [], "endpoint": []}
+
         # VM info
         self.cloud_controller = 0
         self.clouds = 0
@@ -75,6 +90,8 @@ NAME_SANITIZED              %s
 USER                        %s
 IP                          %s
 CORES                       %i
+MEMORY                      %.1f
+NUMA_CPUS                   %s
 CLOUD_CONTROLLER            %i
 CLOUDS                      %i
 EDGES                       %i
@@ -95,6 +112,8 @@ BASE_NAMES                  %s""" % (
             self.user,
             self.ip,
             self.cores,
+            self.memory,
+            self.numa_cpus,
             self.cloud_controller,
             self.clouds,
             self.edges,
@@ -279,7 +298,7 @@ BASE_NAMES                  %s""" % (
         return outputs
 
     def check_hardware(self, config):
-        """Get the amount of physical cores for this machine.
+        """Get the amount of physical cores, memory, and the NUMA topology of this machine.
         This automatically functions as reachability check for this machine.
         """
         # GCP and AWS uses Terraform (cloud), so the number of local cores won't matter
@@ -287,17 +306,19 @@ BASE_NAMES                  %s""" % (
         # same "machine" (your local machine is seen as the cloud provider)
         if config["infrastructure"]["provider"] in ["gcp", "aws"]:
             self.cores = 100000
+            self.memory = 100000
             return
 
         logging.info("Check hardware of node %s", self.name)
-        command = "lscpu"
+        command = (
+            "lscpu && lscpu -p=CPU,CORE,SOCKET,NODE && "
+            "grep MemTotal /proc/meminfo /sys/devices/system/node/node*/meminfo"
+        )
 
-        if self.is_local:
-            command = [command]
-        else:
-            command = ["ssh", self.name, command]
+        if not self.is_local:
+            command = "ssh %s '%s'" % (self.name, command)
 
-        output, error = self.process(config, command)[0]
+        output, error = self.process(config, command, shell=True)[0]
 
         if not output:
             logging.error("".join(error))
@@ -305,13 +326,25 @@ BASE_NAMES                  %s""" % (
         else:
             threads = -1
             threads_per_core = -1
+            cores = {}
             for line in output:
                 if line.startswith("CPU(s):"):
                     threads = int(line.split(":")[-1])
-                if line.startswith("Thread(s) per core:"):
+                elif line.startswith("Thread(s) per core:"):
                     threads_per_core = int(line.split(":")[-1])
-
-            if threads == -1 or threads_per_core == -1:
+                elif re.match(r"^\d+,", line):
+                    # Parsable lscpu output: CPU,CORE,SOCKET,NODE (NODE is empty without NUMA)
+                    cpu, core, socket, node = (line.strip().split(",") + [""] * 4)[:4]
+                    node = int(node) if node else 0
+                    cores.setdefault((int(socket), int(core)), []).append((int(cpu), node))
+                elif "MemTotal" in line:
+                    kb = int(line.split()[-2])
+                    if line.startswith("/proc/meminfo"):
+                        self.memory = kb / 1048576
+                    else:
+                        self.numa_memory[int(line.split()[1])] = kb / 1048576
+
+            if threads == -1 or threads_per_core == -1 or not cores or self.memory == 0:
                 logging.error("Command did not produce the expected output: %s", "".join(output))
                 sys.exit()
 
@@ -319,6 +352,17 @@ BASE_NAMES                  %s""" % (
 
             self.cores = int(threads / threads_per_core)
 
+            for (socket, _), cpus in sorted(cores.items(), key=lambda c: min(c[1])):
+                cpus.sort()
+                cpu, node = cpus[0]
+                self.numa_cpus.setdefault(node, []).append(cpu)
+                self.numa_socket[node] = socket
+                self.cpu_siblings[cpu] = [c for c, _ in cpus[1:]]
+
+            # Machines without NUMA information in sysfs have a single node
+            if not self.numa_memory:
+                self.numa_memory = {node: self.memory for node in self.numa_cpus}
+
     def copy_files(self, config, source, dest, recursive=False):
         """Copy files from host machine to destination machine.
 
@@ -317,6 +317,26 @@ transaction_rate,p50_latency,p90_latency,p99_latency",
     return lat_commands, tp_commands
 
 
+def io_profile(config):
+    """Describe the I/O profile of the VMs, so netperf results can be compared between profiles.
+    Only the QEMU provider has configurable I/O profiles.
+
+    Args:
+        config (dict): Parsed configuration
+
+    Returns:
+        str: I/O profile description
+    """
+    if "io_profile" not in config["infrastructure"]:
+        return "provider %s" % (config["infrastructure"]["provider"])
+
+    return "io_profile=%s disk_cache=%s disk_io=%s" % (
+        config["infrastructure"]["io_profile"],
+        config["infrastructure"]["disk_cache"],
+        config["infrastructure"]["disk_io"],
+    )
+
+
 def benchmark_output(
     config, machine, targets, lat_commands, tp_commands, ssh, source_name, target_name
 ):
@@ -334,7 +354,15 @@ def benchmark_output(
     """
     for target_ip, command in zip(targets + targets, lat_commands + tp_commands):
         output, error = machine.process(config, command, ssh=ssh)[0]
-        logging.info("From %s %s to %s %s: %s", source_name, ssh, target_name, target_ip, command)
+        logging.info(
+            "From %s %s to %s %s [%s]: %s",
+            source_name,
+            ssh,
+            target_name,
+            target_ip,
+            io_profile(config),
+            command,
+        )
         logging.info("\n%s", "".join(output))
         logging.info("\n%s", "".join(error))
 
@@ -346,7 +374,7 @@ def benchmark(config, machines):
         config (dict): Parsed configuration
         machines (list(Machine object)): List of machine objects representing physical machines
     """
-    logging.info("Benchmark network between VMs")
+    logging.info("Benchmark network between VMs with %s", io_profile(config))
 
     # Start the netperf netserver on each machine
     for ssh in config["cloud_ssh"] + config["edge_ssh"] + config["endpoint_ssh"]:
@@ -0,0 +1,432 @@
+"""\
+Place VMs on physical machines and their NUMA nodes using a cost model
+Every VM is a bin-packing item with a number of cores and an amount of memory, and every NUMA node
+of every physical machine is a bin. VMs are placed largest first (first-fit decreasing), each on
+the feasible bin with the lowest cost. Hard constraints:
+- The cloud controller is placed on the first machine, which is where set_ip_names() expects it
+- The memory of all VMs on a machine or NUMA node does not exceed its physical memory, for every
+  numa_policy: also when a VM spans NUMA nodes or its memory is interleaved over them
+- With cpu_pin, every VM core gets its own physical core
+- With energy_isolation, measured VMs (cloud workers, edges) are kept off the controller's sockets,
+  so RAPL readings per package are not polluted by the control plane
+
+With cpu_pin, the placement results in an explicit set of physical cores per VM,
+stored in machine.cpusets and used for the cputune section of the libvirt domain. The memory of
+each VM per NUMA node is stored in machine.memory_nodes, used for the numatune section and to
+reserve hugepages on the right NUMA nodes.
+The numa_policy option decides how those cores are chosen:
+- compact: all cores of a VM on a single NUMA node where possible
+- spread: cores of a VM distributed round-robin over all NUMA nodes, for memory bandwidth
+- isolate: like compact, but the first physical core of every NUMA node is left to the host
+  (stored in machine.host_cpus), so VMs never share a core with host threads
+"""
+
+import logging
+import sys
+
+# Order in which VM types are placed (stable within the same size)
+TYPES = ["cloud", "edge", "endpoint"]
+
+
+class Bin:
+    """Free resources of one NUMA node on one physical machine"""
+
+    def __init__(self, machine, index, node):
+        """Initialize the object
+
+        Args:
+            machine (Machine object): Object representing the physical machine
+            index (int): Index of the machine in the list of machines
+            node (int): NUMA node, or None if the topology is unknown
+        """
+        self.machine = machine
+        self.index = index
+        self.node = node
+
+        if node is None:
+            self.cpus = []
+            self.cores = machine.cores
+            self.memory = machine.memory
+            self.socket = None
+        else:
+            self.cpus = list(machine.numa_cpus[node])
+            self.cores = len(self.cpus)
+            self.memory = machine.numa_memory[node]
+            self.socket = machine.numa_socket[node]
+
+        self.cores_used = 0
+        self.memory_used = 0
+
+
+def has_controller(config):
+    """Check if a cloud controller will be deployed, see set_ip_names()
+
+    Args:
+        config (dict): Parsed configuration
+
+    Returns:
+        bool: A cloud controller will be deployed
+    """
+    return (
+        config["infrastructure"]["cloud_nodes"] > 0
+        and not config["infrastructure"]["infra_only"]
+        and not config["mode"] == "endpoint"
+        and not config["benchmark"]["resource_manager"] == "mist"
+    )
+
+
+def vms(config):
+    """List all VMs to be placed, largest first
+
+    Args:
+        config (dict): Parsed configuration
+
+    Returns:
+        list(dict): VMs with their type, cores, memory, and whether it's measured or the controller
+    """
+    controller = has_controller(config)
+
+    items = []
+    for vm_type in TYPES:
+        for i in range(config["infrastructure"]["%s_nodes" % (vm_type)]):
+            is_controller = vm_type == "cloud" and controller and i == 0
+            items.append(
+                {
+                    "type": vm_type,
+                    "cores": config["infrastructure"]["%s_cores" % (vm_type)],
+                    "memory": config["infrastructure"]["%s_memory" % (vm_type)],
+                    "controller": is_controller,
+                    "measured": vm_type in ["cloud", "edge"] and not is_controller,
+                }
+            )
+
+    # The controller goes first, as it constrains the placement of measured VMs
+    items.sort(key=lambda vm: (not vm["controller"], -vm["cores"], -vm["memory"]))
+    return items
+
+
+def cost(config, vm, machine_bins, option):
+    """Cost of placing a VM on one or more bins of a machine, lower is better
+
+    Args:
+        config (dict): Parsed configuration
+        vm (dict): VM to place, see vms()
+        machine_bins (list(Bin)): All bins of the machine
+        option (list(Bin)): Bins to place the VM on, more than one if it spans NUMA nodes
+
+    Returns:
+        tuple: Cost, compared lexicographically
+    """
+    machine = machine_bins[0].machine
+    index = machine_bins[0].index
+    cores_used = sum(b.cores_used for b in machine_bins) + vm["cores"]
+    memory_used = sum(b.memory_used for b in machine_bins) + vm["memory"]
+    utilization = max(cores_used / machine.cores, memory_used / machine.memory)
+
+    # Spanning NUMA nodes is only a last resort
+    spans = len(option) - 1
+    node = option[0].node or 0
+
+    if config["infrastructure"]["cpu_pin"]:
+        # Pack: fill machines in order so few machines are used, and fill NUMA nodes tightly
+        left = sum(len(b.cpus) for b in option) - vm["cores"]
+        return (index, spans, left, node)
+
+    # Balance: spread load over machines, then over NUMA nodes
+    node_utilization = (sum(b.cores_used for b in option) + vm["cores"]) / sum(
+        b.cores for b in option
+    )
+    return (utilization, spans, node_utilization, index, node)
+
+
+def allowed(config, vm, b, controller_sockets):
+    """Check if a VM may use a bin at all
+
+    Args:
+        config (dict): Parsed configuration
+        vm (dict): VM to place, see vms()
+        b (Bin): Bin to place the VM on
+        controller_sockets (set(int)): Sockets the cloud controller uses on the first machine
+
+    Returns:
+        bool: The VM may use this bin
+    """
+    if vm["controller"] and b.index != 0:
+        return False
+
+    return not (
+        config["infrastructure"]["energy_isolation"]
+        and vm["measured"]
+        and b.index == 0
+        and b.socket in controller_sockets
+    )
+
+
+def interleaved(config, option):
+    """Check if the memory of a VM is interleaved over the bins it's placed on,
+    see numa_config() in infrastructure/qemu/generate.py.
+    With hugepages, memory spanning NUMA nodes is always interleaved, so the number of pages
+    needed per node is known up front.
+
+    Args:
+        config (dict): Parsed configuration
+        option (list(Bin)): Bins to place the VM on
+
+    Returns:
+        bool: Memory is interleaved
+    """
+    return (
+        config["infrastructure"]["cpu_pin"]
+        and (
+            config["infrastructure"]["numa_policy"] == "spread"
+            or (
+                "hugepages" in config["infrastructure"]
+                and config["infrastructure"]["hugepages"] != "none"
+            )
+        )
+        and len(option) > 1
+    )
+
+
+def split_memory(config, vm, option):
+    """Split the memory of a VM over the bins it's placed on.
+    Interleaved memory is split evenly, otherwise the bins are filled in order
+    and the last bin takes the rest.
+
+    Args:
+        config (dict): Parsed configuration
+        vm (dict): VM to place, see vms()
+        option (list(Bin)): Bins to place the VM on
+
+    Returns:
+        list(float): Memory in GB per bin
+    """
+    if interleaved(config, option):
+        return [vm["memory"] / len(option)] * len(option)
+
+    split = []
+    memory_left = vm["memory"]
+    for b in option:
+        memory = min(memory_left, max(b.memory - b.memory_used, 0))
+        if b == option[-1]:
+            memory = memory_left
+
+        split.append(memory)
+        memory_left -= memory
+
+    return split
+
+
+def fits(config, vm, option):
+    """Check if the memory of a VM fits on every NUMA node it's placed on
+
+    Args:
+        config (dict): Parsed configuration
+        vm (dict): VM to place, see vms()
+        option (list(Bin)): Bins to place the VM on
+
+    Returns:
+        bool: The memory fits
+    """
+    return all(
+        b.node is None or b.memory_used + memory <= b.memory
+        for b, memory in zip(option, split_memory(config, vm, option))
+    )
+
+
+def options(config, vm, machine_bins, controller_sockets):
+    """Get all feasible ways to place a VM on a machine: on a single NUMA node,
+    or spanning multiple NUMA nodes if it fits on no single node.
+
+    Args:
+        config (dict): Parsed configuration
+        vm (dict): VM to place, see vms()
+        machine_bins (list(Bin)): All bins of the machine
+        controller_sockets (set(int)): Sockets the cloud controller uses on the first machine
+
+    Returns:
+        list(list(Bin)): Feasible options, each a list of bins
+    """
+    if sum(b.memory_used for b in machine_bins) + vm["memory"] > machine_bins[0].machine.memory:
+        return []
+
+    usable = [b for b in machine_bins if allowed(config, vm, b, controller_sockets)]
+
+    single = []
+    for b in usable:
+        if not fits(config, vm, [b]):
+            continue
+        if config["infrastructure"]["cpu_pin"] and b.node is not None and len(b.cpus) < vm["cores"]:
+            continue
+
+        single.append([b])
+
+    if config["infrastructure"]["cpu_pin"] and config["infrastructure"]["numa_policy"] == "spread":
+        # Use every NUMA node with free cores, memory is interleaved over them
+        usable = [b for b in usable if b.node is None or b.cpus]
+        if (
+            usable
+            and sum(len(b.cpus) for b in usable) >= vm["cores"]
+            and fits(config, vm, usable)
+        ):
+            return [usable]
+
+        return single
+
+    if single or len(usable) < 2:
+        return single
+
+    # Span the NUMA nodes with the most free resources first
+    usable.sort(key=lambda b: (-len(b.cpus), b.memory_used - b.memory))
+    if config["infrastructure"]["cpu_pin"] and sum(len(b.cpus) for b in usable) < vm["cores"]:
+        return []
+
+    if not fits(config, vm, usable):
+        return []
+
+    return [usable]
+
+
+def place(config, machines):
+    """Place all VMs on the available machines
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+
+    Returns:
+        list(set): List of 'cloud', 'edge', 'endpoint' sets containing the number of
+            those machines per physical node
+    """
+    bins = []
+    for i, machine in enumerate(machines):
+        if machine.numa_cpus:
+            bins.append([Bin(machine, i, node) for node in sorted(machine.numa_cpus)])
+        else:
+            bins.append([Bin(machine, i, None)])
+
+    machines_per_node = [{"cloud": 0, "edge": 0, "endpoint": 0} for _ in range(len(machines))]
+    for machine in machines:
+        machine.cpusets = {"cloud": [], "edge": [], "endpoint": []}
+        machine.host_cpus = []
+        machine.memory_nodes = {"cloud": [], "edge": [], "endpoint": []}
+
+    # Reserve one physical core per NUMA node (including its hardware threads) for the host
+    if config["infrastructure"]["cpu_pin"] and config["infrastructure"]["numa_policy"] == "isolate":
+        for machine_bins in bins:
+            for b in machine_bins:
+                if b.node is None or len(b.cpus) < 2:
+                    continue
+
+                host = b.cpus.pop(0)
+                b.cores -= 1
+                b.machine.host_cpus += [host] + b.machine.cpu_siblings.get(host, [])
+
+    controller_sockets = set()
+    for vm in vms(config):
+        candidates = [
+            (cost(config, vm, machine_bins, option), option)
+            for machine_bins in bins
+            for option in options(config, vm, machine_bins, controller_sockets)
+        ]
+
+        if not candidates:
+            logging.error(
+                """\
+Not all VMs or containers fit on the available hardware.
+Please request less cloud / edge / endpoints nodes,
+less cores or memory per VM / container or add more hardware
+using the --file option. The memory of a VM has to fit on the
+NUMA nodes it is placed on"""
+            )
+            sys.exit()
+
+        _, option = min(candidates, key=lambda c: c[0])
+
+        # Spread: take cores round-robin from all chosen bins
+        cpus = []
+        spread = config["infrastructure"]["numa_policy"] == "spread" and len(option) > 1
+        if config["infrastructure"]["cpu_pin"] and spread:
+            cpus = round_robin(vm["cores"], option)
+
+        # Take cores from the chosen bins in order, the last bin takes the rest
+        cores_left = vm["cores"]
+        memory_nodes = {}
+        for b, memory in zip(option, split_memory(config, vm, option)):
+            cores = min(cores_left, max(b.cores - b.cores_used, 0))
+            if b == option[-1]:
+                cores = cores_left
+
+            if config["infrastructure"]["cpu_pin"] and not spread:
+                cpus += b.cpus[:cores]
+                b.cpus = b.cpus[cores:]
+
+            b.cores_used += cores
+            b.memory_used += memory
+            cores_left -= cores
+            if b.node is not None and memory > 0:
+                memory_nodes[b.node] = memory
+
+        machines_per_node[option[0].index][vm["type"]] += 1
+        if config["infrastructure"]["cpu_pin"]:
+            option[0].machine.cpusets[vm["type"]].append(cpus)
+            option[0].machine.memory_nodes[vm["type"]].append(memory_nodes)
+
+        if vm["controller"]:
+            # The controller may span sockets, e.g. with numa_policy = spread
+            controller_sockets = {b.socket for b in option if b.socket is not None}
+
+    return machines_per_node
+
+
+def round_robin(cores, option):
+    """Take cores round-robin from multiple bins, one at a time
+
+    Args:
+        cores (int): Number of cores to take
+        option (list(Bin)): Bins to take cores from, cores are removed from these bins
+
+    Returns:
+        list(int): Taken CPU ids
+    """
+    cpus = []
+    while len(cpus) < cores:
+        for b in option:
+            if b.cpus and len(cpus) < cores:
+                cpus.append(b.cpus.pop(0))
+
+    return cpus
+
+
+def cpuset_string(cpus):
+    """Format a list of CPU ids as a libvirt cpuset, using ranges where possible
+    Example: [0, 1, 2, 5] -> 0-2,5
+
+    Args:
+        cpus (list(int)): CPU ids
+
+    Returns:
+        str: cpuset string
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+
+    return ",".join("%i" % (a) if a == b else "%i-%i" % (a, b) for a, b in ranges)
+
+
+def print_placement(machines):
+    """Print the physical cores assigned to each VM per machine
+
+    Args:
+        machines (list(Machine object)): List of machine objects representing physical machines
+    """
+    for machine in machines:
+        for vm_type in TYPES:
+            for cpus in machine.cpusets[vm_type]:
+                logging.debug(
+                    "%s: %s VM pinned to cpuset %s", machine.name, vm_type, cpuset_string(cpus)
+                )
@@ -0,0 +1,246 @@
+"""\
+Content-addressed cache for QEMU base images
+Every base image is keyed by a hash of everything that goes into building it:
+the Ansible playbooks, resource manager, Kubernetes version, and docker images.
+Built images are stored once per physical machine in .continuum/images/cache/<key>.qcow2,
+and each named base image is a symlink to its cached entry. Stale images are detected by key,
+not by existence, so unchanged stacks never rebuild.
+"""
+
+import hashlib
+import logging
+import os
+import string
+import sys
+
+
+def base_type(base_name):
+    """Strip the machine index and username from a base image name
+    Example: base_cloud_kubernetes0_user -> base_cloud_kubernetes
+
+    Args:
+        base_name (str): Name of a base image / base VM
+
+    Returns:
+        str: Base image type, shared between all physical machines
+    """
+    return base_name.rsplit("_", 1)[0].rstrip(string.digits)
+
+
+def build_inputs(config, base_name):
+    """Collect the files and settings that determine the content of a base image
+
+    Args:
+        config (dict): Parsed configuration
+        base_name (str): Name of a base image / base VM
+
+    Returns:
+        list(str), list(str): Paths of input files, and other inputs as strings
+    """
+    name = base_type(base_name)
+    infra = os.path.join(config["base"], "infrastructure", "qemu", "infrastructure")
+
+    # The OS image and netperf installation are shared by all base images
+    files = [os.path.join(infra, "os.yml"), os.path.join(infra, "netperf.yml")]
+    settings = [name]
+
+    if name == "base":
+        files.append(os.path.join(infra, "base_start.yml"))
+        return files, settings
+
+    # Use Kubeedge setup code for mist computing, same as set_ip_names()
+    rm = config["benchmark"]["resource_manager"]
+    if rm == "mist":
+        rm = "kubeedge"
+
+    images = []
+    if "base_cloud" in name or "base_edge" in name:
+        tier = "cloud" if "base_cloud" in name else "edge"
+        files.append(os.path.join(infra, "base_%s_start.yml" % (tier)))
+
+        rm_path = os.path.join(config["base"], "resource_manager", rm, tier)
+        files.append(os.path.join(rm_path, "base_install.yml"))
+        if os.path.exists(os.path.join(rm_path, "config.toml")):
+            files.append(os.path.join(rm_path, "config.toml"))
+
+        settings.append(rm)
+        settings.append(str(config["benchmark"].get("kube_version", "")))
+
+        # Kubernetes-based resource managers pull their own images, see base_image()
+        if rm not in ["kubernetes", "kubeedge", "kubecontrol", "kube_kata"] and "images" in config:
+            images.append(config["images"]["worker"])
+    elif "base_endpoint" in name:
+        files.append(os.path.join(infra, "base_endpoint_start.yml"))
+        files.append(
+            os.path.join(
+                config["base"], "resource_manager", "endpoint", "endpoint", "base_install.yml"
+            )
+        )
+
+        if "images" in config:
+            images.append(config["images"]["endpoint"])
+            if "combined" in config["images"]:
+                images.append(config["images"]["combined"])
+
+    # Images are pulled from the local registry, so the registry address is part of the content
+    if "registry" in config:
+        settings.append(config["registry"])
+
+    settings += sorted(images)
+    return files, settings
+
+
+def image_key(config, base_name):
+    """Compute the content key of a base image
+
+    Args:
+        config (dict): Parsed configuration
+        base_name (str): Name of a base image / base VM
+
+    Returns:
+        str: Hex digest identifying the content of the base image
+    """
+    files, settings = build_inputs(config, base_name)
+
+    h = hashlib.sha256()
+    for path in files:
+        h.update(os.path.relpath(path, config["base"]).encode("utf-8"))
+        try:
+            with open(path, "rb") as f:
+                h.update(f.read())
+        except FileNotFoundError:
+            h.update(b"missing")
+
+    for setting in settings:
+        h.update(setting.encode("utf-8"))
+        h.update(b"\0")
+
+    return h.hexdigest()[:16]
+
+
+def cache_path(config, key):
+    """Path of a cached base image on a physical machine
+
+    Args:
+        config (dict): Parsed configuration
+        key (str): Content key of the base image
+
+    Returns:
+        str: Path to the cached qcow2 file
+    """
+    return os.path.join(
+        config["infrastructure"]["base_path"], ".continuum/images/cache/%s.qcow2" % (key)
+    )
+
+
+def wrap_command(machine, command):
+    """Execute a shell command locally or on a remote physical machine
+
+    Args:
+        machine (Machine object): Object representing the physical machine
+        command (str): Shell command
+
+    Returns:
+        str: Shell command to pass to Machine.process()
+    """
+    if machine.is_local:
+        return command
+
+    return "ssh %s '%s'" % (machine.name, command)
+
+
+def lookup(config, machines):
+    """Check which base image types are missing or stale on at least one machine
+    Cached images that match their key are linked to their base image name immediately.
+    All machines are checked concurrently.
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+
+    Returns:
+        list(str): Base image types that need to be (re)built
+    """
+    logging.info("Look up base image(s) in the content-addressed image cache")
+    images = os.path.join(config["infrastructure"]["base_path"], ".continuum/images")
+
+    commands = []
+    names = []
+    for machine in machines:
+        for base_name in machine.base_names:
+            key = image_key(config, base_name)
+            path = cache_path(config, key)
+            link = os.path.join(images, "%s.qcow2" % (base_name))
+
+            # Print HIT and relink on a match, MISS otherwise
+            command = (
+                "mkdir -p %s/cache && if [ -f %s ]; then ln -sfn %s %s && echo HIT; "
+                "else echo MISS; fi" % (images, path, path, link)
+            )
+            commands.append(wrap_command(machine, command))
+            names.append(base_name)
+            logging.debug("Base image %s has key %s", base_name, key)
+
+    if not commands:
+        return []
+
+    results = machines[0].process(config, commands, shell=True)
+
+    need = []
+    for base_name, (output, error) in zip(names, results):
+        if error:
+            logging.error("".join(error))
+            sys.exit()
+
+        name = base_type(base_name)
+        if not output or output[-1].strip() != "HIT":
+            logging.info("Base image %s is missing or stale", base_name)
+            if name not in need:
+                need.append(name)
+
+    return need
+
+
+def store(config, machines, base_names):
+    """Move freshly built base images into the cache and link them back to their name.
+    The base VMs should already be shut down.
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+        base_names (list(str)): Base image types that have been rebuilt
+    """
+    logging.info("Store new base image(s) in the content-addressed image cache")
+    images = os.path.join(config["infrastructure"]["base_path"], ".continuum/images")
+
+    commands = []
+    for machine in machines:
+        for base_name in machine.base_names:
+            if base_type(base_name) not in base_names:
+                continue
+
+            path = cache_path(config, image_key(config, base_name))
+            link = os.path.join(images, "%s.qcow2" % (base_name))
+            command = "mkdir -p %s/cache && mv -f %s %s && ln -sfn %s %s" % (
+                images,
+                link,
+                path,
+                path,
+                link,
+            )
+            commands.append(wrap_command(machine, command))
+
+    if not commands:
+        return
+
+    results = machines[0].process(config, commands, shell=True)
+
+    for command, (output, error) in zip(commands, results):
+        logging.debug("Check output for command [%s]", command)
+
+        if error:
+            logging.error("".join(error))
+            sys.exit()
+        elif output:
+            logging.error("".join(output))
+            sys.exit()
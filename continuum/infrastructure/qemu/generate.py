@@ -8,6 +8,8 @@ import logging
 import sys
 import re
 
+from infrastructure import placement
+
 
 DOMAIN = """\
 <domain type='kvm'>
@@ -23,31 +25,15 @@ DOMAIN = """\
         <acpi/>
     </features>
     <vcpu placement="static">%i</vcpu>
+%s
     <cputune>
         <period>%i</period>
         <quota>%i</quota>
 %s
     </cputune>
+%s
     <devices>
-        <interface type='bridge'>
-            <source bridge='%s'/>
-            <model type='e1000'/>
-        </interface>
-        <disk type='file' device='disk'>
-            <driver type='qcow2' cache='none'/>
-            <source file='%s/.continuum/images/%s.qcow2'/>
-            <target dev='vda' bus='virtio'/>
-            <iotune>
-                <read_bytes_sec>%i</read_bytes_sec>
-                <write_bytes_sec>%i</write_bytes_sec>
-                <read_bytes_sec_max>%i</read_bytes_sec_max>
-                <write_bytes_sec_max>%i</write_bytes_sec_max>
-            </iotune>
-        </disk>
-        <disk type='file' device='disk'>
-            <source file='%s/.continuum/images/user_data_%s.img'/>
-            <target dev='vdb' bus='virtio'/>
-        </disk>
+%s
         <console type="pty">
            <target type="serial" port="1"/>
         </console>
@@ -102,15 +88,135 @@ runcmd:
  %s
 # written to /var/log/cloud-init-output.log
 final_message: "The system is finally up, after $UPTIME seconds"
-"""
+%s"""
 
 
-def memory_backing_config():
+INTERFACE = """\
+        <interface type='bridge'>
+            <source bridge='%s'/>
+            <model type='%s'/>%s
+        </interface>"""
+
+DISK = """\
+        <disk type='file' device='disk'>
+            <driver name='qemu' type='qcow2' cache='%s' io='%s'%s/>
+            <source file='%s/.continuum/images/%s.qcow2'/>
+            <target dev='%s' bus='%s'/>
+            <iotune>
+                <read_bytes_sec>%i</read_bytes_sec>
+                <write_bytes_sec>%i</write_bytes_sec>
+                <read_bytes_sec_max>%i</read_bytes_sec_max>
+                <write_bytes_sec_max>%i</write_bytes_sec_max>
+            </iotune>
+        </disk>"""
+
+USER_DATA_DISK = """\
+        <disk type='file' device='disk'>
+            <source file='%s/.continuum/images/user_data_%s.img'/>
+            <target dev='%s' bus='%s'/>
+        </disk>"""
+
+SCSI_CONTROLLER = """\
+        <controller type='scsi' index='0' model='virtio-scsi'>
+            <driver queues='%i' iothread='1'/>
+            <address type='pci' domain='0x0000' bus='0x00' slot='0x0a' function='0x0'/>
+        </controller>"""
+
+
+def io_config(config, bridge_name, name, vcpus, read_speed, write_speed):
+    """Network and disk devices for the domain XML, following the configured I/O profile.
+    - legacy: emulated e1000 NIC, virtio disks
+    - virtio: virtio-net with vhost and one queue per vCPU, virtio-blk with an iothread
+    - virtio-scsi: virtio-net as above, disks on a multi-queue virtio-scsi controller with an
+      iothread. The controller gets a fixed PCI slot, so the NIC keeps the slot (and guest
+      interface name) it has with the other profiles.
+
+    Args:
+        config (dict): Parsed configuration
+        bridge_name (str): Network bridge to connect the VM to
+        name (str): VM name
+        vcpus (int): Number of vCPUs, used as number of queues
+        read_speed (int): Max disk read throughput, 0 for unlimited
+        write_speed (int): Max disk write throughput, 0 for unlimited
+
+    Returns:
+        str, str: Domain-level iothreads element, and the device elements
+    """
+    profile = config["infrastructure"]["io_profile"]
+    base_path = config["infrastructure"]["base_path"]
+
+    iothreads = ""
+    driver = ""
+    bus, root, user_data = "virtio", "vda", "vdb"
+    if profile == "legacy":
+        interface = INTERFACE % (bridge_name, "e1000", "")
+    else:
+        iothreads = "    <iothreads>1</iothreads>"
+        interface = INTERFACE % (
+            bridge_name,
+            "virtio",
+            "\n            <driver name='vhost' queues='%i'/>" % (vcpus),
+        )
+
+        if profile == "virtio":
+            driver = " iothread='1' queues='%i'" % (vcpus)
+        else:
+            bus, root, user_data = "scsi", "sda", "sdb"
+
+    devices = [interface]
+    if profile == "virtio-scsi":
+        devices.append(SCSI_CONTROLLER % (vcpus))
+
+    devices.append(
+        DISK
+        % (
+            config["infrastructure"]["disk_cache"],
+            config["infrastructure"]["disk_io"],
+            driver,
+            base_path,
+            name,
+            root,
+            bus,
+            read_speed,
+            write_speed,
+            read_speed,
+            write_speed,
+        )
+    )
+    devices.append(USER_DATA_DISK % (base_path, name, user_data, bus))
+
+    return iothreads, "\n".join(devices)
+
+
+def memory_backing_config(config, virtiofs=False):
     """Memory backing config for the domain XML file.
+    virtiofsd needs shared memory, which is either memfd or hugepages-backed.
+    Hugepages are used for all VMs if configured, and reserved on the host by the provider.
+
+    Args:
+        config (dict): Parsed configuration
+        virtiofs (bool, optional): VM uses virtiofsd. Defaults to False.
 
     Returns:
-        str: Memory backing domain config
+        str: Memory backing domain config, or nothing if the default backing suffices
     """
+    size = config["infrastructure"]["hugepages"]
+    if size != "none":
+        return """\
+    <memoryBacking>
+        <hugepages>
+            <page size='%s' unit='%s'/>
+        </hugepages>
+        <access mode='shared'/>
+    </memoryBacking>\
+    """ % (
+            size[:-1],
+            size[-1],
+        )
+
+    if not virtiofs:
+        return ""
+
     return """\
     <memoryBacking>
         <source type='memfd'/>
@@ -149,6 +255,87 @@ def additional_commands(commands):
     return ""  # "\n".join(["- " + command for command in commands])
 
 
+def phone_home_config(config):
+    """Phone-home config for USER_DATA, so VMs report when cloud-init has finished.
+
+    Args:
+        config (dict): Parsed configuration
+
+    Returns:
+        str: cloud-init phone_home config, or nothing if no listener is running
+    """
+    if "phone_home" not in config:
+        return ""
+
+    return """\
+phone_home:
+  url: %s
+  post: [hostname]
+  tries: 10
+""" % (config["phone_home"].url())
+
+
+def numa_config(config, machine, cpus, memory):
+    """Pin vCPUs, emulator threads, and memory of a VM following the NUMA placement plan.
+    - vCPU i is pinned to physical core cpus[i]
+    - Emulator threads run on the host cores of the VM's NUMA nodes (numa_policy = isolate),
+      or on the idle hardware threads of the VM's cores (or the VM's cores without SMT)
+    - Memory is bound to the NUMA nodes the placement put it on, interleaved over multiple
+      nodes with numa_policy = spread or hugepages, see placement.interleaved()
+
+    Args:
+        config (dict): Parsed configuration
+        machine (Machine object): Object representing the physical machine
+        cpus (list(int)): Physical core (first hardware thread) per vCPU
+        memory (dict): Memory in GB per NUMA node
+
+    Returns:
+        str, str: Lines for the cputune section, and the numatune section of the domain XML
+    """
+    if not cpus:
+        return "", ""
+
+    pinnings = ['        <vcpupin vcpu="%i" cpuset="%i"/>' % (a, b) for a, b in enumerate(cpus)]
+
+    node_of = {cpu: node for node, node_cpus in machine.numa_cpus.items() for cpu in node_cpus}
+    nodes = sorted({node_of[cpu] for cpu in cpus if cpu in node_of})
+
+    if config["infrastructure"]["numa_policy"] == "isolate" and machine.host_cpus:
+        emulator = [
+            cpu
+            for node in nodes
+            for cpu in [machine.numa_cpus[node][0]]
+            + machine.cpu_siblings.get(machine.numa_cpus[node][0], [])
+        ]
+    else:
+        emulator = [sibling for cpu in cpus for sibling in machine.cpu_siblings.get(cpu, [])]
+
+    if not emulator:
+        emulator = cpus
+
+    pinnings.append('        <emulatorpin cpuset="%s"/>' % (placement.cpuset_string(emulator)))
+
+    memory_nodes = sorted(memory)
+    if not memory_nodes:
+        return "\n".join(pinnings), ""
+
+    mode = "strict"
+    if len(memory_nodes) > 1 and (
+        config["infrastructure"]["numa_policy"] == "spread"
+        or config["infrastructure"]["hugepages"] != "none"
+    ):
+        mode = "interleave"
+
+    numatune = """\
+    <numatune>
+        <memory mode='%s' nodeset='%s'/>
+    </numatune>""" % (
+        mode,
+        placement.cpuset_string(memory_nodes),
+    )
+    return "\n".join(pinnings), numatune
+
+
 def find_bridge(config, machine, bridge):
     """Check if bridge <bridge> is available on the system.
 
@@ -240,26 +427,35 @@ def start(config, machines):
     pc = config["infrastructure"]["endpoint_cores"]
 
     period = 100000
-    pinnings = []
+    pinnings = ""
+    numatune = ""
 
     for machine in machines:
-        # Counter for pinning vcpu to physical cpu
-        start_core = 0
-
         # Clouds
-        for ip, name in zip(
-            machine.cloud_controller_ips + machine.cloud_ips,
-            machine.cloud_controller_names + machine.cloud_names,
+        for i, (ip, name) in enumerate(
+            zip(
+                machine.cloud_controller_ips + machine.cloud_ips,
+                machine.cloud_controller_names + machine.cloud_names,
+            )
         ):
             with open(".tmp/domain_%s.xml" % (name), "w", encoding="utf-8") as f:
                 memory = int(1048576 * config["infrastructure"]["cloud_memory"])
+                iothreads, devices = io_config(
+                    config,
+                    bridge_name,
+                    name,
+                    cc,
+                    config["infrastructure"]["cloud_read_speed"],
+                    config["infrastructure"]["cloud_write_speed"],
+                )
 
                 if config["infrastructure"]["cpu_pin"]:
-                    pinnings = [
-                        '        <vcpupin vcpu="%i" cpuset="%i"/>' % (a, b)
-                        for a, b in zip(range(cc), range(start_core, start_core + cc))
-                    ]
-                    start_core += cc
+                    pinnings, numatune = numa_config(
+                        config,
+                        machine,
+                        machine.cpusets["cloud"][i],
+                        machine.memory_nodes["cloud"][i],
+                    )
                 # Include the running VMs, exclude base VMs
                 if config["infrastructure"]["virtiofsd"] and name.startswith("cloud"):
                     f.write(
@@ -267,21 +463,15 @@ def start(config, machines):
                         % (
                             name,
                             memory,
-                            memory_backing_config(),
+                            memory_backing_config(config, virtiofs=True),
                             "    <cpu mode='host-passthrough'/>" if using_kata else "",
                             cc,
+                            iothreads,
                             period,
                             int(period * config["infrastructure"]["cloud_quota"]),
-                            "\n".join(pinnings),
-                            bridge_name,
-                            config["infrastructure"]["base_path"],
-                            name,
-                            config["infrastructure"]["cloud_read_speed"],
-                            config["infrastructure"]["cloud_write_speed"],
-                            config["infrastructure"]["cloud_read_speed"],
-                            config["infrastructure"]["cloud_write_speed"],
-                            config["infrastructure"]["base_path"],
-                            name,
+                            pinnings,
+                            numatune,
+                            devices,
                             virtiofsd_config(name),
                         )
                     )
@@ -289,7 +479,7 @@ def start(config, machines):
 
                     with open(".tmp/user_data_%s.yml" % (name), "w", encoding="utf-8") as f:
                         hostname = name.replace("_", "")
-                        f.write(USER_DATA % (hostname, hostname, name, name, ssh_key, name, "ens3", ip, gateway, additional_commands(["sudo mkdir /var/scaphandre", "sudo mount -t virtiofs scaphandre /var/scaphandre"])))
+                        f.write(USER_DATA % (hostname, hostname, name, name, ssh_key, name, "ens3", ip, gateway, additional_commands(["sudo mkdir /var/scaphandre", "sudo mount -t virtiofs scaphandre /var/scaphandre"]), phone_home_config(config)))
                         f.close()
                 else:
                     f.write(
@@ -297,21 +487,15 @@ def start(config, machines):
                         % (
                             name,
                             memory,
-                            "",  # memory backing not included
+                            memory_backing_config(config),
                             "    <cpu mode='host-passthrough'/>" if using_kata else "",
                             cc,
+                            iothreads,
                             period,
                             int(period * config["infrastructure"]["cloud_quota"]),
-                            "\n".join(pinnings),
-                            bridge_name,
-                            config["infrastructure"]["base_path"],
-                            name,
-                            config["infrastructure"]["cloud_read_speed"],
-                            config["infrastructure"]["cloud_write_speed"],
-                            config["infrastructure"]["cloud_read_speed"],
-                            config["infrastructure"]["cloud_write_speed"],
-                            config["infrastructure"]["base_path"],
-                            name,
+                            pinnings,
+                            numatune,
+                            devices,
                             "",  # virtiofsd filesystem mapping not included
                         )
                     )
@@ -319,41 +503,44 @@ def start(config, machines):
 
                     with open(".tmp/user_data_%s.yml" % (name), "w", encoding="utf-8") as f:
                         hostname = name.replace("_", "")
-                        f.write(USER_DATA % (hostname, hostname, name, name, ssh_key, name, "ens2", ip, gateway, ""))
+                        f.write(USER_DATA % (hostname, hostname, name, name, ssh_key, name, "ens2", ip, gateway, "", phone_home_config(config)))
                         f.close()
 
         # Edges
-        for ip, name in zip(machine.edge_ips, machine.edge_names):
+        for i, (ip, name) in enumerate(zip(machine.edge_ips, machine.edge_names)):
             with open(".tmp/domain_%s.xml" % (name), "w", encoding="utf-8") as f:
                 memory = int(1048576 * config["infrastructure"]["edge_memory"])
+                iothreads, devices = io_config(
+                    config,
+                    bridge_name,
+                    name,
+                    ec,
+                    config["infrastructure"]["edge_read_speed"],
+                    config["infrastructure"]["edge_write_speed"],
+                )
 
                 if config["infrastructure"]["cpu_pin"]:
-                    pinnings = [
-                        '        <vcpupin vcpu="%i" cpuset="%i"/>' % (a, b)
-                        for a, b in zip(range(ec), range(start_core, start_core + ec))
-                    ]
-                    start_core += ec
+                    pinnings, numatune = numa_config(
+                        config,
+                        machine,
+                        machine.cpusets["edge"][i],
+                        machine.memory_nodes["edge"][i],
+                    )
 
                 f.write(
                     DOMAIN
                     % (
                         name,
                         memory,
-                        "",  # memory backing not included
+                        memory_backing_config(config),
                         "    <cpu mode='host-passthrough'/>" if using_kata else "",
                         ec,
+                        iothreads,
                         period,
                         int(period * config["infrastructure"]["edge_quota"]),
-                        "\n".join(pinnings),
-                        bridge_name,
-                        config["infrastructure"]["base_path"],
-                        name,
-                        config["infrastructure"]["edge_read_speed"],
-                        config["infrastructure"]["edge_write_speed"],
-                        config["infrastructure"]["edge_read_speed"],
-                        config["infrastructure"]["edge_write_speed"],
-                        config["infrastructure"]["base_path"],
-                        name,
+                        pinnings,
+                        numatune,
+                        devices,
                         "",  # virtiofsd filesystem mapping not included
                     )
                 )
@@ -361,41 +548,44 @@ def start(config, machines):
 
             with open(".tmp/user_data_%s.yml" % (name), "w", encoding="utf-8") as f:
                 hostname = name.replace("_", "")
-                f.write(USER_DATA % (hostname, hostname, name, name, ssh_key, name, "ens2", ip, gateway, ""))
+                f.write(USER_DATA % (hostname, hostname, name, name, ssh_key, name, "ens2", ip, gateway, "", phone_home_config(config)))
                 f.close()
 
         # Endpoints
-        for ip, name in zip(machine.endpoint_ips, machine.endpoint_names):
+        for i, (ip, name) in enumerate(zip(machine.endpoint_ips, machine.endpoint_names)):
             with open(".tmp/domain_%s.xml" % (name), "w", encoding="utf-8") as f:
                 memory = int(1048576 * config["infrastructure"]["endpoint_memory"])
+                iothreads, devices = io_config(
+                    config,
+                    bridge_name,
+                    name,
+                    pc,
+                    config["infrastructure"]["endpoint_read_speed"],
+                    config["infrastructure"]["endpoint_write_speed"],
+                )
 
                 if config["infrastructure"]["cpu_pin"]:
-                    pinnings = [
-                        '        <vcpupin vcpu="%i" cpuset="%i"/>' % (a, b)
-                        for a, b in zip(range(pc), range(start_core, start_core + pc))
-                    ]
-                    start_core += pc
+                    pinnings, numatune = numa_config(
+                        config,
+                        machine,
+                        machine.cpusets["endpoint"][i],
+                        machine.memory_nodes["endpoint"][i],
+                    )
 
                 f.write(
                     DOMAIN
                     % (
                         name,
                         memory,
-                        "",  # memory backing not included
+                        memory_backing_config(config),
                         "    <cpu mode='host-passthrough'/>" if using_kata else "",
                         pc,
+                        iothreads,
                         period,
                         int(period * config["infrastructure"]["endpoint_quota"]),
-                        "\n".join(pinnings),
-                        bridge_name,
-                        config["infrastructure"]["base_path"],
-                        name,
-                        config["infrastructure"]["endpoint_read_speed"],
-                        config["infrastructure"]["endpoint_write_speed"],
-                        config["infrastructure"]["endpoint_read_speed"],
-                        config["infrastructure"]["endpoint_write_speed"],
-                        config["infrastructure"]["base_path"],
-                        name,
+                        pinnings,
+                        numatune,
+                        devices,
                         "",  # virtiofsd filesystem mapping not included
                     )
                 )
@@ -403,12 +593,13 @@ def start(config, machines):
 
             with open(".tmp/user_data_%s.yml" % (name), "w", encoding="utf-8") as f:
                 hostname = name.replace("_", "")
-                f.write(USER_DATA % (hostname, hostname, name, name, ssh_key, name, "ens2", ip, gateway, ""))
+                f.write(USER_DATA % (hostname, hostname, name, name, ssh_key, name, "ens2", ip, gateway, "", phone_home_config(config)))
                 f.close()
 
         # Base image(s)
         for ip, name in zip(machine.base_ips, machine.base_names):
             with open(".tmp/domain_%s.xml" % (name), "w", encoding="utf-8") as f:
+                iothreads, devices = io_config(config, bridge_name, name, 1, 0, 0)
                 f.write(
                     DOMAIN
                     % (
@@ -417,18 +608,12 @@ def start(config, machines):
                         "",  # memory backing not included
                         "    <cpu mode='host-passthrough'/>" if using_kata else "",
                         1,
+                        iothreads,
                         0,
                         0,
                         "",
-                        bridge_name,
-                        config["infrastructure"]["base_path"],
-                        name,
-                        0,
-                        0,
-                        0,
-                        0,
-                        config["infrastructure"]["base_path"],
-                        name,
+                        "",
+                        devices,
                         "",  # virtiofsd filesystem mapping not included
                     )
                 )
@@ -436,5 +621,5 @@ def start(config, machines):
 
             with open(".tmp/user_data_%s.yml" % (name), "w", encoding="utf-8") as f:
                 hostname = name.replace("_", "")
-                f.write(USER_DATA % (hostname, hostname, name, name, ssh_key, name, "ens2", ip, gateway, ""))
+                f.write(USER_DATA % (hostname, hostname, name, name, ssh_key, name, "ens2", ip, gateway, "", phone_home_config(config)))
                 f.close()
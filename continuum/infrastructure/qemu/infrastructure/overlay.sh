@@ -0,0 +1,19 @@
+#!/bin/bash
+# Create a thin qcow2 overlay for a VM disk on top of its base image
+# Usage: overlay.sh <base image> <vm image> <reset: True/False>
+#
+# With reset=True, an existing overlay on the same base image content is reverted to its
+# "clean" internal snapshot instead of being recreated. The base image is resolved first,
+# so overlays on a rebuilt (re-keyed) base image are always recreated.
+base="$(readlink -f "$1")"
+img="$2"
+reset="$3"
+
+if [ "$reset" = "True" ] && qemu-img info "$img" 2>/dev/null | grep -qF "backing file: $base" \
+    && qemu-img snapshot -l "$img" | grep -qw clean; then
+    qemu-img snapshot -a clean "$img"
+else
+    rm -f "$img"
+    qemu-img create -q -f qcow2 -F qcow2 -b "$base" "$img"
+    qemu-img snapshot -c clean "$img"
+fi
@@ -0,0 +1,257 @@
+"""\
+Manage the lifecycle of QEMU VMs
+Domains are launched concurrently with one command per physical machine, and boot completion
+is detected with a cloud-init phone-home listener instead of sleeping and polling over SSH.
+"""
+
+import logging
+import re
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from . import generate
+
+
+class PhoneHome:
+    """HTTP listener for the cloud-init phone_home module.
+    Each VM posts its hostname once cloud-init finished, which happens after sshd started.
+    The listener keeps track of launch and boot times to report per-VM boot latency.
+    """
+
+    def __init__(self, host_ip):
+        """Initialize the object and start listening on a free port
+
+        Args:
+            host_ip (str): IP of the main physical machine, as reachable from the VMs
+        """
+        self.host_ip = host_ip
+
+        # VM name per IP, and per hostname (which has no underscores)
+        self.names = {}
+        self.hostnames = {}
+
+        # Timestamps per VM name
+        self.launched = {}
+        self.booted = {}
+
+        self.condition = threading.Condition()
+
+        listener = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Handle a single phone-home POST request"""
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Register the VM that sent this request as booted"""
+                length = int(self.headers.get("Content-Length", 0))
+                body = parse_qs(self.rfile.read(length).decode("utf-8"))
+                hostname = body.get("hostname", [""])[0]
+
+                listener.arrived(self.client_address[0], hostname)
+
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *_args):
+                """Silence the default stderr logging of http.server"""
+
+        self.server = ThreadingHTTPServer(("0.0.0.0", 0), Handler)
+        self.port = self.server.server_address[1]
+
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logging.debug("Phone-home listener running on %s", self.url())
+
+    def url(self):
+        """URL the VMs should post to
+
+        Returns:
+            str: Phone-home URL
+        """
+        return "http://%s:%i/$INSTANCE_ID/" % (self.host_ip, self.port)
+
+    def expect(self, name, ip):
+        """Register a VM that will phone home
+
+        Args:
+            name (str): VM name
+            ip (str): VM IP
+        """
+        with self.condition:
+            self.names[ip] = name
+            self.hostnames[name.replace("_", "")] = name
+            self.booted.pop(name, None)
+
+    def launch(self, names):
+        """Record the launch time of VMs
+
+        Args:
+            names (list(str)): VM names
+        """
+        t = time.time()
+        with self.condition:
+            for name in names:
+                self.launched[name] = t
+                self.booted.pop(name, None)
+
+    def arrived(self, ip, hostname):
+        """Record that a VM finished booting
+
+        Args:
+            ip (str): Source IP of the phone-home request
+            hostname (str): Hostname posted by cloud-init
+        """
+        with self.condition:
+            name = self.names.get(ip, self.hostnames.get(hostname))
+            if name is None:
+                logging.debug("Phone-home from unknown VM %s (%s)", hostname, ip)
+                return
+
+            self.booted[name] = time.time()
+            self.condition.notify_all()
+
+    def wait(self, ips, timeout=300):
+        """Block until all VMs with the given IPs have booted, or until the timeout
+
+        Args:
+            ips (list(str)): VM IPs to wait for
+            timeout (int, optional): Max seconds to wait. Defaults to 300.
+
+        Returns:
+            list(str): IPs of VMs that did not phone home in time
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                left = [ip for ip in ips if self.names.get(ip) not in self.booted]
+                remaining = deadline - time.monotonic()
+                if not left or remaining <= 0:
+                    return left
+
+                self.condition.wait(remaining)
+
+    def latency(self, names):
+        """Get the boot latency of VMs, from launch until phone-home
+
+        Args:
+            names (list(str)): VM names
+
+        Returns:
+            dict(str, float): Boot latency in seconds per VM, only for booted VMs
+        """
+        with self.condition:
+            return {
+                name: self.booted[name] - self.launched[name]
+                for name in names
+                if name in self.booted and name in self.launched
+            }
+
+    def report(self, ips):
+        """Log the boot latency of VMs
+
+        Args:
+            ips (list(str)): VM IPs
+        """
+        names = [self.names[ip] for ip in ips if ip in self.names]
+        latencies = self.latency(names)
+        if not latencies:
+            return
+
+        logging.info("-" * 78)
+        logging.info("%-40s %-20s", "VM", "Boot latency (s)")
+        for name in names:
+            if name in latencies:
+                logging.info("%-40s %-20.2f", name, latencies[name])
+
+        logging.info("-" * 78)
+
+
+def host_ip(config, machine):
+    """Get the IP of this machine as seen by the VMs
+
+    Reuse the registry IP the configuration parser already determined. Without a registry
+    (infrastructure only), use this machine's address on the bridge the VMs are attached to.
+
+    Args:
+        config (dict): Parsed configuration
+        machine (Machine object): Object representing the physical machine we currently use
+
+    Returns:
+        str: IP address
+    """
+    if "registry" in config:
+        return config["registry"].split(":")[0]
+
+    # Same bridge selection as generate.start()
+    bridge = "br0"
+    if generate.find_bridge(config, machine, bridge) == 0:
+        bridge = "virbr0"
+        if generate.find_bridge(config, machine, bridge) == 0:
+            logging.error("ERROR: Could not find a network bridge")
+            sys.exit()
+
+    output, error = machine.process(
+        config, "ip -4 -o addr show dev %s" % (bridge), shell=True
+    )[0]
+    addresses = re.findall(r"inet (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})/", "".join(output))
+    if error != [] or addresses == []:
+        logging.error("ERROR: Could not find the IP address of bridge %s", bridge)
+        sys.exit()
+
+    return addresses[0]
+
+
+def create_command(machine, paths):
+    """Command to create multiple domains concurrently on one physical machine
+
+    Args:
+        machine (Machine object): Object representing the physical machine
+        paths (list(str)): Paths to domain XML files on that machine
+
+    Returns:
+        str: Shell command
+    """
+    comm = " & ".join("virsh --connect qemu:///system create %s" % (path) for path in paths)
+    comm += " & wait"
+
+    if machine.is_local:
+        return comm
+
+    return "ssh %s -t 'bash -l -c \"%s\"'" % (machine.name, comm)
+
+
+def wait_stopped(config, machines, pattern, timeout=30):
+    """Wait until no QEMU process matching a guest name pattern runs anymore.
+    Destroyed or shut down domains may hold image locks for a short while.
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+        pattern (str): Regex for guest names, e.g. "[a-z0-9_]*_user"
+        timeout (int, optional): Max seconds to wait per machine. Defaults to 30.
+    """
+    # The pattern can't match its own command line, as it is not a valid guest name
+    comm = 'for i in $(seq %i); do pgrep -f "guest=%s," > /dev/null || exit 0; sleep 0.1; done; \
+echo timeout' % (timeout * 10, pattern)
+
+    commands = []
+    for machine in machines:
+        if machine.is_local:
+            commands.append(comm)
+        else:
+            commands.append("ssh %s '%s'" % (machine.name, comm))
+
+    results = machines[0].process(config, commands, shell=True)
+
+    for machine, (output, error) in zip(machines, results):
+        if error or output:
+            logging.warning(
+                "QEMU processes for %s still running on %s: %s",
+                pattern,
+                machine.name,
+                "".join(output + error),
+            )
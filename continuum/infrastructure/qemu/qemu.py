@@ -4,7 +4,7 @@ Create and use QEMU Vms
 
 import sys
 import logging
-import time
+import math
 import string
 import os
 
@@ -12,7 +12,10 @@ from infrastructure import infrastructure
 from infrastructure import ansible
 from infrastructure import machine as m
 
+from . import cache
 from . import generate
+from . import lifecycle
+from . import snapshot
 
 
 def delete_vms(config, machines):
@@ -63,7 +66,23 @@ def add_options(_config):
     """
     # TODO: Move base_ip and related logic to here - that's not generic
     #       (that is, GCP doesnt use it)
-    return []
+    settings = [
+        # Option | Type | Condition | Mandatory | Default
+        ["disk_reset", bool, lambda x: x in [True, False], False, False],
+        ["warm_snapshot", bool, lambda x: x in [True, False], False, False],
+        ["io_profile", str, lambda x: x in ["legacy", "virtio", "virtio-scsi"], False, "legacy"],
+        [
+            "disk_cache",
+            str,
+            lambda x: x in ["none", "writethrough", "writeback", "directsync", "unsafe"],
+            False,
+            "none",
+        ],
+        ["disk_io", str, lambda x: x in ["threads", "native", "io_uring"], False, "threads"],
+        ["hugepages", str, lambda x: x in ["none", "2M", "1G"], False, "none"],
+    ]
+
+    return settings
 
 
 def verify_options(parser, config):
@@ -75,6 +94,17 @@ def verify_options(parser, config):
     """
     if config["infrastructure"]["provider"] != "qemu":
         parser.error("ERROR: Infrastructure provider should be qemu")
+    elif config["infrastructure"]["warm_snapshot"] and (
+        config["infrastructure"]["infra_only"] or config["benchmark"]["resource_manager"] == "mist"
+    ):
+        parser.error("ERROR: warm_snapshot requires a resource manager")
+    elif config["infrastructure"]["warm_snapshot"] and config["infrastructure"]["virtiofsd"]:
+        # Libvirt can't save the state of a domain with a virtiofs filesystem attached
+        parser.error("ERROR: warm_snapshot can't be combined with virtiofsd")
+    elif config["infrastructure"]["disk_io"] == "native" and config["infrastructure"][
+        "disk_cache"
+    ] not in ["none", "directsync"]:
+        parser.error("ERROR: disk_io = native requires disk_cache = none or directsync")
 
 
 def update_ip(config, middle_ip, postfix_ip):
@@ -349,7 +379,7 @@ def os_image(config, machines):
 
 
 def base_image(config, machines):
-    """Check if a base image already exists, and if not create the image
+    """Check if an up-to-date base image exists in the image cache, and if not create the image
 
     Args:
         config (dict): Parsed configuration
@@ -357,120 +387,72 @@ def base_image(config, machines):
     """
     logging.info("Check if new base image(s) needs to be created")
 
-    # Create a flat list of base_names, without any special characters
-    base_names = []
-    for machine in machines:
-        for base_name in machine.base_names:
-            name = base_name.rsplit("_", 1)[0]
-            name = name.rstrip(string.digits)
-            base_names.append(name)
-
-    # Create a mask for the previous list
-    need_images = [False for _ in range(len(base_names))]
-
-    # Check if all images are available on each machine, otherwise set need_images
-    for machine in machines:
-        for base_name in machine.base_names:
-            command = [
-                "find",
-                os.path.join(
-                    config["infrastructure"]["base_path"],
-                    ".continuum/images/%s.qcow2" % (base_name),
-                ),
-            ]
-            output, error = machine.process(config, command, ssh=machine.name)[0]
-
-            if error or not output:
-                base_name = base_name.rsplit("_", 1)[0].rstrip(string.digits)
-                need_images[base_names.index(base_name)] = True
-
-    # Stop if no base images are required
-    base_names = [name for name, need in zip(base_names, need_images) if need]
+    # Base images are keyed by their build inputs, so stale images are rebuilt as well
+    base_names = cache.lookup(config, machines)
     if base_names == []:
         logging.info("Base image(s) are all already present")
         return
 
-    # Create base images
+    # Create base images concurrently, each playbook targets a different group of hosts
+    commands = []
     for base_name in base_names:
         logging.info("Create base image %s", base_name)
         if base_name == "base":
-            command = [
-                "ansible-playbook",
-                "-i",
-                os.path.join(config["infrastructure"]["base_path"], ".continuum/inventory"),
-                os.path.join(
-                    config["infrastructure"]["base_path"],
-                    ".continuum/infrastructure/base_start.yml",
-                ),
-            ]
+            playbook = "base_start.yml"
         elif "base_cloud" in base_name:
-            command = [
-                "ansible-playbook",
-                "-i",
-                os.path.join(config["infrastructure"]["base_path"], ".continuum/inventory"),
-                os.path.join(
-                    config["infrastructure"]["base_path"],
-                    ".continuum/infrastructure/base_cloud_start.yml",
-                ),
-            ]
+            playbook = "base_cloud_start.yml"
         elif "base_edge" in base_name:
-            command = [
-                "ansible-playbook",
-                "-i",
-                os.path.join(config["infrastructure"]["base_path"], ".continuum/inventory"),
-                os.path.join(
-                    config["infrastructure"]["base_path"],
-                    ".continuum/infrastructure/base_edge_start.yml",
-                ),
-            ]
+            playbook = "base_edge_start.yml"
         elif "base_endpoint" in base_name:
-            command = [
+            playbook = "base_endpoint_start.yml"
+
+        commands.append(
+            [
                 "ansible-playbook",
                 "-i",
                 os.path.join(config["infrastructure"]["base_path"], ".continuum/inventory"),
                 os.path.join(
                     config["infrastructure"]["base_path"],
-                    ".continuum/infrastructure/base_endpoint_start.yml",
+                    ".continuum/infrastructure/%s" % (playbook),
                 ),
             ]
+        )
 
-        ansible.check_output(machines[0].process(config, command)[0])
+    results = machines[0].process(config, commands)
+
+    for command, (output, error) in zip(commands, results):
+        logging.debug("Check output for command [%s]", " ".join(command))
+        ansible.check_output((output, error))
 
-    # Create commands to launch the base VMs concurrently
+    # Create commands to launch the base VMs concurrently, one command per machine
     commands = []
+    launched = []
     base_ips = []
     for machine in machines:
+        paths = []
         for base_name, base_ip in zip(machine.base_names, machine.base_ips):
             base_name_r = base_name.rsplit("_", 1)[0].rstrip(string.digits)
             if base_name_r in base_names:
-                path = os.path.join(
-                    config["infrastructure"]["base_path"],
-                    ".continuum/domain_%s.xml" % (base_name),
-                )
-                if machine.is_local:
-                    command = "virsh --connect qemu:///system create %s" % (path)
-                else:
-                    command = (
-                        "ssh %s -t 'bash -l -c \"virsh --connect qemu:///system create %s\"'"
-                        % (machine.name, path)
+                paths.append(
+                    os.path.join(
+                        config["infrastructure"]["base_path"],
+                        ".continuum/domain_%s.xml" % (base_name),
                     )
-
-                commands.append(command)
+                )
+                launched.append(base_name)
                 base_ips.append(base_ip)
 
+        if paths:
+            commands.append(lifecycle.create_command(machine, paths))
+
     # Now launch the VMs
+    config["phone_home"].launch(launched)
     results = machines[0].process(config, commands, shell=True)
 
     # Check if VM launching went as expected
     for command, (output, error) in zip(commands, results):
         logging.debug("Check output for command [%s]", command)
-
-        if error and "Connection to " not in error[0]:
-            logging.error("ERROR: %s", "".join(error))
-            sys.exit()
-        elif "Domain " not in output[0] or " created from " not in output[0]:
-            logging.error("ERROR: %s", "".join(output))
-            sys.exit()
+        check_created(command, output, error)
 
     # Fix SSH keys for each base image
     infrastructure.add_ssh(config, machines, base=base_ips)
@@ -634,11 +616,136 @@ def base_image(config, machines):
             sys.exit()
 
     # Wait for the shutdown to be completed
-    time.sleep(5)
+    lifecycle.wait_stopped(config, machines, r"base[a-z0-9_]*_%s" % (config["username"]))
+
+    cache.store(config, machines, base_names)
+
+
+def hugepage_needs(config, machine, pages_per_gb):
+    """Get the number of hugepages the VMs on a machine need. With cpu_pin, the memory of every
+    VM is bound to the NUMA nodes the placement put it on, so the pages are needed on those nodes.
+
+    Args:
+        config (dict): Parsed configuration
+        machine (Machine object): Object representing the physical machine
+        pages_per_gb (int): Hugepages per GB
+
+    Returns:
+        list(tuple(int, int)): NUMA node (None for the whole machine) and number of pages
+    """
+    if config["infrastructure"]["cpu_pin"] and machine.numa_cpus:
+        needs = {}
+        for vm_type in ["cloud", "edge", "endpoint"]:
+            for memory in machine.memory_nodes[vm_type]:
+                for node, gb in memory.items():
+                    needs[node] = needs.get(node, 0) + math.ceil(round(gb * pages_per_gb, 6))
+
+        return sorted(needs.items())
+
+    memory = (
+        (machine.cloud_controller + machine.clouds) * config["infrastructure"]["cloud_memory"]
+        + machine.edges * config["infrastructure"]["edge_memory"]
+        + machine.endpoints * config["infrastructure"]["endpoint_memory"]
+    )
+    return [(None, int(memory * pages_per_gb))]
+
+
+def reserve_hugepages(config, machines):
+    """Reserve enough free hugepages on each machine to back the memory of its VMs.
+    With cpu_pin, pages are reserved on each NUMA node for the VM memory bound to it, as the
+    numatune policy only allows allocations from those nodes. Otherwise, the machine-wide pool
+    is used. Pools are only grown, never shrunk. 1G pages often can't be allocated at runtime due
+    to fragmentation, in which case they should be reserved at boot (hugepagesz=1G hugepages=N).
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+    """
+    size = config["infrastructure"]["hugepages"]
+    logging.info("Reserve %s hugepages for VM memory", size)
+
+    # Pages of destroyed VMs are only freed once their QEMU process has exited
+    lifecycle.wait_stopped(config, machines, r"[a-z0-9_]*_%s" % (config["username"]))
+
+    pool = "hugepages/hugepages-%s" % ("2048kB" if size == "2M" else "1048576kB")
+    pages_per_gb = 512 if size == "2M" else 1
+
+    commands = []
+    needed = []
+    for machine in machines:
+        needs = hugepage_needs(config, machine, pages_per_gb)
+        if not needs:
+            needs = [(None, 0)]
+
+        needed.append(needs)
+
+        parts = []
+        for node, need in needs:
+            path = "/sys/kernel/mm/%s" % (pool)
+            if node is not None:
+                path = "/sys/devices/system/node/node%i/%s" % (node, pool)
+
+            # Print the free pages as the last line of every pool
+            parts.append(
+                "free=$(cat %s/free_hugepages) && total=$(cat %s/nr_hugepages) && "
+                "if [ $free -lt %i ]; then echo $((total + %i - free)) | "
+                "sudo tee %s/nr_hugepages > /dev/null; fi && cat %s/free_hugepages"
+                % (path, path, need, need, path, path)
+            )
+
+        commands.append(cache.wrap_command(machine, " && ".join(parts)))
+
+    results = machines[0].process(config, commands, shell=True)
+
+    for machine, needs, (output, error) in zip(machines, needed, results):
+        if error:
+            logging.error(
+                "ERROR: Could not reserve hugepages on %s: %s", machine.name, "".join(error)
+            )
+            sys.exit()
+
+        output = [line for line in output if line.strip()]
+        for i, (node, need) in enumerate(needs):
+            where = machine.name if node is None else "%s NUMA node %i" % (machine.name, node)
+            free = 0
+            if len(output) == len(needs) and output[i].strip().isdigit():
+                free = int(output[i])
+
+            if free < need:
+                logging.error(
+                    "ERROR: %s has %i free %s hugepages, VMs need %i. Reserve them at boot time",
+                    where,
+                    free,
+                    size,
+                    need,
+                )
+                sys.exit()
+
+            logging.debug("%s has %i free %s hugepages, VMs need %i", where, free, size, need)
+
+
+def check_created(command, output, error):
+    """Check the output of a command that creates domains, stop on failure
+
+    Args:
+        command (str): Executed command, see lifecycle.create_command()
+        output (list(str)): Process stdout
+        error (list(str)): Process stderr
+    """
+    error = [line for line in error if line.strip() and "Connection to " not in line]
+    if error:
+        logging.error("ERROR: %s", "".join(error))
+        sys.exit()
+
+    paths = [part.split(" ")[0] for part in command.split(" create ")[1:]]
+    for path in paths:
+        if not any(" created from " in line and path in line for line in output):
+            logging.error("ERROR: Domain %s was not created: %s", path, "".join(output))
+            sys.exit()
 
 
 def launch_vms(config, machines, repeat=None):
-    """Launch VMs concurrently
+    """Launch VMs concurrently, with one command per physical machine
     Moved into a function so it can be re-executed when a VM didn't start for some reason
 
     Args:
@@ -647,60 +754,53 @@ def launch_vms(config, machines, repeat=None):
         repeat (list, optional): Repeat specific execution. If empty, start all VMs. Defaults to [].
 
     Returns:
-        list: Commands to execute again
+        list: (machine, VM names) to launch again
     """
     # Launch the VMs concurrently
     logging.info("Start VMs")
 
-    # Sometimes previous QEMU commands aren't finished yet,
-    # so it's safer to wait a bit to prevent lock errors
-    time.sleep(5)
-
-    commands = []
     if not repeat:
+        # Destroyed QEMU processes may still hold image locks, so wait for them to exit
+        lifecycle.wait_stopped(config, machines, r"[a-z0-9_]*_%s" % (config["username"]))
+
+        repeat = []
         for machine in machines:
-            for name in (
+            names = (
                 machine.cloud_controller_names
                 + machine.cloud_names
                 + machine.edge_names
                 + machine.endpoint_names
-            ):
-                path = os.path.join(
-                    config["infrastructure"]["base_path"],
-                    ".continuum/domain_%s.xml" % (name),
-                )
-                if machine.is_local:
-                    command = "virsh --connect qemu:///system create %s" % (path)
-                else:
-                    command = (
-                        "ssh %s -t 'bash -l -c \"virsh --connect qemu:///system create %s\"'"
-                        % (machine.name, path)
-                    )
+            )
+            if names:
+                repeat.append((machine, names))
 
-                commands.append(command)
+    commands = []
+    for machine, names in repeat:
+        paths = [
+            os.path.join(
+                config["infrastructure"]["base_path"],
+                ".continuum/domain_%s.xml" % (name),
+            )
+            for name in names
+        ]
+        commands.append(lifecycle.create_command(machine, paths))
 
-        results = machines[0].process(config, commands, shell=True)
-    else:
-        # Only execute specific commands on repeat until VMs are launched succesfully
-        commands = repeat
-        results = machines[0].process(config, commands, shell=True)
+    config["phone_home"].launch([name for _, names in repeat for name in names])
+    results = machines[0].process(config, commands, shell=True)
 
-    repeat = []
-    for command, (output, error) in zip(commands, results):
+    new_repeat = []
+    for (machine, names), command, (output, error) in zip(repeat, commands, results):
         logging.debug("Check output for command [%s]", command)
 
-        if error and "kex_exchange_identification" in error[0]:
+        if any("kex_exchange_identification" in line for line in error):
             # Repeat execution if key exchange error, can be solved by executing again
             logging.error("ERROR, REPEAT EXECUTION: %s", "".join(error))
-            repeat.append(command)
-        elif error and "Connection to " not in error[0]:
-            logging.error("ERROR: %s", "".join(error))
-            sys.exit()
-        elif "Domain " not in output[0] or " created from " not in output[0]:
-            logging.error("ERROR: %s", "".join(output))
-            sys.exit()
+            new_repeat.append((machine, names))
+            continue
+
+        check_created(command, output, error)
 
-    return repeat
+    return new_repeat
 
 
 def start_vms(config, machines):
@@ -712,60 +812,48 @@ def start_vms(config, machines):
     """
     logging.info("Start VM creation using QEMU")
 
-    # Delete older VM images
-    command = [
-        "ansible-playbook",
-        "-i",
-        os.path.join(config["infrastructure"]["base_path"], ".continuum/inventory"),
-        os.path.join(
-            config["infrastructure"]["base_path"],
-            ".continuum/infrastructure/remove.yml",
-        ),
-    ]
-    ansible.check_output(machines[0].process(config, command)[0])
-
-    # Check if os and base image need to be created, and if so do create them
-    os_image(config, machines)
-    base_image(config, machines)
-
-    # Create cloud images
-    if config["infrastructure"]["cloud_nodes"]:
+    # Delete older VM images, unless their overlays can be reverted in place
+    if not config["infrastructure"]["disk_reset"]:
         command = [
             "ansible-playbook",
             "-i",
             os.path.join(config["infrastructure"]["base_path"], ".continuum/inventory"),
             os.path.join(
                 config["infrastructure"]["base_path"],
-                ".continuum/infrastructure/cloud_start.yml",
+                ".continuum/infrastructure/remove.yml",
             ),
         ]
         ansible.check_output(machines[0].process(config, command)[0])
 
-    # Create edge images
-    if config["infrastructure"]["edge_nodes"]:
-        command = [
-            "ansible-playbook",
-            "-i",
-            os.path.join(config["infrastructure"]["base_path"], ".continuum/inventory"),
-            os.path.join(
-                config["infrastructure"]["base_path"],
-                ".continuum/infrastructure/edge_start.yml",
-            ),
-        ]
-        ansible.check_output(machines[0].process(config, command)[0])
+    # Check if os and base image need to be created, and if so do create them
+    os_image(config, machines)
+    base_image(config, machines)
 
-    # Create endpoint images
-    if config["infrastructure"]["endpoint_nodes"]:
-        command = [
-            "ansible-playbook",
-            "-i",
-            os.path.join(config["infrastructure"]["base_path"], ".continuum/inventory"),
-            os.path.join(
-                config["infrastructure"]["base_path"],
-                ".continuum/infrastructure/endpoint_start.yml",
-            ),
-        ]
-        ansible.check_output(machines[0].process(config, command)[0])
+    # Create cloud / edge / endpoint images concurrently as thin overlays on the base images
+    commands = []
+    for tier in ["cloud", "edge", "endpoint"]:
+        if not config["infrastructure"]["%s_nodes" % (tier)]:
+            continue
+
+        commands.append(
+            [
+                "ansible-playbook",
+                "-i",
+                os.path.join(config["infrastructure"]["base_path"], ".continuum/inventory"),
+                "-e",
+                "disk_reset=%s" % (config["infrastructure"]["disk_reset"]),
+                os.path.join(
+                    config["infrastructure"]["base_path"],
+                    ".continuum/infrastructure/%s_start.yml" % (tier),
+                ),
+            ]
+        )
+
+    results = machines[0].process(config, commands)
+
+    for command, (output, error) in zip(commands, results):
+        logging.debug("Check output for command [%s]", " ".join(command))
+        ansible.check_output((output, error))
 
     # Start VMs
     repeat = []
@@ -776,7 +864,11 @@ def start_vms(config, machines):
             break
 
         if i == 1:
-            logging.error("ERROR AFTER %i REPS: %s", i + 1, " | ".join(repeat))
+            logging.error(
+                "ERROR AFTER %i REPS: %s",
+                i + 1,
+                " | ".join(machine.name for machine, _ in repeat),
+            )
             sys.exit()
 
         i += 1
@@ -803,9 +895,52 @@ def start(config, machines):
     ansible.create_inventory_vm(config, machines)
     ansible.copy(config, machines)
 
+    # Restore a pre-warmed cluster from an earlier run with the same configuration, if any
+    restore = config["infrastructure"]["warm_snapshot"] and snapshot.exists(config, machines)
+
+    # Listen for VMs reporting they have booted, instead of polling them
+    # Restored VMs have booted already, so they won't phone home
+    if not restore:
+        config["phone_home"] = lifecycle.PhoneHome(lifecycle.host_ip(config, machines[0]))
+        for machine in machines:
+            for name, ip in zip(
+                machine.cloud_controller_names
+                + machine.cloud_names
+                + machine.edge_names
+                + machine.endpoint_names
+                + machine.base_names,
+                machine.cloud_controller_ips
+                + machine.cloud_ips
+                + machine.edge_ips
+                + machine.endpoint_ips
+                + machine.base_ips,
+            ):
+                config["phone_home"].expect(name, ip)
+
     generate.start(config, machines)
     copy(config, machines)
 
     logging.info("Setting up the infrastructure")
-    start_vms(config, machines)
+    if config["infrastructure"]["hugepages"] != "none":
+        reserve_hugepages(config, machines)
+
+    if restore:
+        snapshot.restore(config, machines)
+        config["snapshot_restored"] = True
+    else:
+        start_vms(config, machines)
+
     infrastructure.add_ssh(config, machines)
+
+    if restore:
+        snapshot.sync_clock(config, machines)
+
+
+def save_snapshot(config, machines):
+    """Save the initialized cluster so later runs with the same configuration can restore it
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+    """
+    snapshot.save(config, machines)
@@ -0,0 +1,310 @@
+"""\
+Save and restore pre-warmed clusters as libvirt memory-and-disk snapshots
+After the resource manager has been installed (and worker images have been cached), the memory
+state of every VM is saved with virsh save, and its disk is frozen as a read-only qcow2 layer.
+A later run with the same configuration restores these snapshots instead of creating VMs
+and installing the resource manager again.
+
+Snapshots are stored per physical machine in .continuum/snapshots/<key>/, where the key hashes
+the configuration, the base image keys, and the resource manager files.
+"""
+
+import hashlib
+import logging
+import os
+import sys
+
+from . import cache
+from . import lifecycle
+
+# Settings that don't change the state of the VMs, and are left out of the snapshot key
+IGNORED = ["delete", "netperf", "warm_snapshot"]
+
+# Benchmark settings that change the state of the VMs before the snapshot is taken
+BENCHMARK = [
+    "resource_manager",
+    "kube_version",
+    "observability",
+    "cache_worker",
+    "runtime",
+    "runtime_filesystem",
+]
+
+
+def vm_names(machine):
+    """Names of all VMs on a physical machine, excluding base VMs
+
+    Args:
+        machine (Machine object): Object representing the physical machine
+
+    Returns:
+        list(str): VM names
+    """
+    return (
+        machine.cloud_controller_names
+        + machine.cloud_names
+        + machine.edge_names
+        + machine.endpoint_names
+    )
+
+
+def snapshot_key(config, machines):
+    """Compute the key of the pre-warmed cluster described by the configuration
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+
+    Returns:
+        str: Hex digest identifying the cluster state
+    """
+    h = hashlib.sha256()
+
+    # Base images the VM disks are layered on
+    base_names = {}
+    for machine in machines:
+        for base_name in machine.base_names:
+            base_names.setdefault(cache.base_type(base_name), base_name)
+
+    for name in sorted(base_names):
+        h.update(cache.image_key(config, base_names[name]).encode("utf-8"))
+
+    # Placement of VMs on physical machines
+    for machine in machines:
+        h.update(("%s:%s" % (machine.name, ",".join(vm_names(machine)))).encode("utf-8"))
+
+    settings = [
+        "%s=%s" % (k, v) for k, v in sorted(config["infrastructure"].items()) if k not in IGNORED
+    ]
+    settings += ["%s=%s" % (k, config["benchmark"].get(k)) for k in BENCHMARK]
+
+    if "cache_worker" in config["benchmark"] and config["benchmark"]["cache_worker"]:
+        settings.append(str(config["benchmark"]["application"]))
+        settings.append(str(config.get("images")))
+
+    for setting in settings:
+        h.update(setting.encode("utf-8"))
+        h.update(b"\0")
+
+    # The VMs only accept the SSH key they were created with
+    with open("%s.pub" % (config["ssh_key"]), "rb") as f:
+        h.update(f.read())
+
+    # Resource manager playbooks
+    rm_path = os.path.join(
+        config["base"], "resource_manager", config["benchmark"]["resource_manager"]
+    )
+    for root, dirs, files in os.walk(rm_path):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(".pyc"):
+                continue
+
+            path = os.path.join(root, file)
+            h.update(os.path.relpath(path, config["base"]).encode("utf-8"))
+            with open(path, "rb") as f:
+                h.update(f.read())
+
+    return h.hexdigest()[:16]
+
+
+def paths(config, key, name):
+    """Paths used to snapshot a VM
+
+    Args:
+        config (dict): Parsed configuration
+        key (str): Snapshot key, see snapshot_key()
+        name (str): VM name
+
+    Returns:
+        dict(str, str): Paths of the live disk and user data image, and their snapshot
+            counterparts (memory state, frozen disk, user data)
+    """
+    base = os.path.join(config["infrastructure"]["base_path"], ".continuum")
+    directory = os.path.join(base, "snapshots", key)
+    return {
+        "dir": directory,
+        "disk": os.path.join(base, "images", "%s.qcow2" % (name)),
+        "user_data": os.path.join(base, "images", "user_data_%s.img" % (name)),
+        "state": os.path.join(directory, "%s.save" % (name)),
+        "frozen": os.path.join(directory, "%s.qcow2" % (name)),
+        "frozen_user_data": os.path.join(directory, "user_data_%s.img" % (name)),
+    }
+
+
+def run(config, machines, commands):
+    """Execute commands on physical machines concurrently, stop on errors
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+        commands (list(tuple(Machine object, str))): Shell command per physical machine
+
+    Returns:
+        list(list(str)): Output per command
+    """
+    if not commands:
+        return []
+
+    commands = [cache.wrap_command(machine, command) for machine, command in commands]
+    results = machines[0].process(config, commands, shell=True)
+
+    outputs = []
+    for command, (output, error) in zip(commands, results):
+        logging.debug("Check output for command [%s]", command)
+
+        if error:
+            logging.error("".join(error))
+            sys.exit()
+
+        outputs.append(output)
+
+    return outputs
+
+
+def exists(config, machines):
+    """Check if all physical machines hold a snapshot of the configured cluster
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+
+    Returns:
+        bool: A complete snapshot is available
+    """
+    key = snapshot_key(config, machines)
+    logging.info("Look up pre-warmed cluster snapshot %s", key)
+
+    commands = []
+    for machine in machines:
+        # The memory state is written last, so its presence marks a complete snapshot
+        files = []
+        for name in vm_names(machine):
+            p = paths(config, key, name)
+            files += [p["state"], p["frozen"], p["frozen_user_data"]]
+
+        if files:
+            commands.append(
+                (
+                    machine,
+                    "for f in %s; do [ -f $f ] || { echo MISS; exit 0; }; done; echo HIT"
+                    % (" ".join(files)),
+                )
+            )
+
+    outputs = run(config, machines, commands)
+    hit = all(output and output[-1].strip() == "HIT" for output in outputs)
+
+    if not hit:
+        logging.info("No pre-warmed cluster snapshot found, set up the cluster from scratch")
+
+    return hit
+
+
+def save(config, machines):
+    """Save the memory and disk state of all VMs, and resume them afterwards.
+    Disks are frozen by moving them into the snapshot and layering a new overlay on top,
+    so the running VMs never modify the snapshot.
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+    """
+    key = snapshot_key(config, machines)
+    logging.info("Save pre-warmed cluster snapshot %s", key)
+
+    commands = []
+    for machine in machines:
+        vms = []
+        for name in vm_names(machine):
+            p = paths(config, key, name)
+            vms.append(
+                "(virsh --connect qemu:///system save %s %s.part --running > /dev/null && "
+                "mv -f %s %s && "
+                "qemu-img create -q -f qcow2 -F qcow2 -b %s %s && "
+                "cp -f %s %s && "
+                "mv -f %s.part %s && "
+                "virsh --connect qemu:///system restore %s > /dev/null)"
+                % (
+                    name,
+                    p["state"],
+                    p["disk"],
+                    p["frozen"],
+                    p["frozen"],
+                    p["disk"],
+                    p["user_data"],
+                    p["frozen_user_data"],
+                    p["state"],
+                    p["state"],
+                    p["state"],
+                )
+            )
+
+        if vms:
+            directory = paths(config, key, "")["dir"]
+            commands.append(
+                (
+                    machine,
+                    "rm -rf %s && mkdir -p %s && { %s & wait; }"
+                    % (directory, directory, " & ".join(vms)),
+                )
+            )
+
+    run(config, machines, commands)
+
+
+def restore(config, machines):
+    """Restore all VMs from their snapshot. Each VM gets a new overlay on its frozen disk.
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+    """
+    key = snapshot_key(config, machines)
+    logging.info("Restore pre-warmed cluster snapshot %s", key)
+
+    # Destroyed QEMU processes may still hold image locks, so wait for them to exit
+    lifecycle.wait_stopped(config, machines, r"[a-z0-9_]*_%s" % (config["username"]))
+
+    commands = []
+    for machine in machines:
+        vms = []
+        for name in vm_names(machine):
+            p = paths(config, key, name)
+            vms.append(
+                "(rm -f %s && "
+                "qemu-img create -q -f qcow2 -F qcow2 -b %s %s && "
+                "cp -f %s %s && "
+                "virsh --connect qemu:///system restore %s > /dev/null)"
+                % (
+                    p["disk"],
+                    p["frozen"],
+                    p["disk"],
+                    p["frozen_user_data"],
+                    p["user_data"],
+                    p["state"],
+                )
+            )
+
+        if vms:
+            commands.append((machine, "%s & wait" % (" & ".join(vms))))
+
+    run(config, machines, commands)
+
+
+def sync_clock(config, machines):
+    """Set the clock of restored VMs from their real-time clock, which follows the host.
+    Without this, guest time lags behind by the time between saving and restoring.
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+    """
+    logging.info("Synchronize clocks of restored VMs")
+    sshs = config["cloud_ssh"] + config["edge_ssh"] + config["endpoint_ssh"]
+    results = machines[0].process(config, "sudo hwclock --hctosys", shell=True, ssh=sshs)
+
+    for ssh, (_, error) in zip(sshs, results):
+        if error and not all("[CONTINUUM]" in l for l in error):
+            logging.error("Could not synchronize clock on %s: %s", ssh, "".join(error))
+            sys.exit()
@@ -16,9 +16,36 @@ from infrastructure import infrastructure
 from resource_manager import resource_manager
 
 
+# Implementations per project component, each in <component>/<name>/<name>.py
+# Only the implementations used by a configuration are imported, and only these are accepted
+# as options in the configuration file
+PLUGINS = {
+    "infrastructure": ["aws", "baremetal", "gcp", "qemu"],
+    "resource_manager": ["endpoint", "kube_kata", "kubecontrol", "kubeedge", "kubernetes"],
+    "execution_model": ["openfaas"],
+    "application": ["empty", "empty_kata", "image_classification", "mem_usage", "stress"],
+}
+
+
+def load_plugin(component, name):
+    """Import the implementation of a project component, if it exists
+
+    Args:
+        component (str): Project component, key of PLUGINS
+        name (str): Name of the implementation
+
+    Returns:
+        module: Imported module, or None if there is no such implementation
+    """
+    if name not in PLUGINS[component]:
+        return None
+
+    return importlib.import_module("%s.%s.%s" % (component, name, name))
+
+
 def dynamic_import(parser, config):
     """Perform magic and dynamic imports to solve project dependencies
-    Find an implementation for every used project component:
+    Find an implementation for every used project component in PLUGINS:
     - Infrastructure provider
     - Resource manager
     - Execution model
@@ -37,13 +64,10 @@ def dynamic_import(parser, config):
         "application": False,
     }
 
-    # Check if infrastructure provider directory exists
-    dirs = list(os.walk("./infrastructure"))[0][1]
-    dirs = [d for d in dirs if d[0] != "_"]
-    if config["infrastructure"]["provider"] in dirs:
-        config["module"]["provider"] = importlib.import_module(
-            "infrastructure.%s.%s" % ((config["infrastructure"]["provider"],) * 2)
-        )
+    # Check if infrastructure provider exists
+    module = load_plugin("infrastructure", config["infrastructure"]["provider"])
+    if module is not None:
+        config["module"]["provider"] = module
     else:
         parser.error(
             "ERROR: Given provider %s does not have an implementation",
@@ -51,31 +75,23 @@ def dynamic_import(parser, config):
         )
 
     if not config["infrastructure"]["infra_only"]:
-        # Check if resource manager directory exists
+        # Check if resource manager exists
         # Not all RM have modules (e.g., mist, none)
-        dirs = list(os.walk("./resource_manager"))[0][1]
-        dirs = [d for d in dirs if d[0] != "_"]
-        if config["benchmark"]["resource_manager"] in dirs:
-            config["module"]["resource_manager"] = importlib.import_module(
-                "resource_manager.%s.%s" % ((config["benchmark"]["resource_manager"],) * 2)
-            )
+        module = load_plugin("resource_manager", config["benchmark"]["resource_manager"])
+        if module is not None:
+            config["module"]["resource_manager"] = module
         elif config["benchmark"]["resource_manager"] == "mist":
             # Mist provider uses KubeEdge
             # TODO: Make a separate Mist provider
             #       Mist already has its own Ansible file, should be easy
-            config["module"]["resource_manager"] = importlib.import_module(
-                "resource_manager.%s.%s" % (("kubeedge",) * 2)
-            )
+            config["module"]["resource_manager"] = load_plugin("resource_manager", "kubeedge")
 
         # Now for execution model
         if "execution_model" in config:
-            # Check if resource manager directory exists
-            dirs = list(os.walk("./execution_model"))[0][1]
-            dirs = [d for d in dirs if d[0] != "_"]
-            if config["execution_model"]["model"] in dirs:
-                config["module"]["execution_model"] = importlib.import_module(
-                    "execution_model.%s.%s" % ((config["execution_model"]["model"],) * 2)
-                )
+            # Check if execution model exists
+            module = load_plugin("execution_model", config["execution_model"]["model"])
+            if module is not None:
+                config["module"]["execution_model"] = module
             else:
                 parser.error(
                     "ERROR: Given execution model %s does not have an implementation",
@@ -84,13 +100,10 @@ def dynamic_import(parser, config):
 
         # Now for applications
         if not config["benchmark"]["resource_manager_only"]:
-            # Check if infrastructure provider directory exists
-            dirs = list(os.walk("./application"))[0][1]
-            dirs = [d for d in dirs if d[0] != "_"]
-            if config["benchmark"]["application"] in dirs:
-                config["module"]["application"] = importlib.import_module(
-                    "application.%s.%s" % ((config["benchmark"]["application"],) * 2)
-                )
+            # Check if application exists
+            module = load_plugin("application", config["benchmark"]["application"])
+            if module is not None:
+                config["module"]["application"] = module
             else:
                 parser.error(
                     "ERROR: Application %s does not exist",
@@ -243,8 +256,7 @@ def parse_infrastructure(parser, input_config, config):
     config[sec] = {}
 
     # Get a list of all providers
-    providers = list(os.walk("./infrastructure"))[0][1]
-    providers = [d for d in providers if d[0] != "_"]
+    providers = PLUGINS["infrastructure"]
 
     settings = [
         # Option | Type | Condition | Mandatory | Default
@@ -330,6 +342,8 @@ def parse_infrastructure(parser, input_config, config):
         ["edge_write_speed", int, lambda x: x >= 0, False, 0],
         ["endpoint_write_speed", int, lambda x: x >= 0, False, 0],
         ["cpu_pin", bool, lambda x: x in [True, False], False, False],
+        ["energy_isolation", bool, lambda x: x in [True, False], False, False],
+        ["numa_policy", str, lambda x: x in ["compact", "spread", "isolate"], False, "compact"],
         ["external_physical_machines", list, lambda x: True, False, []],
         ["netperf", bool, lambda x: x in [True, False], False, False],
         ["base_path", str, os.path.expanduser, False, os.getenv("HOME")],
@@ -353,6 +367,12 @@ def parse_infrastructure(parser, input_config, config):
     if config[sec]["middleIP"] == config[sec]["middleIP_base"]:
         parser.error("Config: middleIP == middleIP_base")
 
+    if config[sec]["energy_isolation"] and not config[sec]["cpu_pin"]:
+        parser.error("Config: energy_isolation requires cpu_pin")
+
+    if config[sec]["numa_policy"] != "compact" and not config[sec]["cpu_pin"]:
+        parser.error("Config: numa_policy %s requires cpu_pin" % (config[sec]["numa_policy"]))
+
 
 def parse_infrastructure_network(parser, input_config, config):
     """Parse config file, section infrastructure, network part
@@ -425,16 +445,14 @@ def parse_benchmark(parser, input_config, config):
 
     # Get a list of all resource managers
     # TODO: Make mist a provider - and scrap none
-    rms = list(os.walk("./resource_manager"))[0][1]
-    rms = [d for d in rms if d[0] != "_"]
+    rms = list(PLUGINS["resource_manager"])
     rms.append("mist")
     rms.append("none")
     if "endpoint" in rms:
         rms.remove("endpoint")
 
     # Get a list of all apps
-    apps = list(os.walk("./application"))[0][1]
-    apps = [d for d in apps if d[0] != "_"]
+    apps = PLUGINS["application"]
 
     settings = [
         # Option | Type | Condition | Mandatory | Default
@@ -495,8 +513,7 @@ def parse_execution_model(parser, input_config, config):
         return
 
     # Get a list of all execution models
-    models = list(os.walk("./execution_model"))[0][1]
-    models = [d for d in models if d[0] != "_"]
+    models = PLUGINS["execution_model"]
 
     config[sec] = {}
     option_check(parser, input_config, config, sec, "model", str, lambda x: x in models, True, None)
@@ -0,0 +1,98 @@
+"""\
+Write CSV samples to compressed, time-chunked files with an index
+Samples are appended to current.csv until the timestamp crosses a chunk boundary (every
+CHUNK_INTERVAL seconds in wall-clock time). The chunk is then compressed to <first>.csv.gz,
+named after the timestamp of its first row, and a line with the file name, first and last
+timestamp (in ns) and number of rows is appended to index.csv. Every chunk starts with the CSV
+header, so chunks can be read on their own.
+
+The host only fetches the chunks whose time range overlaps with the benchmark, plus current.csv,
+see get_resource_output() in resource_manager/kubernetes/kubernetes.py.
+
+This file is copied next to the resource usage scripts on the VMs, so it only depends on the
+standard library.
+"""
+
+import gzip
+import logging
+import os
+import shutil
+
+# Seconds of samples per chunk
+CHUNK_INTERVAL = 60
+
+CURRENT = "current.csv"
+INDEX = "index.csv"
+
+
+class ChunkWriter:
+    """Append CSV lines to the current chunk, and compress and index chunks once they're full"""
+
+    def __init__(self, directory, columns):
+        """Initialize the object, and remove chunks of earlier runs
+
+        Args:
+            directory (str): Directory to write the chunks and index to
+            columns (list(str)): CSV header, the first column is the timestamp in ns
+        """
+        self.directory = directory
+        self.header = ",".join(columns) + "\n"
+
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+
+        os.makedirs(directory)
+        with open(os.path.join(directory, INDEX), "w", encoding="utf-8") as f:
+            f.write("file,first,last,rows\n")
+
+        self.file = None
+        self.chunk = None
+        self.first = 0
+        self.last = 0
+        self.rows = 0
+
+    def write(self, timestamp, line):
+        """Append a line to the current chunk, and flush it
+
+        Args:
+            timestamp (int): Timestamp of the line in ns
+            line (str): CSV line without newline
+        """
+        chunk = timestamp // (CHUNK_INTERVAL * 10**9)
+        if self.file is not None and chunk != self.chunk:
+            self.close_chunk()
+
+        if self.file is None:
+            # pylint: disable-next=consider-using-with
+            self.file = open(os.path.join(self.directory, CURRENT), "w", encoding="utf-8")
+            self.file.write(self.header)
+            self.chunk = chunk
+            self.first = timestamp
+            self.rows = 0
+
+        self.file.write(line + "\n")
+        self.file.flush()
+        self.last = timestamp
+        self.rows += 1
+
+    def close_chunk(self):
+        """Compress the current chunk and add it to the index.
+        The compressed file is complete before it's indexed, and only then is current.csv
+        removed, so readers always find every row in an indexed chunk or in current.csv.
+        """
+        self.file.close()
+        self.file = None
+
+        name = "%i.csv.gz" % (self.first)
+        current = os.path.join(self.directory, CURRENT)
+        path = os.path.join(self.directory, name)
+        with open(current, "rb") as src, gzip.open(path + ".part", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+        os.replace(path + ".part", path)
+
+        with open(os.path.join(self.directory, INDEX), "a", encoding="utf-8") as f:
+            f.write("%s,%i,%i,%i\n" % (name, self.first, self.last, self.rows))
+
+        os.remove(current)
+        logging.debug("Wrote chunk %s with %i rows", name, self.rows)
@@ -0,0 +1,130 @@
+"""\
+Call a sampling function at a fixed rate without drift
+Ticks are scheduled on absolute deadlines on the monotonic clock, start + n * interval, so the
+time spent sampling never shifts later ticks. The first deadline is aligned to a multiple of the
+interval in wall-clock time, so samplers on different machines with synchronized clocks sample
+at the same instants and their timelines line up.
+
+If a sample overruns one or more whole intervals, those ticks are skipped and counted as missed,
+instead of being caught up in a burst. Jitter is the delay between a deadline and the moment the
+sample actually started.
+
+This file is copied next to the resource usage scripts on the VMs, and is also used by the
+energy collector on the host, so it only depends on the standard library.
+"""
+
+import logging
+import math
+import time
+
+
+class Sampler:
+    """Run a sampling function every interval, and keep track of missed ticks and jitter"""
+
+    def __init__(self, interval, report_interval=None):
+        """Initialize the object
+
+        Args:
+            interval (float): Seconds between ticks
+            report_interval (float, optional): Log the statistics every this many seconds.
+                Defaults to None (never).
+        """
+        self.interval = interval
+        self.report_every = None
+        if report_interval is not None:
+            self.report_every = max(int(report_interval / interval), 1)
+
+        self.ticks = 0
+        self.missed = 0
+
+        # Running mean and variance of the jitter (Welford), in seconds
+        self.jitter_mean = 0.0
+        self.jitter_m2 = 0.0
+        self.jitter_max = 0.0
+
+    def first_deadline(self):
+        """Get the first deadline: the first multiple of the interval in wall-clock time that is
+        at least one interval away, so the first sample covers a full interval
+
+        Returns:
+            float: Deadline on the monotonic clock
+        """
+        now = time.time()
+        wait = math.ceil(now / self.interval + 1) * self.interval - now
+        return time.monotonic() + wait
+
+    def record(self, jitter):
+        """Add the jitter of a tick to the statistics
+
+        Args:
+            jitter (float): Seconds between the deadline and the start of the sample
+        """
+        self.ticks += 1
+        delta = jitter - self.jitter_mean
+        self.jitter_mean += delta / self.ticks
+        self.jitter_m2 += delta * (jitter - self.jitter_mean)
+        self.jitter_max = max(self.jitter_max, jitter)
+
+    def stats(self):
+        """Get the statistics of all ticks so far
+
+        Returns:
+            dict: Number of ticks and missed ticks, and the mean, standard deviation
+                and max jitter in seconds
+        """
+        stdev = 0.0
+        if self.ticks > 1:
+            stdev = math.sqrt(self.jitter_m2 / (self.ticks - 1))
+
+        return {
+            "ticks": self.ticks,
+            "missed": self.missed,
+            "jitter_mean": self.jitter_mean,
+            "jitter_stdev": stdev,
+            "jitter_max": self.jitter_max,
+        }
+
+    def report(self):
+        """Log the statistics of all ticks so far"""
+        stats = self.stats()
+        logging.info(
+            "Ticks: %i, missed: %i, jitter mean: %.3f ms, stdev: %.3f ms, max: %.3f ms",
+            stats["ticks"],
+            stats["missed"],
+            stats["jitter_mean"] * 1000.0,
+            stats["jitter_stdev"] * 1000.0,
+            stats["jitter_max"] * 1000.0,
+        )
+
+    def run(self, sample, stop=None):
+        """Call the sampling function on every tick until it returns False, or until stopped
+
+        Args:
+            sample (function): Function without arguments, called on every tick
+            stop (threading.Event, optional): Stop sampling once set. Defaults to None.
+        """
+        deadline = self.first_deadline()
+        while True:
+            wait = deadline - time.monotonic()
+            if stop is not None:
+                if stop.wait(max(wait, 0)):
+                    return
+            elif wait > 0:
+                time.sleep(wait)
+
+            self.record(time.monotonic() - deadline)
+            if sample() is False:
+                return
+
+            if self.report_every is not None and self.ticks % self.report_every == 0:
+                self.report()
+
+            # Skip ticks that are late by a whole interval or more, others run right away
+            deadline += self.interval
+            skipped = math.floor((time.monotonic() - deadline) / self.interval)
+            if skipped > 0:
+                self.missed += skipped
+                deadline += skipped * self.interval
+                logging.debug(
+                    "Can't keep up with interval %f: skipped %i tick(s)", self.interval, skipped
+                )
@@ -3,18 +3,35 @@ Setup Kubernetes on cloud
 This resource manager doesn't have any/many help functions, see the /kubernetes folder instead
 """
 
+import heapq
 import logging
 import os
 import json
+import sys
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import Dict, List
-
-import requests
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List
 
 from infrastructure import ansible
 from resource_manager.kubernetes import kubernetes
 
+if TYPE_CHECKING:
+    import numpy as np
+
+# Port of the jaeger query API on the worker nodes
+JAEGER_PORT = "16686"
+
+# Max traces per request, and seconds of traces per request (windows are split if they hit it)
+TRACE_LIMIT = 1000
+TRACE_WINDOW = 60
+
+# Seconds of traces to get before the start and after the end of the benchmark, for clock skew
+TRACE_MARGIN = 5
+
+# Max number of concurrent requests to the jaeger servers
+TRACE_PARALLEL = 8
+
 
 def add_options(_config):
     """Add config options for a particular module
@@ -229,104 +246,199 @@ def get_deployment_duration(config, machines):
         return -1
 
 
-def _gather_kata_traces(ip: str, port: str = "16686") -> List[List[Dict]]:
-    """(internal) curl request to jaeger server on `ip` to
-    get the traces produced by the kata runtime.
+def _stream_traces(chunks: Iterable[str]) -> Iterator[Dict]:
+    """(internal) Parse the traces of a Jaeger API response one at a time, while it's being
+    received, so the full response is never held in memory.
+    Response format: {"data": [trace, trace, ...], "total": ..., ...}
 
     Args:
-        ip (str): Jaeger endpoint ip
-        port (str, optional): Jaeger endpoint port. Defaults to "16686".
+        chunks (Iterable[str]): Decoded chunks of the response body
 
-    Returns:
-        List[List[Dict]]: a sorted list of traces for each kata deployment on `ip`.
+    Yields:
+        Dict: Trace, with its spans in "spans"
     """
-    jaeger_api_url = f"http://{ip}:{port}/api/traces?service=kata&operation=rootSpan&limit=10000"
-    response = requests.get(jaeger_api_url, timeout=600)
-    response_data = response.json()
+    decoder = json.JSONDecoder()
+    buf = ""
+    in_data = False
+    for chunk in chunks:
+        buf += chunk
+        pos = 0
 
-    traces = response_data["data"]
+        if not in_data:
+            start = buf.find('"data"')
+            if start == -1:
+                continue
 
-    # Sort each trace's spans based on starTime and sort traces based on startTime
-    traces = sorted(
-        [sorted(trace["spans"], key=lambda x: x["startTime"]) for trace in traces],
-        key=lambda x: x[0]["startTime"],
-    )
+            # The data list starts after the colon, it's null without traces
+            start = buf.find(":", start) + 1
+            while start < len(buf) and buf[start].isspace():
+                start += 1
+
+            if start >= len(buf):
+                continue
+            if buf[start] != "[":
+                return
+
+            in_data = True
+            pos = start + 1
+
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+                pos += 1
 
-    print(f"gather_kata_traces({ip}, {port}) -> got {len(traces)} traces")
-    return traces
+            if pos < len(buf) and buf[pos] == "]":
+                return
 
+            try:
+                trace, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Trace is incomplete, wait for the next chunk
+                break
 
-def get_kata_period_timestamps(traces: List[List[Dict]]) -> List[List[int]]:
-    """TODO
+            yield trace
 
-    T0 -> T1 : create kata runtime
-    T1 -> T2 : create VM
-    T2 -> T3 : connect to VM
-    T3 -> T4 : create container and launch
+        buf = buf[pos:]
+
+
+def get_kata_period_timestamps(trace: Dict) -> List[int]:
+    """Get the timestamps of the kata deployment phases from a trace, in one pass over its spans.
+    Spans are ordered on start time (ties in the order Jaeger returns them):
+
+    T0 -> T1 : create kata runtime (T0 is the start of the first span)
+    T1 -> T2 : create VM (first StartVM span after the first span)
+    T2 -> T3 : connect to VM (the connect span, after StartVM)
+    T3 -> T4 : create container and launch (end of the second ttrpc.StartContainer span
+               after connect)
 
     Args:
-        traces (List[List[Dict]]): _description_
+        trace (Dict): Trace of a single kata deployment
 
     Returns:
-        List[List[int]]: _description_
+        List[int]: T0 - T4 in microseconds
     """
+    # Order key, start and end time of the first span, and of spans per operation
+    first = None
+    spans: Dict[str, List] = {"StartVM": [], "connect": [], "ttrpc.StartContainer": []}
+    for i, span in enumerate(trace["spans"]):
+        key = (span["startTime"], i)
+        if first is None or key < first[0]:
+            first = (key, span["startTime"])
+
+        if span["operationName"] in spans:
+            spans[span["operationName"]].append((key, span["startTime"] + span["duration"]))
+
+    if len(spans["StartVM"]) != 2 or len(spans["connect"]) != 1 or first is None:
+        logging.error(
+            "Kata trace %s has %i StartVM and %i connect spans, expected 2 and 1",
+            trace["traceID"],
+            len(spans["StartVM"]),
+            len(spans["connect"]),
+        )
+        sys.exit()
 
-    timestamps: List[List[int]] = []
-
-    for trace in traces:
-        ts: List[int] = []
-        skip_first = True
-        for span in trace:
-            assert len([span for span in trace if span["operationName"] == "StartVM"]) == 2
-            assert len([span for span in trace if span["operationName"] == "connect"]) == 1
-            # T0
-            if len(ts) == 0:
-                ts.append(span["startTime"])
-            # T1, T2
-            elif len(ts) == 1 and span["operationName"] == "StartVM":
-                ts.append(span["startTime"])  # T1
-                ts.append(span["startTime"] + span["duration"])  # T2
-            # T3
-            elif len(ts) == 3 and span["operationName"] == "connect":
-                ts.append(span["startTime"] + span["duration"])  # T3
-            # T4
-            elif len(ts) == 4 and span["operationName"] == "ttrpc.StartContainer":
-                if skip_first is False:
-                    ts.append(span["startTime"] + span["duration"])  # T4
-                    break
-
-                skip_first = False
-
-        assert len(ts) == 5
-        timestamps.append(ts)
-
-    return timestamps
+    start_vm = min(span for span in spans["StartVM"] if span[0] != first[0])
+    connect = spans["connect"][0]
+    start_container = heapq.nsmallest(
+        2, (span for span in spans["ttrpc.StartContainer"] if span[0] > connect[0])
+    )
 
+    if connect[0] < start_vm[0] or len(start_container) < 2:
+        logging.error("Kata trace %s misses deployment phases", trace["traceID"])
+        sys.exit()
+
+    return [first[1], start_vm[0][0], start_vm[1], connect[1], start_container[1][1]]
 
-# Kata entry point.
-def get_kata_timestamps(config, _worker_output) -> List[List[int]]:
-    """_summary_
+
+def _gather_kata_traces(ip: str, start: int, end: int, port: str = JAEGER_PORT) -> Dict[str, List]:
+    """(internal) Request the traces produced by the kata runtime in a time window from the
+    jaeger server on `ip`, and get the timestamps of their deployment phases while streaming.
 
     Args:
-        config (_type_): _description_
-        _worker_output (_type_): _description_
+        ip (str): Jaeger endpoint ip
+        start (int): Start of the window in microseconds
+        end (int): End of the window in microseconds
+        port (str, optional): Jaeger endpoint port. Defaults to JAEGER_PORT.
 
     Returns:
-        List[List[int]]: _description_
+        Dict[str, List]: T0 - T4 per trace id, see get_kata_period_timestamps()
     """
-    logging.info(
-        "----------------------------------------------------------------------------------------"
-    )
-    logging.info("get_kata_timestamps")
-    logging.info(
-        "----------------------------------------------------------------------------------------"
-    )
+    # Only needed when gathering traces, don't slow down startup
+    import requests  # pylint: disable=import-outside-toplevel
+
+    params = {
+        "service": "kata",
+        "operation": "rootSpan",
+        "start": start,
+        "end": end,
+        "limit": TRACE_LIMIT,
+    }
+    with requests.get(
+        f"http://{ip}:{port}/api/traces", params=params, stream=True, timeout=600
+    ) as response:
+        response.raise_for_status()
+        response.encoding = "utf-8"
+
+        chunks = response.iter_content(chunk_size=2**16, decode_unicode=True)
+        return {
+            trace["traceID"]: get_kata_period_timestamps(trace)
+            for trace in _stream_traces(chunks)
+        }
 
-    _nodes_names, nodes_ips = map(list, zip(*[str.split(x, "@") for x in config["cloud_ssh"][1:]]))
 
-    traces = [_gather_kata_traces(ip)[1:] for ip in nodes_ips]
-    # Flatten list of lists
-    traces = [a for b in traces for a in b]
+# Kata entry point.
+def get_kata_timestamps(config, starttime: float, endtime: float) -> "np.ndarray":
+    """Get the timestamps of the kata deployment phases of all pods deployed by the benchmark.
+    The jaeger servers of all worker nodes are queried concurrently, per time window of
+    TRACE_WINDOW seconds. Windows that hit TRACE_LIMIT are split in two and queried again.
 
-    kata_ts = get_kata_period_timestamps(traces)
-    return kata_ts
+    Args:
+        config (dict): Parsed configuration
+        starttime (float): Invocation time of kubectl apply command that launches the benchmark
+        endtime (float): Time at which the final application is deployed
+
+    Returns:
+        np.ndarray: T0 - T4 in microseconds per pod (one row per pod), ordered on T0
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+    import requests  # pylint: disable=import-outside-toplevel
+
+    logging.info("Gather kata traces from the jaeger servers of all worker nodes")
+
+    nodes_ips = [ssh.split("@")[1] for ssh in config["cloud_ssh"][1:]]
+
+    start = int((starttime - TRACE_MARGIN) * 10**6)
+    end = int((endtime + TRACE_MARGIN) * 10**6)
+    window = TRACE_WINDOW * 10**6
+
+    timestamps: Dict[str, List] = {}
+    with ThreadPoolExecutor(max_workers=TRACE_PARALLEL) as pool:
+        pending = {}
+        for ip in nodes_ips:
+            for window_start in range(start, end, window):
+                window_end = min(window_start + window, end)
+                future = pool.submit(_gather_kata_traces, ip, window_start, window_end)
+                pending[future] = (ip, window_start, window_end)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ip, window_start, window_end = pending.pop(future)
+                try:
+                    traces = future.result()
+                except requests.RequestException as e:
+                    logging.error("Could not get kata traces from %s: %s", ip, e)
+                    sys.exit()
+
+                # The window may hold more traces than returned, split it
+                if len(traces) >= TRACE_LIMIT and window_end - window_start > 1:
+                    middle = (window_start + window_end) // 2
+                    for bounds in [(window_start, middle), (middle, window_end)]:
+                        future = pool.submit(_gather_kata_traces, ip, *bounds)
+                        pending[future] = (ip, *bounds)
+                    continue
+
+                logging.debug("Got %i kata traces from %s", len(traces), ip)
+                timestamps.update(traces)
+
+    kata_ts = np.array(list(timestamps.values()), dtype=np.int64).reshape(-1, 5)
+    return kata_ts[np.argsort(kata_ts[:, 0], kind="stable")]
@@ -1,11 +1,30 @@
-"""Measure resource usage in a Kubernetes cluster"""
+"""\
+Measure resource usage in a Kubernetes cluster
+Control plane components are read from their pod cgroups on this node, falling back to the
+metrics-server. Node usage is not measured here: the metrics-server only refreshes it every 15
+seconds. Instead, resource_usage_os.py measures it on every node from /proc, and the host adds
+those columns, see filter_metrics_kube() in resource_manager/kubernetes/kubernetes.py.
+"""
 
 import argparse
+import http.client
+import json
 import logging
+import math
+import os
 import sys
 import subprocess
 import time
 
+import chunks
+import sampling
+
+CGROUP = "/sys/fs/cgroup"
+POD_LOGS = "/var/log/pods"
+
+# Seconds between logging the missed ticks and jitter of the sampling loop
+REPORT_INTERVAL = 60
+
 
 def enable_logging(verbose):
     """Enable logging -> only used for debugging this script"""
@@ -19,182 +38,303 @@ def enable_logging(verbose):
     logging.debug("Logging has been enabled")
 
 
-def execute(command, shell=False):
-    """Execute a process using the subprocess library
+# Control plane components to measure, assume that only 1 copy of each is running
+COMPONENTS = ["etcd", "apiserver", "controller-manager", "scheduler"]
+
+# Kubernetes quantity suffixes, see k8s.io/apimachinery/pkg/api/resource
+SUFFIXES = {
+    "n": 10**-9,
+    "u": 10**-6,
+    "m": 10**-3,
+    "k": 10**3,
+    "M": 10**6,
+    "G": 10**9,
+    "T": 10**12,
+    "Ki": 2**10,
+    "Mi": 2**20,
+    "Gi": 2**30,
+    "Ti": 2**40,
+}
+
+
+def parse_quantity(quantity):
+    """Convert a Kubernetes resource quantity to a number
+
+    Example: 54123456n -> 0.054123456, 588Mi -> 616562688
+
+    Args:
+        quantity (str): Quantity as returned by the metrics API
+
+    Returns:
+        (float): Value in cores or bytes
+    """
+    for length in [2, 1]:
+        if quantity[-length:] in SUFFIXES:
+            return float(quantity[:-length]) * SUFFIXES[quantity[-length:]]
+
+    return float(quantity)
+
+
+def to_columns(cpu, memory):
+    """Format usage like kubectl top does: CPU in millicores (rounded up), memory in Mi
 
     Args:
-        command (list(str) or str): Command to be executed.
-        shell (bool). Optional. Execute subprocess via shell. Defaults to False.
-        crash (bool). Optional. Crash on error. Defaults to True
+        cpu (float): CPU usage in cores
+        memory (float): Memory usage in bytes
 
     Returns:
-        (Popen): Subprocess Popen object of running process
+        (list(str)): CPU and memory column
+    """
+    return [str(math.ceil(cpu * 1000)), str(int(memory) // 2**20)]
+
+
+class MetricsServer:
+    """Query the metrics-server API, which kubectl top uses, over one keep-alive connection.
+    A single kubectl proxy takes care of authentication, so no process is started per sample.
     """
-    if isinstance(command, str):
-        logging.debug(command)
-    else:
-        logging.debug(" ".join(command))
 
-    try:
+    def __init__(self):
+        """Start kubectl proxy on a free port and connect to it"""
+        logging.debug("kubectl proxy --port=0")
+
         # pylint: disable-next=consider-using-with
-        process = subprocess.Popen(
-            command, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        self.proxy = subprocess.Popen(
+            ["kubectl", "proxy", "--port=0"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
         )
-    except Exception as _:
-        sys.exit()
 
-    return process
+        # Example: Starting to serve on 127.0.0.1:37957
+        line = self.proxy.stdout.readline().decode("utf-8")
+        if "Starting to serve on" not in line:
+            logging.error("Could not start kubectl proxy: %s", line)
+            sys.exit()
+
+        host, port = line.split()[-1].rsplit(":", 1)
+        self.connection = http.client.HTTPConnection(host, int(port), timeout=10)
+
+    def get(self, path):
+        """Get a resource from the API, reconnect once if the connection was closed
+
+        Args:
+            path (str): API path
+
+        Returns:
+            (dict): Parsed JSON response
+        """
+        for attempt in range(2):
+            try:
+                self.connection.request("GET", path)
+                response = self.connection.getresponse()
+                body = response.read()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                # The next request opens a new connection
+                self.connection.close()
+                if attempt == 1:
+                    logging.error("Could not get %s: %s", path, str(e))
+                    sys.exit()
+
+        if response.status != 200:
+            logging.error("Could not get %s: %s", path, body.decode("utf-8"))
+            sys.exit()
 
+        return json.loads(body)
 
-def get_output(process):
-    """Wait for a process to complete and return its stdout and stderr
+    def pods(self, namespace):
+        """Get the resource usage per pod, summed over its containers, like kubectl top pods
+
+        Args:
+            namespace (str): Namespace of the pods
+
+        Returns:
+            (dict(str, list(str))): CPU and memory column per pod name
+        """
+        items = self.get("/apis/metrics.k8s.io/v1beta1/namespaces/%s/pods" % (namespace))["items"]
+
+        usage = {}
+        for item in items:
+            cpu = sum(parse_quantity(c["usage"]["cpu"]) for c in item["containers"])
+            memory = sum(parse_quantity(c["usage"]["memory"]) for c in item["containers"])
+            usage[item["metadata"]["name"]] = to_columns(cpu, memory)
+
+        return usage
+
+
+def find_cgroup(uid):
+    """Find the cgroup v2 directory of a pod, for both the systemd and cgroupfs cgroup driver
 
     Args:
-        process (Popen): Subprocess Popen object of running process
+        uid (str): UID of the pod
 
     Returns:
-        (list(str)): Return stdout of this process without custom [CONTINUUM] prints
+        (str): Path to the cgroup directory, or None if not found
+    """
+    names = ["pod" + uid.replace("-", "_"), "pod" + uid]
+    for root in ["kubepods.slice", "kubepods"]:
+        for path, dirs, _ in os.walk(os.path.join(CGROUP, root)):
+            for d in dirs:
+                if any(name in d for name in names):
+                    return os.path.join(path, d)
+
+            # Don't descend into the cgroups of other pods
+            dirs[:] = [d for d in dirs if not d.startswith("pod") and "-pod" not in d]
+
+    return None
+
+
+class ComponentCgroups:
+    """Read the resource usage of control plane components from their pod cgroups on this node.
+    CPU usage is measured over the time between two samples, and memory usage is the working
+    set (memory.current minus inactive file pages), like the metrics-server reports.
     """
-    output = [line.decode("utf-8") for line in process.stdout.readlines()]
-    error = [line.decode("utf-8") for line in process.stderr.readlines()]
 
-    if not output:
-        logging.error("stdout is empty, stderr: %s", " ".join(error))
-        sys.exit()
-    elif error and not all("[CONTINUUM]" in l for l in error):
-        logging.error("stderr is not empty: %s", " ".join(error))
-        sys.exit()
+    def __init__(self):
+        """Find the cgroup of every control plane component, via the pod UIDs in the log dirs"""
+        self.paths = {}
+        self.prev = {}
+
+        # Example: /var/log/pods/kube-system_etcd-cloudcontrollermatthijs_<uid>
+        pods = os.listdir(POD_LOGS) if os.path.isdir(POD_LOGS) else []
+        for component in COMPONENTS:
+            self.paths[component] = None
+            for pod in pods:
+                namespace, name, uid = pod.split("_", 2)
+                if namespace == "kube-system" and component in name:
+                    self.paths[component] = find_cgroup(uid)
+                    break
+
+            if self.paths[component] is None:
+                logging.debug("No cgroup for %s, use the metrics-server instead", component)
+            else:
+                logging.debug("Cgroup for %s: %s", component, self.paths[component])
+                self.prev[component] = (self.cpu_usec(component), time.monotonic_ns())
 
-    # Filter custom prints out of stdout
-    # And remove empty spaces
-    out = []
-    for line in output:
-        if "[CONTINUUM]" not in line:
-            l = line.split(" ")
-            l = [word for word in l if word != ""]
-            out.append(l)
+    def found(self, component):
+        """Check if the cgroup of a component was found
 
-    return out
+        Args:
+            component (str): Control plane component
 
+        Returns:
+            (bool): Cgroup was found
+        """
+        return self.paths[component] is not None
 
-def main(args):
-    """Main function
+    def read(self, component, file):
+        """Read the key-value pairs in a cgroup file, like cpu.stat
 
-    Args:
-        args (Namespace): Argparse object
-    """
-    # Measure total resource usage
-    command_nodes = ["kubectl", "top", "nodes", "--no-headers=True"]
-
-    # Measure resource usage per pod
-    command_pods = ["kubectl", "top", "pods", "--no-headers=True", "-n", "kube-system"]
-
-    # Execute the commands every interval and write to file
-    with open("resource_usage.csv", "w", encoding="utf-8") as f:
-        # Execute top nodes first to discover how many nodes there are
-        # And add a CPU and memory column for each node
-        process = execute(command_nodes)
-        output = get_output(process)
-
-        columns = ["timestamp"]
-        for line in output:
-            nodename = line[0]
-            columns.append(nodename + "_cpu")
-            columns.append(nodename + "_memory")
-
-        # Now add entries for control plane components
-        # Assume that only 1 copy of each control plane component is running
-        components = ["etcd", "apiserver", "controller-manager", "scheduler"]
-        for component in components:
-            columns.append(component + "_cpu")
-            columns.append(component + "_memory")
-
-        # Write header to file
-        logging.debug("Columns: %s", ", ".join(columns))
-        f.write(",".join(columns) + "\n")
-        f.flush()
-
-        # Now start the main loop and gather the data every args.interval seconds
-        while True:
-            logging.debug("-------------------------")
-            logging.debug("Start iteration")
-            start_time = time.time_ns()
-
-            # ALways write a timestamp first
-            to_write = [str(start_time)]
-
-            # Get info on nodes
-            # Get the cpu usage (line[1]) and memory usage (line[3]) per node
-            process1 = execute(command_nodes)
-            process2 = execute(command_pods)
-            output = get_output(process1)
-
-            for line in output:
-                # Example header and line (header is not printed in our command)
-                # NAME                      CPU(cores)   CPU%   MEMORY(bytes)   MEMORY%
-                # cloud0matthijs            54m          0%     588Mi           1%
-                if line[1][-1] != "m":
-                    logging.error("Expected CPU to be measured in m, was: %s", line[1])
-                    sys.exit()
+        Args:
+            component (str): Control plane component
+            file (str): Name of the file
 
-                to_write.append(line[1][:-1])
+        Returns:
+            (dict(str, int)): Values per key
+        """
+        values = {}
+        with open(os.path.join(self.paths[component], file), encoding="utf-8") as f:
+            for line in f:
+                key, value = line.split()
+                values[key] = int(value)
 
-                if "Mi" in line[3]:
-                    to_write.append(line[3][:-2])
-                elif "Gi" in line[3]:
-                    to_write.append(str(float(line[3][:-2]) * 1000))
-                else:
-                    logging.error("Expected Mi or Gi as unit for memory, was: %s", line[3])
-                    sys.exit()
+        return values
 
-            # Now get info on pods
-            output = get_output(process2)
+    def cpu_usec(self, component):
+        """Get the CPU time used by a component
 
-            for line in output:
-                # We don't want info on all components, just on a few
-                if not any(c in line[0] for c in components):
-                    continue
+        Args:
+            component (str): Control plane component
 
-                # Example header and line (header is not printed in our command)
-                # NAME                                              CPU(cores)   MEMORY(bytes)
-                # etcd-cloudcontrollermatthijs                      33m          38Mi
-                if line[1][-1] != "m":
-                    logging.error("Expected CPU to be measured in m, was: %s", line[1])
-                    sys.exit()
+        Returns:
+            (int): CPU time in microseconds
+        """
+        return self.read(component, "cpu.stat")["usage_usec"]
 
-                to_write.append(line[1][:-1])
+    def sample(self, component):
+        """Get the resource usage of a component since the previous sample
 
-                if "Mi" in line[2]:
-                    to_write.append(line[2][:-2])
-                elif "Gi" in line[3]:
-                    to_write.append(str(float(line[2][:-2]) * 1000))
-                else:
-                    logging.error("Expected Mi or Gi as unit for memory, was: %s", line[3])
-                    sys.exit()
+        Args:
+            component (str): Control plane component
 
-            # Write all data from this iteration to file at once
-            line = ",".join(to_write)
-            logging.debug("Write line: %s", line)
-            if len(columns) != len(to_write):
-                logging.error(
-                    "This line does not contain the expected %i columns: %s", len(columns), line
-                )
+        Returns:
+            (list(str)): CPU and memory column
+        """
+        usec = self.cpu_usec(component)
+        now = time.monotonic_ns()
+        prev_usec, prev_now = self.prev[component]
+        self.prev[component] = (usec, now)
+
+        cpu = 0.0
+        if now > prev_now:
+            cpu = (usec - prev_usec) * 1000 / (now - prev_now)
+
+        with open(os.path.join(self.paths[component], "memory.current"), encoding="utf-8") as f:
+            memory = int(f.readline())
+
+        memory = max(memory - self.read(component, "memory.stat")["inactive_file"], 0)
+        return to_columns(cpu, memory)
+
+
+def main(args):
+    """Main function
+
+    Args:
+        args (Namespace): Argparse object
+    """
+    cgroups = ComponentCgroups()
+
+    # The metrics-server is only needed for components without a cgroup on this node
+    metrics = None
+    if not all(cgroups.found(component) for component in COMPONENTS):
+        metrics = MetricsServer()
+
+    # Add a CPU and memory column for each control plane component
+    columns = ["timestamp"]
+    for component in COMPONENTS:
+        columns.append(component + "_cpu")
+        columns.append(component + "_memory")
+
+    # Write the data in compressed chunks, see chunks.py
+    logging.debug("Columns: %s", ", ".join(columns))
+    writer = chunks.ChunkWriter("resource_usage", columns)
+
+    def sample():
+        """Gather and write the data of one iteration"""
+        logging.debug("-------------------------")
+        logging.debug("Start iteration")
+
+        # ALways write a timestamp first
+        timestamp = time.time_ns()
+        to_write = [str(timestamp)]
+
+        # Get info on control plane components, from the metrics-server if needed
+        pods = {}
+        if metrics is not None:
+            pods = metrics.pods("kube-system")
+
+        for component in COMPONENTS:
+            if cgroups.found(component):
+                to_write += cgroups.sample(component)
+                continue
+
+            pod = [name for name in pods if component in name]
+            if not pod:
+                logging.error("No metrics for control plane component %s", component)
                 sys.exit()
 
-            f.write(line + "\n")
-            f.flush()
+            to_write += pods[pod[0]]
 
-            # Wait until the next iteration
-            interval = float(time.time_ns() - start_time) / 10**9
-            if interval < args.interval:
-                # Wait until next frame should happen
-                time.sleep(interval)
-            else:
-                logging.debug(
-                    "[WARNING] Can't keep up with interval %f: Spent %f seconds instead",
-                    args.interval,
-                    interval,
-                )
+        # Write all data from this iteration to file at once
+        line = ",".join(to_write)
+        logging.debug("Write line: %s", line)
+        if len(columns) != len(to_write):
+            logging.error(
+                "This line does not contain the expected %i columns: %s", len(columns), line
+            )
+            sys.exit()
+
+        writer.write(timestamp, line)
+
+    # Now start the main loop and gather the data every args.interval seconds
+    sampling.Sampler(args.interval, report_interval=REPORT_INTERVAL).run(sample)
 
 
 if __name__ == "__main__":
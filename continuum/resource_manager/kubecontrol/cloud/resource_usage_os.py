@@ -2,10 +2,17 @@
 
 import argparse
 import logging
+import math
+import os
 import sys
-import subprocess
 import time
 
+import chunks
+import sampling
+
+# Seconds between logging the missed ticks and jitter of the sampling loop
+REPORT_INTERVAL = 60
+
 
 def enable_logging(verbose):
     """Enable logging -> only used for debugging this script"""
@@ -19,69 +26,42 @@ def enable_logging(verbose):
     logging.debug("Logging has been enabled")
 
 
-def execute(command):
-    """Execute a process using the subprocess library
-
-    Args:
-        command (list(str) or str): Command to be executed.
-        shell (bool). Optional. Execute subprocess via shell. Defaults to False.
-        crash (bool). Optional. Crash on error. Defaults to True
+def read_cpu():
+    """Read the CPU time spent by all CPUs since boot, like top does
 
     Returns:
-        (Popen): Subprocess Popen object of running process
+        (int, int, int): Total, idle and iowait CPU time in clock ticks
     """
-    if isinstance(command, str):
-        logging.debug(command)
-    else:
-        logging.debug(" ".join(command))
+    with open("/proc/stat", encoding="utf-8") as f:
+        fields = [int(field) for field in f.readline().split()[1:]]
 
-    try:
-        # pylint: disable-next=consider-using-with
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            executable="/bin/bash",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-    except Exception as _:
-        sys.exit()
+    # user nice system idle iowait irq softirq steal (guest time is already part of user)
+    return sum(fields[:8]), fields[3], fields[4]
 
-    return process
 
-
-def get_output(process):
-    """Wait for a process to complete and return its stdout and stderr
-
-    Args:
-        process (Popen): Subprocess Popen object of running process
+def read_memory():
+    """Read the percentage of used memory, like free from procps 3.3 (as on the VMs) does:
+    used = total - free - buffers - cache, where cache includes reclaimable slab memory.
+    Also read the working set, like the kubelet reports for a node: total - free - inactive file
 
     Returns:
-        (list(str)): Return stdout of this process without custom [CONTINUUM] prints
+        (float, int): Used memory in percent, and working set in bytes
     """
-    output = [line.decode("utf-8") for line in process.stdout.readlines()]
-    error = [line.decode("utf-8") for line in process.stderr.readlines()]
-
-    if not output:
-        logging.error("stdout is empty, stderr: %s", " ".join(error))
-        sys.exit()
-    elif error:
-        logging.error("stderr is not empty: %s", " ".join(error))
-        sys.exit()
-
-    # We only expect 1 line of output
-    if len(output) != 1:
-        logging.error("stdout should have contained only 1 line, stdout: %s", " ".join(output))
-        sys.exit()
-
-    # The output should be a float
-    try:
-        percentage = float(output[0].strip())
-    except Exception as _:
-        logging.error("Couldn't convert expected percentage to float: %s", " ".join(output))
-        sys.exit()
-
-    return percentage
+    meminfo = {}
+    with open("/proc/meminfo", encoding="utf-8") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            meminfo[key] = int(value.split()[0])
+
+    used = (
+        meminfo["MemTotal"]
+        - meminfo["MemFree"]
+        - meminfo["Buffers"]
+        - meminfo["Cached"]
+        - meminfo.get("SReclaimable", 0)
+    )
+    working_set = meminfo["MemTotal"] - meminfo["MemFree"] - meminfo["Inactive(file)"]
+    return used / meminfo["MemTotal"] * 100.0, working_set * 1024
 
 
 def main(args):
@@ -90,63 +70,65 @@ def main(args):
     Args:
         args (Namespace): Argparse object
     """
-    command_cpu = (
-        'top -bn1 | grep "Cpu(s)" | sed "s/.*, *\([0-9.]*\)%* id.*/\\1/" | awk \'{print 100 - $1}\''
-    )
-    command_memory = "free | grep Mem | awk '{print $3/$2 * 100.0}'"
-
-    # Execute the commands every interval and write to file
-    with open("resource_usage_os.csv", "w", encoding="utf-8") as f:
-        # Write header to file
-        columns = ["timestamp", "cpu-used (%)", "memory-used (%)"]
-        logging.debug("Columns: %s", ", ".join(columns))
-        f.write(",".join(columns) + "\n")
-        f.flush()
-
-        # Now start the main loop and gather the data every args.interval seconds
-        while True:
-            logging.debug("-------------------------")
-            logging.debug("Start iteration")
-            start_time = time.time_ns()
-
-            # ALways write a timestamp first
-            to_write = [str(start_time)]
-
-            # Execute both commands
-            process1 = execute(command_cpu)
-            process2 = execute(command_memory)
-
-            # Get CPU usage
-            cpu = get_output(process1)
-            to_write.append(str(cpu))
-
-            # Get memory usage
-            memory = get_output(process2)
-            to_write.append(str(memory))
-
-            # Write all data from this iteration to file at once
-            line = ",".join(to_write)
-            logging.debug("Write line: %s", line)
-            if len(columns) != len(to_write):
-                logging.error(
-                    "This line does not contain the expected %i columns: %s", len(columns), line
-                )
-                sys.exit()
-
-            f.write(line + "\n")
-            f.flush()
-
-            # Wait until the next iteration
-            interval = float(time.time_ns() - start_time) / 10**9
-            if interval < args.interval:
-                # Wait until next frame should happen
-                time.sleep(interval)
-            else:
-                logging.debug(
-                    "[WARNING] Can't keep up with interval %f: Spent %f seconds instead",
-                    args.interval,
-                    interval,
-                )
+    # Write the data in compressed chunks, see chunks.py
+    # The last two columns are in the units of kubectl top nodes, which uses these instead of
+    # the metrics-server, see filter_metrics_kube() in resource_manager/kubernetes/kubernetes.py
+    columns = [
+        "timestamp",
+        "cpu-used (%)",
+        "memory-used (%)",
+        "cpu-used (millicpu)",
+        "memory-used (Mi)",
+    ]
+    logging.debug("Columns: %s", ", ".join(columns))
+    writer = chunks.ChunkWriter("resource_usage_os", columns)
+
+    # CPU usage is measured over the time between two samples
+    prev_total, prev_idle, prev_iowait = read_cpu()
+    cpus = os.cpu_count()
+
+    def sample():
+        """Gather and write the data of one iteration"""
+        nonlocal prev_total, prev_idle, prev_iowait
+        logging.debug("-------------------------")
+        logging.debug("Start iteration")
+
+        # ALways write a timestamp first
+        timestamp = time.time_ns()
+        to_write = [str(timestamp)]
+
+        # Get CPU usage, in cores without iowait like the kubelet
+        total, idle, iowait = read_cpu()
+        cpu = 0.0
+        cores = 0.0
+        if total > prev_total:
+            cpu = 100.0 - (idle - prev_idle) / (total - prev_total) * 100.0
+            busy = (total - idle - iowait) - (prev_total - prev_idle - prev_iowait)
+            cores = max(busy, 0) / (total - prev_total) * cpus
+
+        prev_total, prev_idle, prev_iowait = total, idle, iowait
+        to_write.append(str(cpu))
+
+        # Get memory usage
+        memory, working_set = read_memory()
+        to_write.append(str(memory))
+
+        # Same as above, formatted like kubectl top does: millicores (rounded up), memory in Mi
+        to_write += [str(math.ceil(cores * 1000)), str(working_set // 2**20)]
+
+        # Write all data from this iteration to file at once
+        line = ",".join(to_write)
+        logging.debug("Write line: %s", line)
+        if len(columns) != len(to_write):
+            logging.error(
+                "This line does not contain the expected %i columns: %s", len(columns), line
+            )
+            sys.exit()
+
+        writer.write(timestamp, line)
+
+    # Now start the main loop and gather the data every args.interval seconds
+    sampling.Sampler(args.interval, report_interval=REPORT_INTERVAL).run(sample)
 
 
 if __name__ == "__main__":
@@ -4,16 +4,40 @@ Setup Kubernetes on cloud
 
 import logging
 import os
+import re
+import shutil
+import subprocess
 import sys
 import time
 
 # import json
-# from datetime import datetime
-
-import pandas as pd
+from datetime import datetime, timezone
 
 from infrastructure import ansible
 
+# Max number of concurrent SSH connections to fetch pod logs over, below the sshd MaxStartups
+LOG_FETCH_PARALLEL = 10
+
+# Seconds of logs to get before the requested since-time, to allow for clock skew between VMs
+LOG_SINCE_MARGIN = 60
+
+# Seconds between entries of the pod status timeline, see status_timeline()
+STATUS_INTERVAL = 1.0
+
+# Pod statuses in the timeline, besides Arriving
+STATUSES = ["Pending", "ContainerCreating", "Running", "Succeeded"]
+
+# Kubernetes components with custom output, in order of precedence if a line mentions multiple
+COMPONENTS = ["kubelet", "scheduler", "apiserver", "proxy", "controller-manager"]
+
+# Custom output line, e.g. (prefixed by the log file or journal entry of the component):
+# I0824 22:23:21.269974    5026 kubectl.go:32] %!s(int64=1692908601269961032) [CONTINUUM] 0400
+# Groups: one per component (the first present in the line), timestamp in ns, custom output
+CONTROL_LINE = re.compile(
+    r"^(?:%s)?.*?=(\d+)\) \[CONTINUUM\] (.*)$"
+    % ("|".join(r"(?=.*(%s))" % (re.escape(c)) for c in COMPONENTS))
+)
+
 
 def add_options(_config):
     """Add config options for a particular module
@@ -332,7 +356,145 @@ def start_worker(config, machines, app_vars, get_starttime=False):
     return starttime, kubectl_output, status
 
 
-def wait_worker_ready(config, machines, get_starttime):
+def watch_pods(config, worker_apps):
+    """Follow the phase of all pods with a single kubectl watch on the cloud controller,
+    until all worker applications are running or succeeded. Every change is timestamped on
+    the controller as it arrives, so the apiserver is not polled.
+
+    Args:
+        config (dict): Parsed configuration
+        worker_apps (int): Number of pods to wait for
+
+    Returns:
+        (float, list(tuple(float, str, str))): Start time of the watch, and the
+            (time, pod, phase) of every phase change in chronological order
+    """
+    # The first line is the start time, every following line is "time pod phase"
+    command = [
+        "ssh",
+        config["cloud_ssh"][0],
+        "-i",
+        config["ssh_key"],
+        "echo $EPOCHREALTIME; kubectl get pods --watch --no-headers "
+        "-o=custom-columns=NAME:.metadata.name,STATUS:.status.phase | "
+        'while IFS= read -r line; do echo "$EPOCHREALTIME $line"; done',
+    ]
+
+    start = None
+    events = []
+    phases = {}
+    ready = 0
+
+    # The apiserver may close a watch after a while, in that case watch again
+    while ready < worker_apps:
+        logging.debug("Start subprocess: %s", command)
+        # pylint: disable=consider-using-with
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+        )
+        # pylint: enable=consider-using-with
+
+        lines = 0
+        for line in process.stdout:
+            # Custom prints in kubectl
+            if "[CONTINUUM]" in line:
+                continue
+
+            lines += 1
+            fields = line.split()
+            try:
+                t = float(fields[0])
+            except (ValueError, IndexError):
+                process.kill()
+                logging.error("Could not watch pods: %s", line)
+                sys.exit()
+
+            if lines == 1:
+                if start is None:
+                    start = t
+
+                continue
+
+            pod = fields[1]
+            phase = fields[-1]
+            if phase in ["Failed", "Unknown", "ErrImageNeverPull"]:
+                process.kill()
+                logging.error(
+                    'Container on cloud/edge %s has status %s, expected "Pending" or "Running"',
+                    pod,
+                    phase,
+                )
+                sys.exit()
+
+            # A pod may be modified without changing phase, and a new watch lists all pods again
+            previous = phases.get(pod)
+            if phase == previous or phase not in STATUSES:
+                continue
+
+            ready += int(phase in ["Running", "Succeeded"])
+            ready -= int(previous in ["Running", "Succeeded"])
+            phases[pod] = phase
+            events.append((t, pod, phase))
+
+            # Stop if all statuses are running or succeeded
+            if ready == worker_apps:
+                break
+
+        process.terminate()
+        process.wait()
+
+        if lines == 0:
+            logging.error("Could not watch pods: watch exited without output")
+            sys.exit()
+
+    return start, events
+
+
+def status_timeline(start, events, worker_apps):
+    """Derive the number of pods per status over time from the phase changes of all pods.
+    There is an entry every STATUS_INTERVAL seconds, and one on every phase change.
+
+    Possible status:
+    - Pending
+    - Running
+    - Succeeded
+    - ContainerCreating
+    - Arriving (not yet shown up in kubectl)
+
+    Args:
+        start (float): Start time of the watch
+        events (list(tuple(float, str, str))): Phase changes, see watch_pods()
+        worker_apps (int): Number of pods deployed
+
+    Returns:
+        (list(dict)): Status of all pods over time
+    """
+    counts = {status: 0 for status in STATUSES}
+    phases = {}
+    status = []
+
+    def add(t):
+        status_entry = {"time_orig": t, "time": t, "Arriving": worker_apps - sum(counts.values())}
+        status_entry.update(counts)
+        status.append(status_entry)
+
+    next_t = start
+    for t, pod, phase in events:
+        while next_t < t:
+            add(next_t)
+            next_t += STATUS_INTERVAL
+
+        if pod in phases:
+            counts[phases[pod]] -= 1
+
+        phases[pod] = phase
+        counts[phase] += 1
+        add(t)
+
+    return status
+
+
+def wait_worker_ready(config, _machines, get_starttime):
     """Wait for the Kubernetes pods to be running
 
     Args:
@@ -362,85 +524,8 @@ def wait_worker_ready(config, machines, get_starttime):
                 * config["benchmark"]["applications_per_worker"]
             )
 
-    status = []
-    while True:
-        # Get the list of all pods
-        command = (
-            "\"date +'%s.%N'; kubectl get pods "
-            + '-o=custom-columns=NAME:.metadata.name,STATUS:.status.phase --sort-by=.spec.nodeName"'
-        )
-        output, error = machines[0].process(
-            config, command, shell=True, ssh=config["cloud_ssh"][0]
-        )[0]
-
-        start_t = float(output[0])
-        output = output[1:]
-
-        # No pods are yet shown in the 'kubectl get pods' command
-        if error and any("couldn't find any field with path" in line for line in error):
-            continue
-
-        # Real crash
-        if (error and not all("[CONTINUUM]" in l for l in error)) or not output:
-            logging.error("".join(error))
-            sys.exit()
-
-        # Loop over all pods, check status, and create a list of all current statuses
-        # Possible status:
-        # - Pending
-        # - Running
-        # - Succeeded
-        # - Failed
-        # - Unknown
-        # - ContainerCreating
-        # - Arriving (not yet shown up in kubectl)
-        status_entry = {
-            "time_orig": start_t,
-            "time": start_t,
-            "Arriving": 0,
-            "Pending": 0,
-            "ContainerCreating": 0,
-            "Running": 0,
-            "Succeeded": 0,
-        }
-
-        # The first couple of lines may have custom prints
-        offset = 0
-        for offset, o in enumerate(output):
-            if "NAME" in o and "STATUS" in o:
-                break
-
-        for line in output[1 + offset :]:
-            # Some custom output may appear afterwards - ignore
-            if "CONTINUUM" in line:
-                break
-
-            l = line.rstrip().split(" ")
-            app_name = l[0]
-            app_status = l[-1]
-
-            if app_status in ["Failed", "Unknown", "ErrImageNeverPull"]:
-                logging.error(
-                    'Container on cloud/edge %s has status %s, expected "Pending" or "Running"',
-                    app_name,
-                    app_status,
-                )
-                sys.exit()
-
-            status_entry[app_status] += 1
-
-        pods_in_system = (
-            status_entry["Pending"]
-            + status_entry["Running"]
-            + status_entry["Succeeded"]
-            + status_entry["ContainerCreating"]
-        )
-        status_entry["Arriving"] = worker_apps - pods_in_system
-        status.append(status_entry)
-
-        # Stop if all statuses are running or succeeded
-        if status_entry["Running"] + status_entry["Succeeded"] == worker_apps:
-            break
+    start, events = watch_pods(config, worker_apps)
+    status = status_timeline(start, events, worker_apps)
 
     if get_starttime:
         # Normalize time
@@ -917,13 +1002,18 @@ def wait_worker_completion(config, machines):
             sys.exit()
 
 
-def get_worker_output(config, machines, container_names=None, get_description=False):
+def get_worker_output(
+    config, machines, container_names=None, get_description=False, since_time=None
+):
     """Select the correct function to start the worker application
 
     Args:
         config (dict): Parsed configuration
         machines (list(Machine object)): List of machine objects representing physical machines
         container_names (list(list(str))): Names of docker containers launched per machine
+        get_description (bool, optional): Get pod descriptions instead. Defaults to False.
+        since_time (float, optional): Only get log lines from this timestamp on (Kubernetes
+            only). Defaults to None.
 
     Returns:
         list(list(str)): Output of each container ran on the cloud / edge
@@ -932,19 +1022,53 @@ def get_worker_output(config, machines, container_names=None, get_description=Fa
     if config["benchmark"]["resource_manager"] in ["mist", "baremetal"]:
         return get_worker_output_mist(config, machines, container_names)
 
-    return get_worker_output_kube(config, machines, get_description)
+    return get_worker_output_kube(config, machines, get_description, since_time)
 
 
-def get_worker_output_kube(config, machines, get_description):
-    """Get the output of worker cloud / edge applications
+def fetch_pod_outputs(config, machines, commands):
+    """Execute kubectl commands on the cloud controller concurrently, with bounded parallelism.
+    Every command gets its own SSH connection, so at most LOG_FETCH_PARALLEL run at once to
+    stay below the MaxStartups limit of sshd.
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+        commands (dict(str, list(str))): Command per pod / container
+
+    Returns:
+        dict(str, list(str)): Output per pod / container
+    """
+    keys = list(commands)
+    outputs = {}
+    for i in range(0, len(keys), LOG_FETCH_PARALLEL):
+        batch = keys[i : i + LOG_FETCH_PARALLEL]
+        results = machines[0].process(
+            config, [commands[key] for key in batch], ssh=config["cloud_ssh"][0]
+        )
+
+        for key, (output, error) in zip(batch, results):
+            if error and not all("[CONTINUUM]" in l for l in error):
+                logging.error("Pod/container %s: %s", key, "".join(error))
+                sys.exit()
+
+            outputs[key] = [line.rstrip() for line in output]
+
+    return outputs
+
+
+def get_worker_output_kube(config, machines, get_description, since_time=None):
+    """Get the output of worker cloud / edge applications.
+    Logs are fetched concurrently per pod / container, see fetch_pod_outputs().
 
     Args:
         config (dict): Parsed configuration
         machines (list(Machine object)): List of machine objects representing physical machines
         get_description (bool): Also output an extensive description of all pod properties
+        since_time (float, optional): Only get log lines from this timestamp on. Defaults to None.
 
     Returns:
-        list(list(str)): Output of each container ran on the cloud / edge
+        list(list(str)): Output of each container ran on the cloud / edge.
+            Without get_description, a list of [pod / container name, output] pairs.
     """
     logging.info("Gather output from subscribers")
 
@@ -968,8 +1092,31 @@ def get_worker_output_kube(config, machines, get_description):
         if "NAME" in o and "STATUS" in o:
             break
 
-    # Gather commands to get logs
-    commands = []
+    # Check if there is only 1 container per pod or multiple - requires different approach
+    # We treat every container as an entity - no matter if there are multiple in a pod
+    sub_pods_mode = False
+    sub_pods = 1
+    if (
+        "kube_deployment" in config["benchmark"]
+        and config["benchmark"]["kube_deployment"] == "container"
+    ):
+        # This deployment has all containers in 1 pod
+        # This requires special parsing
+        # There is only 1 line in "kubectl get pods", but you can get sub-output anyway
+
+        # Assume cloud mode
+        sub_pods_mode = True
+        sub_pods = (config["infrastructure"]["cloud_nodes"] - 1) * config["benchmark"][
+            "applications_per_worker"
+        ]
+
+    log_command = ["kubectl", "logs", "--timestamps=true"]
+    if since_time is not None:
+        since = datetime.fromtimestamp(since_time - LOG_SINCE_MARGIN, timezone.utc)
+        log_command.append("--since-time=%s" % (since.strftime("%Y-%m-%dT%H:%M:%SZ")))
+
+    # Gather commands to get logs, keyed by pod (description) or pod + container (logs)
+    commands = {}
     pods = []
     for line in output[1 + offset :]:
         # Some custom output may appear afterwards - ignore
@@ -977,86 +1124,32 @@ def get_worker_output_kube(config, machines, get_description):
             break
 
         pod = line.split(" ")[0]
+        pods.append(pod)
 
-        # Check if there is only 1 container per pod or multiple - requires different approach
-        # We treat every container as an entity - no matter if there are multiple in a pod
-        sub_pods_mode = False
-        sub_pods = 1
-        if (
-            "kube_deployment" in config["benchmark"]
-            and config["benchmark"]["kube_deployment"] == "container"
-        ):
-            # This deployment has all containers in 1 pod
-            # This requires special parsing
-            # There is only 1 line in "kubectl get pods", but you can get sub-output anyway
-
-            # Assume cloud mode
-            sub_pods_mode = True
-            sub_pods = (config["infrastructure"]["cloud_nodes"] - 1) * config["benchmark"][
-                "applications_per_worker"
-            ]
-
-        # Loop through every sub-container in the single pod
         if get_description:
             # Will be identical between containers - per pod level
-            command = ["kubectl", "get", "pod", pod, "-o", "yaml"]
-            for _ in range(sub_pods):
-                commands.append(command)
-                pods.append(pod)
-        else:
-            for i in range(1, sub_pods + 1):
+            commands[pod] = ["kubectl", "get", "pod", pod, "-o", "yaml"]
+            continue
+
+        # Loop through every sub-container in the single pod
+        for i in range(1, sub_pods + 1):
+            if sub_pods_mode:
                 # Sub-pods-mode requires the name of the container to be appended
-                if sub_pods_mode:
-                    container = pod + " empty-%i" % (i)
-                else:
-                    container = pod
-
-                command = ["kubectl", "logs", "--timestamps=true", container]
-                commands.append(command)
-                pods.append(container)
-
-    # Append commands into 1 big command
-    big_command = '"'
-    for command in commands:
-        com = " ".join(command) + ";"
-        big_command += com
-        big_command += 'echo "DELIMITER01234";'
-
-    big_command += '"'
-
-    # Get the logs
-    output, error = machines[0].process(
-        config, big_command, ssh=config["cloud_ssh"][0], shell=True
-    )[0]
-
-    # Check error
-    if (error and not all("[CONTINUUM]" in l for l in error)) or not output:
-        logging.error("Container %i: %s", i, "".join(error))
-        sys.exit()
+                container = "empty-%i" % (i)
+                commands["%s %s" % (pod, container)] = log_command + [pod, container]
+            else:
+                commands[pod] = log_command + [pod]
 
-    logging.debug("Assign output to correct pod/container")
+    if not commands:
+        logging.error("No pods found to get output from")
+        sys.exit()
 
-    # Split based on custom delimiter, and group output per pod
-    worker_output = []
-    entry = []
-    i = 0
-    for line in output:
-        line = line.rstrip()
-        if "DELIMITER01234" in line:
-            if get_description:
-                e = entry
-            else:
-                # For worker output, you need to know to what pod it is related
-                # We dont/cant distinct between containers, but assume correct ordering
-                e = [pods[i], entry]
-                i += 1
+    outputs = fetch_pod_outputs(config, machines, commands)
 
-            worker_output.append(e)
-            entry = []
-        else:
-            entry.append(line)
+    if get_description:
+        return [outputs[pod] for pod in pods for _ in range(sub_pods)]
 
-    return worker_output
+    return [[key, outputs[key]] for key in commands]
 
 
 def get_worker_output_mist(config, machines, container_names):
@@ -1114,102 +1207,80 @@ def get_control_output(config, machines, starttime, status):
     Returns:
         dict: Parsed output from control plane components
     """
+    # Only needed for output processing, don't slow down startup
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
     logging.info("Collect and parse output from Kubernetes controlplane components")
 
-    # Save custom output in file so you can read it later if needed
+    # Save custom output in file so you can read it later if needed, save pods output as it may
+    # get overwritten later on, and get the custom output back. One command per node, concurrently
+    # grep fails if a node has no custom output, the backup and cat should run anyway
     # For control plane
-    command = """\"cd /var/log && \
-        sudo su -c \\\"grep -ri --exclude continuum.txt '\[continuum\]' > continuum.txt\\\"\""""
-    results = machines[0].process(config, command, shell=True, ssh=config["cloud_ssh"][0])
+    commands = [
+        """\"cd /var/log && \
+        sudo su -c \\\"grep -ri --exclude continuum.txt '\[continuum\]' > continuum.txt\\\"; \
+        sudo cp -r pods pods-continuum && sudo cat continuum.txt\""""
+    ]
 
     # For worker nodes
-    if len(config["cloud_ssh"]) > 1:
-        command = """\"sudo su -c \\\"journalctl -u kubelet | \
-            grep -i '\[continuum\]' > /var/log/continuum.txt\\\"\""""
-        results += machines[0].process(config, command, shell=True, ssh=config["cloud_ssh"][1:])
-
-    for _, error in results:
-        if error:
-            logging.error("".join(error))
-            sys.exit()
+    for _ in config["cloud_ssh"][1:]:
+        commands.append(
+            """\"sudo su -c \\\"journalctl -u kubelet | \
+            grep -i '\[continuum\]' > /var/log/continuum.txt\\\"; \
+            cd /var/log && sudo cp -r pods pods-continuum && sudo cat continuum.txt\""""
+        )
 
-    # Save pods output - it may get overwritten later on
-    command = """\"cd /var/log && \
-        sudo cp -r pods pods-continuum\""""
-    results = machines[0].process(config, command, shell=True, ssh=config["cloud_ssh"])
+    results = machines[0].process(config, commands, shell=True, ssh=config["cloud_ssh"])
 
     for _, error in results:
         if error:
             logging.error("".join(error))
             sys.exit()
 
-    # Get output from each cloud node
-    outputs = []
-    for ssh in zip(config["cloud_ssh"]):
-        command = ["sudo", "cat", "/var/log/continuum.txt"]
-        output, error = machines[0].process(config, command, ssh=ssh)[0]
-
-        if error:
-            logging.error("".join(error))
-            sys.exit()
-
-        outputs.append(output)
-
     # Parse output, filter per component, get timestamp and custom output
-    components = ["kubelet", "scheduler", "apiserver", "proxy", "controller-manager"]
+    endtime = status[-1]["time_orig"]
     parsed = {}
 
-    for ssh, output in zip(config["cloud_ssh"], outputs):
+    for ssh, (output, _) in zip(config["cloud_ssh"], results):
         name = ssh.split("@")[0]
-        parsed[name] = {}
 
+        # Timestamps (in ns) and custom output per component, in order of appearance
+        times = {}
+        lines = {}
         for line in output:
             line = line.strip()
+            match = CONTROL_LINE.match(line)
+            if match is None:
+                logging.debug("Couldn't properly parse line: %s", line)
+                continue
 
-            # Split per Kubernetes controlplane component
-            comp = ""
-            for c in components:
-                if c in line:
-                    comp = c
-                    break
-
+            # The first groups are the components, only the first in COMPONENTS in the line is set
+            comp = next((c for i, c in enumerate(COMPONENTS) if match.group(i + 1)), "")
             if comp == "":
                 logging.debug("[WARNING] No component in line: %s", line)
                 continue
 
-            if comp not in parsed[name]:
-                parsed[name][comp] = []
-
-            time_obj, line = parse_custom_kubernetes_splits(line)
-            if time_obj is False:
-                logging.debug("Couldn't properly parse line: %s", line)
-                continue
+            times.setdefault(comp, []).append(match.group(len(COMPONENTS) + 1))
+            lines.setdefault(comp, []).append(match.group(len(COMPONENTS) + 2))
 
-            parsed[name][comp].append([time_obj, line])
+        parsed[name] = {}
+        for comp, time_strs in times.items():
+            # Starttime and endtime are both in 192031029309.1230910293 format
+            t = np.array(time_strs, dtype=np.float64) / 10**9
 
-    # Now filter out everything before starttime and after endtime
-    # Starttime and endtime are both in 192031029309.1230910293 format
-    endtime = status[-1]["time_orig"]
-    parsed_copy = {}
-    for node, output in parsed.items():
-        parsed_copy[node] = {}
-        for component, out in output.items():
-            parsed_copy[node][component] = []
-            for entry in out:
-                # There may be time zone differences between timestamps
-                # We assume no 2 prints differ by more than 1 hour
-                seconds_per_hour = float(3600)
-                while entry[0] - starttime < seconds_per_hour:
-                    entry[0] += seconds_per_hour
+            # There may be time zone differences between timestamps
+            # We assume no 2 prints differ by more than 1 hour: shift into (start, start + 1h]
+            seconds_per_hour = float(3600)
+            t -= (np.ceil((t - starttime) / seconds_per_hour) - 1) * seconds_per_hour
 
-                while entry[0] - starttime > seconds_per_hour:
-                    entry[0] -= seconds_per_hour
+            # Now filter out everything before starttime and after endtime, and sort on time
+            keep = np.flatnonzero((t >= starttime) & (t <= endtime))
+            keep = keep[np.argsort(t[keep], kind="stable")]
 
-                # Now check for time interval
-                if entry[0] >= starttime and entry[0] <= endtime:
-                    parsed_copy[node][component].append(entry)
+            t = t.tolist()
+            parsed[name][comp] = [[t[i], lines[comp][i]] for i in keep.tolist()]
 
-    return parsed_copy, endtime
+    return parsed, endtime
 
 
 def parse_custom_kubernetes_splits(line):
@@ -1276,7 +1347,7 @@ def start_resource_metrics(config, machines):
 
 
 def get_resource_output(config, machines, starttime, endtime):
-    """Get the resource usage data from .csv files from VMs and parse it
+    """Get the resource usage data from the VMs and parse it
 
     Args:
         config (dict): Parsed configuration
@@ -1289,46 +1360,108 @@ def get_resource_output(config, machines, starttime, endtime):
     """
     logging.info("Fetch the resource utilization data from the controlplane VM")
 
-    # Move the csv file from the VM to the host
-    command = [
-        "ansible-playbook",
-        "-i",
-        os.path.join(config["infrastructure"]["base_path"], ".continuum/inventory_vms"),
-        os.path.join(
-            config["infrastructure"]["base_path"],
-            ".continuum/cloud/resource_usage_back.yml",
-        ),
-    ]
+    fetch_resource_chunks(config, machines, starttime, endtime)
 
-    output, error = machines[0].process(config, command)[0]
+    df1 = filter_metrics_kube(config, starttime, endtime)
+    df2 = filter_metrics_os(config, starttime, endtime)
 
-    logging.debug("Check output for Ansible command [%s]", " ".join(command))
-    ansible.check_output((output, error))
+    return df1, df2
 
-    # Same, but for OS metrics
-    command = [
-        "ansible-playbook",
-        "-i",
-        os.path.join(config["infrastructure"]["base_path"], ".continuum/inventory_vms"),
-        os.path.join(
-            config["infrastructure"]["base_path"],
-            ".continuum/cloud/resource_usage_os_back.yml",
-        ),
+
+def fetch_resource_chunks(config, machines, starttime, endtime):
+    """Move the resource usage chunks that overlap with the benchmark from the VMs to the host.
+    The resource usage scripts write compressed chunks with an index, see chunks.py in the cloud
+    directory of the resource manager. Each VM selects the chunks in the time range of the
+    benchmark from its index, and streams them as a tar archive over SSH. All VMs at once.
+
+    Args:
+        config (dict): Parsed configuration
+        machines (list(Machine object)): List of machine objects representing physical machines
+        starttime (datetime): Invocation time of kubectl apply command that launches the benchmark
+        endtime (datetime): Time at which the final application is deployed
+    """
+    # Take 1.0 second more on both ends, like filter_metrics_kube() and filter_metrics_os()
+    first = int((starttime - 1.0) * 10**9)
+    last = int((endtime + 1.0) * 10**9)
+
+    # Kubernetes metrics from the controller, OS metrics from all cloud VMs
+    sshs = [config["cloud_ssh"][0]] + config["cloud_ssh"]
+    remotes = ["resource_usage"] + ["resource_usage_os"] * len(config["cloud_ssh"])
+    paths = [resource_path(config)] + [
+        resource_path(config, ssh.split("@")[0]) for ssh in config["cloud_ssh"]
     ]
 
-    output, error = machines[0].process(config, command)[0]
+    commands = []
+    for remote, path in zip(remotes, paths):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+        os.makedirs(path)
+
+        # Copy current.csv before reading the index, and only its complete lines. If the chunk is
+        # compressed after the copy, its rows are in both and the duplicates are dropped in
+        # read_chunks(). If it's compressed before the copy, it's already in the index.
+        # Chunks are hard linked next to the copy, so the archive holds exactly these files
+        commands.append(
+            "\"cd %s && rm -rf .fetch && mkdir .fetch && "
+            "{ if cat current.csv > .fetch/raw 2> /dev/null; then "
+            "head -n \\$(wc -l < .fetch/raw) .fetch/raw > .fetch/current.csv; fi; "
+            "rm -f .fetch/raw; } && "
+            "awk -F, 'NR > 1 && \\$2 <= %i && \\$3 >= %i {print \\$1}' index.csv "
+            "| xargs -r ln -t .fetch && tar -C .fetch -cf - . && rm -rf .fetch\" "
+            "| tar -xf - -C %s" % (remote, last, first, path)
+        )
 
-    logging.debug("Check output for Ansible command [%s]", " ".join(command))
-    ansible.check_output((output, error))
+    results = machines[0].process(config, commands, shell=True, ssh=sshs)
 
-    df1 = filter_metrics_kube(config, starttime, endtime)
-    df2 = filter_metrics_os(config, starttime, endtime)
+    for ssh, (_, error) in zip(sshs, results):
+        if error:
+            logging.error("Could not fetch resource usage from %s: %s", ssh, "".join(error))
+            sys.exit()
 
-    return df1, df2
+
+def resource_path(config, vm_name=None):
+    """Local directory for resource usage chunks
+
+    Args:
+        config (dict): Parsed configuration
+        vm_name (str, optional): VM for OS metrics. Defaults to None (Kubernetes metrics).
+
+    Returns:
+        str: Path to the directory
+    """
+    name = "resource_usage"
+    if vm_name is not None:
+        name = "resource_usage_os-%s" % (vm_name)
+
+    return os.path.join(config["infrastructure"]["base_path"], ".continuum", name)
+
+
+def read_chunks(path):
+    """Read all resource usage chunks in a directory into one dataframe
+
+    Args:
+        path (str): Directory with chunks, see fetch_resource_chunks()
+
+    Returns:
+        (dataframe): Pandas dataframe with all rows, ordered on timestamp
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    files = sorted(f for f in os.listdir(path) if f.endswith(".csv.gz") or f == "current.csv")
+    if not files:
+        logging.error("No resource usage data found in %s", path)
+        sys.exit()
+
+    df = pd.concat([pd.read_csv(os.path.join(path, f)) for f in files], ignore_index=True)
+    return df.drop_duplicates("timestamp").sort_values("timestamp", ignore_index=True)
 
 
 def filter_metrics_kube(config, starttime, endtime):
-    """Filter the metrics gathered via kubectl top
+    """Filter the metrics gathered via kubectl top.
+    Node usage is measured from /proc on every node by resource_usage_os.py, as the
+    metrics-server only refreshes it every 15 seconds. It is joined on the nearest timestamp,
+    which is the same instant as both scripts sample on the same interval grid.
 
     Args:
         config (dict): Parsed configuration
@@ -1338,13 +1471,28 @@ def filter_metrics_kube(config, starttime, endtime):
     Returns:
         (dataframe): Pandas dataframe with resource utilization metrics during our benchmrak deploym
     """
+    # Only needed for output processing, don't slow down startup
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
     logging.debug("Filter kube metric stats")
 
-    # Now read the file via pandas and:
+    # Now read the chunks via pandas and:
     # - Only take the timestamps between the start and end of the benchmark
     # - Offset these values compared to the start time of the benchmark (so row 1 starts near 0.0s)
-    path = os.path.join(config["infrastructure"]["base_path"], ".continuum/resource_usage.csv")
-    df = pd.read_csv(path)
+    df = read_chunks(resource_path(config))
+
+    # Add the CPU and memory column of each node first, like kubectl top nodes orders them
+    nodes = []
+    for vm_name in sorted(ssh.split("@")[0] for ssh in config["cloud_ssh"]):
+        node = vm_name.replace("_", "")
+        df_node = read_chunks(resource_path(config, vm_name))
+        df_node = df_node[["timestamp", "cpu-used (millicpu)", "memory-used (Mi)"]].rename(
+            columns={"cpu-used (millicpu)": node + "_cpu", "memory-used (Mi)": node + "_memory"}
+        )
+        df = pd.merge_asof(df, df_node, on="timestamp", direction="nearest", tolerance=10**9)
+        nodes += [node + "_cpu", node + "_memory"]
+
+    df = df[["timestamp"] + nodes + [c for c in df.columns if c != "timestamp" and c not in nodes]]
     df["timestamp"] = df["timestamp"] / 10**9
 
     # Disable warning generated by the lines below
@@ -1369,15 +1517,16 @@ def filter_metrics_os(config, starttime, endtime):
     Returns:
         (dataframe): Pandas dataframe with resource utilization metrics during our benchmrak deploym
     """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
     logging.debug("Filter os metric stats")
 
     # Gather all data from each VM first
     dfs = []
     for vm_name in [vm_name.split("@")[0] for vm_name in config["cloud_ssh"]]:
-        path = os.path.join(
-            config["infrastructure"]["base_path"], ".continuum/resource_usage_os-%s.csv" % (vm_name)
-        )
-        df = pd.read_csv(path)
+        # The absolute columns are used for the node usage in filter_metrics_kube()
+        df = read_chunks(resource_path(config, vm_name))
+        df = df[["timestamp", "cpu-used (%)", "memory-used (%)"]]
         df["timestamp"] = df["timestamp"] / 10**9
 
         df_filtered = df.loc[
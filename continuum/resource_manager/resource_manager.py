@@ -2,6 +2,10 @@
 Select the correct resource manager, install required software and set them up.
 """
 
+import logging
+
+from infrastructure import infrastructure
+
 from .endpoint import endpoint
 
 
@@ -12,6 +16,11 @@ def start(config, machines):
         config (dict): Parsed configuration
         machines (list(Machine object)): List of machine objects representing physical machines
     """
+    # VMs restored from a snapshot already have all software installed and running
+    if config["snapshot_restored"]:
+        logging.info("Restored a pre-warmed cluster, skip resource manager setup")
+        return
+
     # Install software on cloud/edge nodes
     if config["module"]["resource_manager"]:
         config["module"]["resource_manager"].start(config, machines)
@@ -21,6 +30,10 @@ def start(config, machines):
     if config["infrastructure"]["endpoint_nodes"] and not config["infrastructure"]["infra_only"]:
         endpoint.start(config, machines)
 
+    # Save the cluster now, unless worker images still have to be cached by the application
+    if not ("cache_worker" in config["benchmark"] and config["benchmark"]["cache_worker"]):
+        infrastructure.save_snapshot(config, machines)
+
 
 def add_options(config):
     """[INTERFACE] Add config options for a particular module
@@ -3,36 +3,64 @@ import numpy as np
 import os.path
 
 
-def read_vals_file(metadata_file, metrics_file, absolute=False):
+def energy_delta(prev, curr, max_range):
+    # RAPL counters wrap at max_energy_range_uj, unknown for captures made before it was recorded
+    if curr < prev and max_range is not None:
+        return curr + max_range - prev
+    return curr - prev
+
+
+def parse_vm_line(line):
+    # name energy_intel-rapl:0 usr_time sys_time [zone=energy ...]
+    fields = line.split()
+    name, energy, usr_cpu, sys_cpu = fields[:4]
+    zones = {zone: int(value) for zone, value in (field.split('=') for field in fields[4:])}
+    if not zones:
+        zones = {'intel-rapl:0': int(energy)}
+    return name, zones, int(usr_cpu), int(sys_cpu)
+
+
+def read_vals_file(metadata_file, metrics_file, absolute=False, zones=False):
+    """Read a capture of save_synced_resource_usage.
+
+    The energy of a VM is the sum over all RAPL packages (intel-rapl:N), so multi-socket hosts are
+    fully attributed. With zones=True, the energy deltas per zone (including sub-domains such as
+    intel-rapl:0:0 for core) are returned as well, as a dict per VM.
+    """
     with open(metadata_file, 'r') as metadata:
         metadata_lines = metadata.readlines()
-        scaph_offset = metadata_lines[2].split()[0] == "Scaphandre"
+        # Optional line with the start time of Scaphandre, or of the energy collector replacing it
+        scaph_offset = metadata_lines[2].split()[0] in ["Scaphandre", "Collector"]
         benchmark_duration = float(metadata_lines[2 + scaph_offset].split()[-1])
         vms = int(metadata_lines[3 + scaph_offset].split()[-1])
         vms_experiment = int(metadata_lines[4 + scaph_offset].split()[-1])
     with open(metrics_file, 'r') as measurements:
-        start_time, start_total_cpu = measurements.readline().split()
+        line = measurements.readline()
+        max_ranges = {}
+        if line.startswith('#'):
+            max_ranges = {zone: int(value) for zone, value in (field.split('=') for field in line.split()[2:])}
+            line = measurements.readline()
+
+        start_time, start_total_cpu = line.split()
         prev_total_cpu = [int(start_total_cpu)] * vms_experiment
         prev_time = [float(start_time)] * vms_experiment
         
         names = {}
         vm_measurements = []
-        
+        zone_measurements = []
 
         prev_energy = []
         prev_usr_cpu = []
         prev_sys_cpu = []
         for i in range(vms_experiment):
-            name, energy, usr_cpu, sys_cpu = measurements.readline().split()
+            name, energy, usr_cpu, sys_cpu = parse_vm_line(measurements.readline())
             names[name] = i
-            energy = int(energy)
-            usr_cpu = int(usr_cpu)
-            sys_cpu = int(sys_cpu)
             prev_energy.append(energy)
             prev_usr_cpu.append(usr_cpu)
             prev_sys_cpu.append(sys_cpu)
             
             vm_measurements.append(([0], [0], [0], [0], [0]))
+            zone_measurements.append({zone: [0] for zone in energy})
         
         # Skip empty line
         measurements.readline()
@@ -43,26 +71,27 @@ def read_vals_file(metadata_file, metrics_file, absolute=False):
             curr_time = float(curr_time)
             curr_total_cpu = int(curr_total_cpu)
             measurement_line = measurements.readline()
-            name, energy, usr_cpu, sys_cpu = measurement_line.split()
-            curr_energy = int(energy)
-            curr_usr_cpu = int(usr_cpu)
-            curr_sys_cpu = int(sys_cpu)
+            name, curr_energy, curr_usr_cpu, curr_sys_cpu = parse_vm_line(measurement_line)
 
             i = names[name]
 
+            zone_deltas = {zone: energy_delta(prev_energy[i][zone], curr_energy[zone], max_ranges.get(zone))
+                           for zone in curr_energy}
+            energy_change = sum(delta for zone, delta in zone_deltas.items() if zone.count(':') == 1)
+
             delta_time = curr_time - prev_time[i]
             if absolute:
                 delta_total_cpu = curr_total_cpu
-                delta_energy = curr_energy
+                delta_energy = sum(energy for zone, energy in curr_energy.items() if zone.count(':') == 1)
                 delta_usr_cpu = curr_usr_cpu
                 delta_sys_cpu = curr_sys_cpu
             else:
                 delta_total_cpu = curr_total_cpu - prev_total_cpu[i]
-                delta_energy = curr_energy - prev_energy[i]
+                delta_energy = energy_change
                 delta_usr_cpu = curr_usr_cpu - prev_usr_cpu[i]
                 delta_sys_cpu = curr_sys_cpu - prev_sys_cpu[i]
             
-            if curr_energy - prev_energy[i] != 0:
+            if energy_change != 0:
                 time_deltas, total_cpu_deltas, energy_deltas, usr_cpu_deltas, sys_cpu_deltas = vm_measurements[i]
 
                 time_deltas.append(time_deltas[-1] + delta_time)
@@ -71,6 +100,9 @@ def read_vals_file(metadata_file, metrics_file, absolute=False):
                 usr_cpu_deltas.append(delta_usr_cpu + delta_sys_cpu)
                 sys_cpu_deltas.append(delta_sys_cpu)
 
+                for zone, delta in zone_deltas.items():
+                    zone_measurements[i][zone].append(curr_energy[zone] if absolute else delta)
+
                 prev_time[i] = curr_time
                 prev_total_cpu[i] = curr_total_cpu
                 prev_energy[i] = curr_energy
@@ -80,6 +112,8 @@ def read_vals_file(metadata_file, metrics_file, absolute=False):
             measurements.readline()
             line = measurements.readline()
     
+    if zones:
+        return vm_measurements, benchmark_duration, vms, vms_experiment, zone_measurements
     return vm_measurements, benchmark_duration, vms, vms_experiment
 
 